@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for feature building, model inference, the /predict, /explain and /progress endpoints and the ETL.
+
+  python bench/run_benchmarks.py                              # full run, JSON to bench/results/
+  python bench/run_benchmarks.py --quick --suites feature,inference
+  python bench/run_benchmarks.py --compare bench/results/baseline.json --threshold 0.2
+
+Workloads are seeded (--seed), so runs are comparable. Every result records median,
+p95, mean and min latency per call (and throughput where it makes sense). With
+--compare, results are matched to the baseline by name + params and any median that
+got slower by more than --threshold is flagged; the process then exits with status 1.
+The feature suite also checks that the compiled FeatureLayout matches the dict builder
+and the ETL column for column; a mismatch fails the run the same way.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import datetime
+import importlib.util
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import workloads
+
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(BASE_DIR, "models"))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def measure(fn, number=1, repeat=20, warmup=1):
+    """Per-call latency samples of fn() in microseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t) / number * 1e6)
+    samples = np.asarray(samples)
+    return {
+        "median_us": float(np.median(samples)),
+        "p95_us": float(np.percentile(samples, 95)),
+        "mean_us": float(samples.mean()),
+        "min_us": float(samples.min()),
+        "repeat": repeat,
+        "number": number,
+    }
+
+def record(results, name, params, stats, rows=None):
+    entry = {"name": name, "params": params, **stats}
+    if rows:
+        entry["throughput_per_s"] = rows / (stats["median_us"] / 1e6)
+    results.append(entry)
+    print(f"{name:28s} {json.dumps(params):48s} median {stats['median_us']:12.1f} us   p95 {stats['p95_us']:12.1f} us")
+
+def bench_feature_builder(results, seed, quick):
+    from server.feature_builder import FeatureLayout, build_features_from_submission, build_feature_matrix
+    for n_topics in (3, 10, 30):
+        topics = workloads.topic_names(n_topics)
+        feature_cols = ["correct_count", "total_questions", "avg_time", "median_time", "time_std",
+                        "easy_acc", "medium_acc", "hard_acc"] + [f"topic_acc__{t}" for t in topics]
+        for n_questions in (10, 50, 200):
+            rng = np.random.default_rng(seed)
+            sub = workloads.make_submission(rng, n_questions, topics)
+            params = {"questions": n_questions, "topics": n_topics}
+            record(results, "feature_builder.single", params,
+                   measure(lambda: build_features_from_submission(sub, known_topics=topics), number=20, repeat=5 if quick else 30))
+            layout = FeatureLayout(feature_cols)
+            out = np.empty(layout.width)
+            record(results, "feature_builder.layout", params,
+                   measure(lambda: layout.fill(sub["responses"], out), number=20, repeat=5 if quick else 30))
+        subs = workloads.make_submissions(seed, 256, n_questions=20, n_topics=n_topics)
+        record(results, "feature_builder.matrix", {"rows": 256, "questions": 20, "topics": n_topics},
+               measure(lambda: build_feature_matrix(subs, feature_cols, known_topics=topics), repeat=5 if quick else 20), rows=256)
+
+def _same(a, b, tol=1e-9):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return a.shape == b.shape and bool(np.all((np.isnan(a) & np.isnan(b)) | (np.abs(a - b) <= tol)))
+
+def check_feature_parity(seed, tmp_dir, n_attempts=2000):
+    """
+    FeatureLayout.fill against the dict builder (ordered by feature_cols) and against
+    the ETL's training features for the same raw attempts. Returns the mismatches.
+    """
+    from server.feature_builder import FeatureLayout, build_features_from_submission
+    failures = []
+    topics = workloads.topic_names(6)
+    # the model knows all but the last topic, so unknown topics are exercised too
+    feature_cols = ["correct_count", "total_questions", "avg_time", "median_time", "time_std",
+                    "easy_acc", "medium_acc", "hard_acc"] + [f"topic_acc__{t}" for t in topics[:-1]] + ["hist_attempts"]
+    layout = FeatureLayout(feature_cols)
+
+    def expected(sub):
+        feats = build_features_from_submission(sub, known_topics=layout.known_topics)
+        return [np.nan if feats.get(c) is None else feats[c] for c in feature_cols]
+
+    subs = workloads.make_submissions(seed + 5, 500, n_questions=15, n_topics=6)
+    subs += [
+        {"user_id": "u1", "quiz_id": "q1", "responses": []},
+        {"user_id": "u1", "quiz_id": "q1", "responses": [{"is_correct": True, "time_taken": 0}]},
+        {"user_id": "u1", "quiz_id": "q1", "responses": [{"topic": "nope", "difficulty": "extreme", "is_correct": False,
+                                                          "time_taken": "4.5"}, {"topic": topics[0], "time_taken": 2}]},
+    ]
+    for i, sub in enumerate(subs):
+        if not _same(layout.fill(sub.get("responses", [])), expected(sub)):
+            failures.append(f"dict builder, submission {i}")
+
+    # training rows: the ETL over the same attempts written as a raw CSV
+    etl = _load_etl()
+    path = os.path.join(tmp_dir, "raw_parity.csv")
+    workloads.write_raw_attempts(path, seed + 6, n_attempts)
+    import pandas as pd
+    df_raw = pd.read_csv(path)
+    df_feat, _ = etl.build_features_columnar(df_raw)
+    train_cols = [c for c in feature_cols if c in df_feat.columns or c.startswith("topic_acc__")]
+    X_etl = df_feat.reindex(columns=train_cols).to_numpy(dtype=np.float64)
+    cols = [feature_cols.index(c) for c in train_cols]
+    for i, row in zip(df_feat.index, X_etl):
+        if not _same(layout.fill(json.loads(df_raw.at[i, "responses"]))[cols], row):
+            failures.append(f"ETL, attempt {i}")
+    os.remove(path)
+    return failures
+
+def bench_inference(results, seed, quick):
+    from server.model_registry import load_legacy_bundle
+    for engine in ("fused", "lightgbm"):
+        bundle = load_legacy_bundle(MODEL_DIR, use_fused=engine == "fused").warmup()
+        for n_rows in (1, 16, 64, 256, 1024):
+            X = workloads.make_feature_matrix(seed, n_rows, bundle.feature_cols)
+            number = 20 if n_rows <= 64 else 2
+            record(results, "inference.all_models", {"engine": engine, "rows": n_rows},
+                   measure(lambda: bundle.predict(X), number=number, repeat=5 if quick else 30), rows=n_rows)
+    # pred_contrib for every model (what /explain computes on a cache miss)
+    for n_rows in (1, 64, 1024):
+        X = workloads.make_feature_matrix(seed, n_rows, bundle.feature_cols)
+        record(results, "inference.explain", {"rows": n_rows},
+               measure(lambda: bundle.explain(X), number=10 if n_rows <= 64 else 1, repeat=5 if quick else 30),
+               rows=n_rows)
+
+def bench_drift(results, seed, quick):
+    # sketch update cost on the /predict hot path, against a baseline of the same shape as training's
+    from server.model_registry import load_legacy_bundle
+    from server.drift import DriftSketch, build_baseline, decode_outputs
+    bundle = load_legacy_bundle(MODEL_DIR, use_fused=False)
+    X_base = workloads.make_feature_matrix(seed, 5000, bundle.feature_cols)
+    baseline = build_baseline(X_base, bundle.feature_cols, decode_outputs(bundle.predict(X_base), bundle.weak_cols))
+    sketch = DriftSketch(bundle.version, bundle.feature_cols, bundle.weak_cols, baseline)
+    for n_rows in (1, 64):
+        X = workloads.make_feature_matrix(seed + 1, n_rows, bundle.feature_cols)
+        rows = [(50.0, "Intermediate", 0.5, ["spelling"])] * n_rows
+        record(results, "drift.observe", {"rows": n_rows},
+               measure(lambda: sketch.observe(X, rows), number=20, repeat=5 if quick else 30), rows=n_rows)
+
+class _NullTable:
+    def insert(self, rows):
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        return self
+
+    def execute(self):
+        return None
+
+class _NullSupabase:
+    def table(self, name):
+        return _NullTable()
+
+def bench_predict_endpoint(results, seed, quick, tmp_dir):
+    # stubbed Supabase, private history DB, caches off so every call does the full work
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    os.environ.setdefault("SUPABASE_KEY", "bench")
+    os.environ["USER_HISTORY_DB"] = os.path.join(tmp_dir, "user_history.sqlite")
+    os.environ["PROGRESS_DB"] = os.path.join(tmp_dir, "progress.sqlite")
+    os.environ["DRIFT_SNAPSHOT_DIR"] = os.path.join(tmp_dir, "drift")
+    os.environ["WRITE_SPILL_PATH"] = os.path.join(tmp_dir, "spill.jsonl")
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    from fastapi.testclient import TestClient
+    import server.app
+    app_module = sys.modules["server.app"]
+    app_module.result_writer.client = _NullSupabase()
+
+    from server.columnar import to_columnar
+
+    n = 50 if quick else 500
+    subs = iter(workloads.make_submissions(seed, n + 10, n_questions=20, n_topics=3))
+    batch = {"submissions": workloads.make_submissions(seed + 1, 64, n_questions=20, n_topics=3)}
+    with TestClient(app_module.app) as client:
+        record(results, "endpoint.predict", {"questions": 20},
+               measure(lambda: client.post("/predict", json=next(subs)), repeat=n, warmup=10))
+        record(results, "endpoint.predict_batch", {"rows": 64, "questions": 20},
+               measure(lambda: client.post("/predict/batch", json=batch), repeat=5 if quick else 30), rows=64)
+        explain_subs = iter(workloads.make_submissions(seed + 4, n + 10, n_questions=20, n_topics=3))
+        record(results, "endpoint.explain", {"questions": 20},
+               measure(lambda: client.post("/explain", json=next(explain_subs)), repeat=n, warmup=10))
+        record(results, "endpoint.explain_batch", {"rows": 64, "questions": 20},
+               measure(lambda: client.post("/explain/batch", json=batch), repeat=5 if quick else 30), rows=64)
+        # a whole class finishing at once: 64 concurrent /predict calls, micro-batched by the server
+        wave = workloads.make_submissions(seed + 3, 64, n_questions=20, n_topics=3)
+        with ThreadPoolExecutor(len(wave)) as pool:
+            record(results, "endpoint.predict_concurrent", {"clients": 64, "questions": 20},
+                   measure(lambda: list(pool.map(lambda sub: client.post("/predict", json=sub), wave)),
+                           repeat=5 if quick else 30), rows=64)
+        # long diagnostic quizzes, per-item vs columnar payload
+        for n_questions in (50, 500):
+            long_subs = workloads.make_submissions(seed + 2, n + 10, n_questions=n_questions, n_topics=6)
+            items, columnar = iter(long_subs), iter([to_columnar(s) for s in long_subs])
+            record(results, "endpoint.predict", {"questions": n_questions},
+                   measure(lambda: client.post("/predict", json=next(items)), repeat=n, warmup=10))
+            record(results, "endpoint.predict_columnar", {"questions": n_questions},
+                   measure(lambda: client.post("/predict/columnar", json=next(columnar)), repeat=n, warmup=10))
+        # progress reads should cost the same however long the learner's history is
+        for n_attempts in (10, 1000, 10000):
+            user_id, class_id = f"progress-{n_attempts}", f"class-{n_attempts}"
+            stored = [{"id": f"r{i}", "user_id": user_id, "quiz_id": f"q{i}", "quiz_score": float(i % 100),
+                       "skill_level": ("Beginner", "Intermediate", "Advanced")[i % 3], "weak_topics": ["spelling"],
+                       "confidence_score": 0.5, "taken_at": f"2025-11-{1 + i % 28:02d}T12:00:00Z"}
+                      for i in range(n_attempts)]
+            app_module.progress.update_many([{"class_id": class_id}] * n_attempts, stored)
+            params = {"attempts": n_attempts}
+            record(results, "endpoint.progress_learner", params,
+                   measure(lambda: client.get(f"/progress/learners/{user_id}"), repeat=n, warmup=5))
+            record(results, "endpoint.progress_class", params,
+                   measure(lambda: client.get(f"/progress/classes/{class_id}"), repeat=n, warmup=5))
+            # a page from the middle of the history
+            cursor = app_module.progress.history(user_id, n_attempts // 2)[1]
+            record(results, "endpoint.progress_history", params,
+                   measure(lambda: client.get(f"/progress/learners/{user_id}/history?limit=50&cursor={cursor}"),
+                           repeat=n, warmup=5))
+
+def _load_etl():
+    spec = importlib.util.spec_from_file_location("bench_etl_build_features", os.path.join(BASE_DIR, "etl", "build_features.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def bench_etl(results, seed, sizes, tmp_dir):
+    etl = _load_etl()
+    for n in sizes:
+        path = os.path.join(tmp_dir, f"raw_{n}.csv")
+        workloads.write_raw_attempts(path, seed, n)
+
+        def run():
+            rows = 0
+            for df_feat, _ in etl.iter_feature_chunks(path):
+                rows += len(df_feat)
+            return rows
+
+        record(results, "etl.build_features", {"attempts": n},
+               measure(run, repeat=1 if n >= 100000 else 3, warmup=0), rows=n)
+        os.remove(path)
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True).strip()
+    except Exception:
+        return None
+
+def compare(current, baseline, threshold):
+    base = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nComparison against baseline (threshold {threshold:.0%}):")
+    for r in current["results"]:
+        b = base.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if b is None:
+            continue
+        ratio = r["median_us"] / b["median_us"] if b["median_us"] else float("inf")
+        flag = "REGRESSION" if ratio > 1.0 + threshold else ""
+        print(f"  {r['name']:28s} {json.dumps(r['params']):48s} {ratio:6.2f}x {flag}")
+        if flag:
+            regressions.append({"name": r["name"], "params": r["params"], "ratio": ratio})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", default="feature,inference,predict,etl")
+    parser.add_argument("--etl-sizes", default="10000,100000,1000000")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--quick", action="store_true", help="fewer repeats and only the smallest ETL size")
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    suites = set(args.suites.split(","))
+    sizes = [int(s) for s in args.etl_sizes.split(",")]
+    if args.quick:
+        sizes = sizes[:1]
+    results = []
+    parity_failures = []
+    with tempfile.TemporaryDirectory(prefix="quiz-bench-") as tmp_dir:
+        if "feature" in suites:
+            parity_failures = check_feature_parity(args.seed, tmp_dir)
+            print(f"Feature layout parity: {len(parity_failures) or 'ok'}"
+                  f"{' mismatches, first: ' + parity_failures[0] if parity_failures else ''}")
+            bench_feature_builder(results, args.seed, args.quick)
+        if "inference" in suites:
+            bench_inference(results, args.seed, args.quick)
+            bench_drift(results, args.seed, args.quick)
+        if "predict" in suites:
+            bench_predict_endpoint(results, args.seed, args.quick, tmp_dir)
+        if "etl" in suites:
+            bench_etl(results, args.seed, sizes, tmp_dir)
+
+    import lightgbm
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "git_commit": _git_commit(),
+            "seed": args.seed,
+            "quick": args.quick,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "lightgbm": lightgbm.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if parity_failures:
+        report["parity_failures"] = parity_failures
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.threshold)
+
+    out = args.out or os.path.join(RESULTS_DIR, datetime.datetime.utcnow().strftime("bench-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {out}")
+    return 1 if report.get("regressions") or parity_failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
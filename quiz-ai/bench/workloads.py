@@ -0,0 +1,77 @@
+"""
+Seeded, reproducible workloads for the benchmark suite.
+
+Every generator takes a numpy Generator (or seed) so two runs of the suite see
+exactly the same submissions, feature matrices and raw ETL input.
+"""
+import json
+import numpy as np
+import pandas as pd
+
+DIFFICULTIES = np.array(["easy", "medium", "hard"])
+
+def topic_names(n_topics):
+    base = ["spelling", "grammar", "vocabulary", "phonics", "reading", "rhyming"]
+    return (base + [f"topic{i}" for i in range(len(base), n_topics)])[:n_topics]
+
+def make_submission(rng, n_questions, topics, user_id="u1", quiz_id="q1"):
+    topic_idx = rng.integers(0, len(topics), n_questions)
+    diff_idx = rng.integers(0, 3, n_questions)
+    correct = rng.random(n_questions) < 0.65
+    times = np.round(rng.gamma(2.0, 6.0, n_questions), 2)
+    return {
+        "user_id": user_id,
+        "quiz_id": quiz_id,
+        "responses": [
+            {
+                "question_id": f"q{j}",
+                "topic": topics[topic_idx[j]],
+                "difficulty": str(DIFFICULTIES[diff_idx[j]]),
+                "is_correct": bool(correct[j]),
+                "time_taken": float(times[j]),
+            }
+            for j in range(n_questions)
+        ],
+        "start_time": "2025-11-04T12:00:00Z",
+        "end_time": "2025-11-04T12:05:00Z",
+    }
+
+def make_submissions(seed, n, n_questions=10, n_topics=3):
+    rng = np.random.default_rng(seed)
+    topics = topic_names(n_topics)
+    return [make_submission(rng, n_questions, topics, user_id=f"u{i}", quiz_id=f"q{i % 10}") for i in range(n)]
+
+def make_feature_matrix(seed, n_rows, feature_cols, nan_rate=0.05):
+    """Plausible feature rows in feature_cols order (counts, times and accuracies)."""
+    rng = np.random.default_rng(seed)
+    X = np.empty((n_rows, len(feature_cols)))
+    total = rng.integers(5, 30, n_rows)
+    for j, c in enumerate(feature_cols):
+        if c == "total_questions":
+            X[:, j] = total
+        elif c == "correct_count":
+            X[:, j] = rng.binomial(total, 0.65)
+        elif c.endswith("_time") or c == "time_std":
+            X[:, j] = rng.gamma(2.0, 6.0, n_rows)
+        else:
+            X[:, j] = rng.random(n_rows)
+    X[rng.random(X.shape) < nan_rate] = np.nan
+    return X
+
+def write_raw_attempts(path, seed, n_attempts, n_topics=6, min_questions=5, max_questions=25, chunk=50000):
+    """Write a raw ETL input CSV (user_id, quiz_id, responses JSON, start/end time)."""
+    rng = np.random.default_rng(seed)
+    topics = topic_names(n_topics)
+    header = True
+    for start in range(0, n_attempts, chunk):
+        n = min(chunk, n_attempts - start)
+        lengths = rng.integers(min_questions, max_questions + 1, n)
+        rows = []
+        for i in range(n):
+            sub = make_submission(rng, int(lengths[i]), topics)
+            rows.append((f"u{(start + i) % 5000}", f"q{(start + i) % 50}", json.dumps(sub["responses"]),
+                         sub["start_time"], sub["end_time"]))
+        pd.DataFrame(rows, columns=["user_id", "quiz_id", "responses", "start_time", "end_time"]).to_csv(
+            path, index=False, mode="w" if header else "a", header=header)
+        header = False
+    return path
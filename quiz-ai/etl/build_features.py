@@ -16,19 +16,43 @@ Raw input format (one quiz attempt):
 
 This script supports two modes:
 - dev: load from a local CSV of raw events
-- prod: you can adapt to fetch from Supabase and produce same features
+- prod: etl/prod_source.py pulls only the attempts added since its last run from
+  Postgres and feeds them through the same columnar builder
+
+The raw CSV is processed in fixed-size chunks (ETL_CHUNK_SIZE rows) by a columnar
+engine: responses are exploded once into flat arrays and every aggregate is computed
+with grouped/vectorized operations. process_one_attempt is kept as the row-wise
+reference implementation the columnar output must match.
 """
 import os
+import sys
+import glob
 import json
 import pandas as pd
 import numpy as np
 from collections import defaultdict
 from typing import List, Dict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import feature_store
+
+# a single CSV or a glob of shards, e.g. "raw_quiz_responses/*.csv" (read in sorted order)
 INPUT_RAW_CSV = os.environ.get("RAW_INPUT_CSV", "raw_quiz_responses.csv")
 OUTPUT_FEATURE_CSV = os.environ.get("OUTPUT_FEATURE_CSV", "prepared_quiz_features.csv")
 # threshold for weak topic (used to create labels)
 WEAK_TOPIC_THRESHOLD = float(os.environ.get("WEAK_TOPIC_THRESHOLD", 0.7))
+# number of raw attempts held in memory at once
+CHUNK_SIZE = int(os.environ.get("ETL_CHUNK_SIZE", 50000))
+# optional comma-separated topic list; when set, output columns are fixed up front and
+# every chunk is appended to the output as soon as it is built
+ETL_TOPICS = [t for t in os.environ.get("ETL_TOPICS", "").split(",") if t]
+# when set, features are appended to this partitioned Parquet store instead of the CSV
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR")
+# feature rows buffered before an append to the store (one file per date per append)
+STORE_FLUSH_ROWS = int(os.environ.get("ETL_STORE_FLUSH_ROWS", 500000))
+
+BASE_COLS = ["user_id", "quiz_id", "quiz_score", "correct_count", "total_questions", "avg_time",
+             "median_time", "time_std", "easy_acc", "medium_acc", "hard_acc", "weak_topics_list"]
 
 def process_one_attempt(row):
     # row.responses expected as JSON string or python list
@@ -97,35 +121,219 @@ def process_one_attempt(row):
         out[k] = v
     return out
 
-def main():
-    df_raw = pd.read_csv(INPUT_RAW_CSV)
-    processed = []
-    for _, r in df_raw.iterrows():
-        rec = process_one_attempt(r.to_dict())
-        if rec:
-            processed.append(rec)
-    df_feat = pd.DataFrame(processed).fillna(np.nan)
-
-    # convert weak topics to multiple binary columns (weak_{topic})
-    # find the top topics across dataset
-    topic_cols = [c for c in df_feat.columns if c.startswith("topic_acc__")]
-    topics = [c.replace("topic_acc__", "") for c in topic_cols]
+def _parse_responses(values):
+    # parse every JSON string of the chunk with a single json.loads call
+    parsed = []
+    pending = []
+    for v in values:
+        if isinstance(v, str):
+            pending.append(v)
+            parsed.append(None)
+        elif isinstance(v, list):
+            parsed.append(v)
+        else:
+            parsed.append([])
+    if pending:
+        it = iter(json.loads("[" + ",".join(pending) + "]"))
+        parsed = [next(it) if p is None else p for p in parsed]
+    return parsed
+
+def explode_responses(df_raw):
+    """
+    Flatten the responses of a raw chunk into one columnar frame with a row per
+    question, tagged with the position of its attempt in the chunk.
+    """
+    responses = _parse_responses(df_raw["responses"].tolist())
+    counts = np.fromiter((len(r) for r in responses), dtype=np.int64, count=len(responses))
+    flat = [q for rs in responses for q in rs]
+    m = len(flat)
+    return pd.DataFrame({
+        "attempt": np.repeat(np.arange(len(responses)), counts),
+        "topic": [q.get("topic", "unknown") for q in flat],
+        "difficulty": [q.get("difficulty", "medium") for q in flat],
+        "is_correct": np.fromiter((bool(q.get("is_correct")) for q in flat), dtype=bool, count=m),
+        "time_taken": np.fromiter((max(0.001, float(q.get("time_taken", 0))) for q in flat), dtype=np.float64, count=m),
+    }), counts
+
+def _timing_stats(times, counts):
+    """
+    Per-attempt mean/median/std of question times. Attempts are bucketed by quiz
+    length so each bucket is a dense 2-D matrix reduced along its rows, which uses the
+    same numpy reductions as process_one_attempt and gives bit-identical results.
+    """
+    n = len(counts)
+    avg_time = np.full(n, np.nan)
+    median_time = np.full(n, np.nan)
+    time_std = np.full(n, np.nan)
+    starts = np.cumsum(counts) - counts
+    for k in np.unique(counts[counts > 0]):
+        rows = np.flatnonzero(counts == k)
+        T = times[starts[rows, None] + np.arange(k)]
+        avg_time[rows] = np.mean(T, axis=1)
+        median_time[rows] = np.median(T, axis=1)
+        time_std[rows] = np.std(T, axis=1)
+    return avg_time, median_time, time_std
+
+def build_features_columnar(df_raw):
+    """
+    Columnar equivalent of running process_one_attempt over every row of df_raw.
+    Returns (df_feat, topics) where topics is the list of topics seen in the chunk in
+    order of first appearance (which is the topic_acc__* column order).
+    """
+    flat, counts = explode_responses(df_raw)
+    keep = counts > 0
+    n = len(counts)
+
+    correct = np.bincount(flat["attempt"], weights=flat["is_correct"], minlength=n)
+    avg_time, median_time, time_std = _timing_stats(flat["time_taken"].to_numpy(), counts)
+    out = pd.DataFrame(index=df_raw.index[keep], data={
+        "user_id": df_raw["user_id"].to_numpy()[keep],
+        "quiz_id": df_raw["quiz_id"].to_numpy()[keep],
+        "quiz_score": (correct[keep] / counts[keep]) * 100.0,
+        "correct_count": correct[keep].astype(np.int64),
+        "total_questions": counts[keep],
+        "avg_time": avg_time[keep],
+        "median_time": median_time[keep],
+        "time_std": time_std[keep],
+    })
+
+    # difficulty accuracies
+    attempt = flat["attempt"].to_numpy()
+    is_c = flat["is_correct"].to_numpy()
+    for d in ("easy", "medium", "hard"):
+        sel = (flat["difficulty"] == d).to_numpy()
+        tot = np.bincount(attempt[sel], minlength=n)
+        cor = np.bincount(attempt[sel], weights=is_c[sel], minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"{d}_acc"] = np.where(tot > 0, cor / tot, np.nan)[keep]
+
+    # topic accuracies; groups come out in first-appearance order within each attempt
+    topic_stats = flat.groupby(["attempt", "topic"], sort=False)["is_correct"].agg(["sum", "count"]).reset_index()
+    topic_stats["acc"] = topic_stats["sum"] / topic_stats["count"]
+    weak = topic_stats[topic_stats["acc"] < WEAK_TOPIC_THRESHOLD]
+    weak_json = np.full(n, "[]", dtype=object)
+    if len(weak):
+        w_attempt = weak["attempt"].to_numpy()
+        bounds = np.flatnonzero(np.diff(w_attempt)) + 1
+        for a, ts in zip(w_attempt[np.r_[0, bounds]], np.split(weak["topic"].to_numpy(dtype=object), bounds)):
+            weak_json[a] = json.dumps(ts.tolist())
+    out["weak_topics_list"] = weak_json[keep]
+
+    topics = list(pd.unique(flat["topic"]))
+    codes = pd.Categorical(topic_stats["topic"], categories=topics).codes
+    acc = np.full((n, len(topics)), np.nan)
+    acc[topic_stats["attempt"].to_numpy(), codes] = topic_stats["acc"].to_numpy()
+    acc = acc[keep]
+    for i, topic in enumerate(topics):
+        out[f"topic_acc__{topic}"] = acc[:, i]
+    return out, topics
+
+def add_labels(df_feat, topics):
+    # convert topic accuracies to binary weak_topic__{topic} columns
     for topic in topics:
-        # weak topic = 1 if topic_acc__topic < threshold OR topic absent -> 0
         src = f"topic_acc__{topic}"
-        df_feat[f"weak_topic__{topic}"] = df_feat[src].apply(lambda x: 1 if (pd.notna(x) and x < WEAK_TOPIC_THRESHOLD) else 0)
+        if src in df_feat.columns:
+            df_feat[f"weak_topic__{topic}"] = (df_feat[src] < WEAK_TOPIC_THRESHOLD).astype(np.int64)
+        else:
+            df_feat[src] = np.nan
+            df_feat[f"weak_topic__{topic}"] = 0
 
-    # derive skill_level_label
-    def skill_label(score):
-        if score < 50: return 0
-        if score < 80: return 1
-        return 2
-    df_feat["skill_level_label"] = df_feat["quiz_score"].apply(skill_label)
+    # derive skill_level_label (<50 -> 0, <80 -> 1, else 2)
+    df_feat["skill_level_label"] = np.digitize(df_feat["quiz_score"].to_numpy(), [50, 80]).astype(np.int64)
 
     # confidence target (simple heuristic): accuracy * (1 / (1 + time_std))
     df_feat["confidence_score"] = (df_feat["quiz_score"] / 100.0) * (1.0 / (1.0 + df_feat["time_std"].fillna(0.0)))
     # clamp 0.0-1.0
     df_feat["confidence_score"] = df_feat["confidence_score"].clip(0.0, 1.0)
+    return df_feat
+
+def output_columns(topics):
+    return (BASE_COLS + [f"topic_acc__{t}" for t in topics] + [f"weak_topic__{t}" for t in topics]
+            + ["skill_level_label", "confidence_score"])
+
+def input_paths(pattern):
+    """The raw CSV files matched by `pattern` (a path or a glob), in sorted order."""
+    if not glob.has_magic(pattern):
+        return [pattern]
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No raw input files match {pattern}")
+    return paths
+
+def iter_raw_chunks(pattern, chunksize=CHUNK_SIZE):
+    for path in input_paths(pattern):
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+def iter_feature_chunks(path, chunksize=CHUNK_SIZE, topics=None):
+    """
+    Yield (df_feat, chunk_topics) for each chunk of the raw CSV(s). Labels are built for
+    `topics` when given, otherwise for the topics seen in the chunk.
+    """
+    for df_raw in iter_raw_chunks(path, chunksize):
+        df_feat, chunk_topics = build_features_columnar(df_raw)
+        if len(df_feat):
+            yield add_labels(df_feat, topics if topics is not None else chunk_topics), chunk_topics
+
+def write_to_store(path, store_dir, flush_rows=STORE_FLUSH_ROWS):
+    # chunks are buffered up to flush_rows feature rows and appended together, so each
+    # date gets one file per flush rather than one per chunk; the store widens its
+    # schema when a flush introduces new topics
+    rows = 0
+    pending, dates, buffered = [], [], 0
+    for df_raw in iter_raw_chunks(path):
+        df_feat, topics = build_features_columnar(df_raw)
+        if not len(df_feat):
+            continue
+        df_feat = add_labels(df_feat, ETL_TOPICS or topics)
+        start_times = df_raw["start_time"].loc[df_feat.index] if "start_time" in df_raw.columns else [None] * len(df_feat)
+        df_feat["attempt_id"] = feature_store.attempt_ids(df_feat["user_id"], df_feat["quiz_id"], start_times)
+        pending.append(df_feat)
+        dates.append(feature_store.attempt_dates(start_times))
+        buffered += len(df_feat)
+        if buffered >= flush_rows:
+            rows += _flush_to_store(pending, dates, store_dir)
+            pending, dates, buffered = [], [], 0
+    if pending:
+        rows += _flush_to_store(pending, dates, store_dir)
+    return rows
+
+def _flush_to_store(frames, dates, store_dir):
+    # chunks with different topics concatenate to the union; missing labels are 0
+    df_feat = pd.concat(frames, ignore_index=True)
+    weak = [c for c in df_feat.columns if c.startswith("weak_topic__")]
+    df_feat[weak] = df_feat[weak].fillna(0).astype(int)
+    return feature_store.write_features(df_feat, store_dir, attempt_date=np.concatenate(dates))
+
+def main():
+    if FEATURE_STORE_DIR:
+        rows = write_to_store(INPUT_RAW_CSV, FEATURE_STORE_DIR)
+        print(f"Appended {rows} feature rows to {FEATURE_STORE_DIR}")
+        return
+
+    if ETL_TOPICS:
+        # fixed layout: stream every chunk straight to the output file
+        cols = output_columns(ETL_TOPICS)
+        rows = 0
+        header = True
+        for df_feat, _ in iter_feature_chunks(INPUT_RAW_CSV, topics=ETL_TOPICS):
+            df_feat = df_feat.reindex(columns=cols)
+            df_feat.to_csv(OUTPUT_FEATURE_CSV, index=False, mode="w" if header else "a", header=header)
+            header = False
+            rows += len(df_feat)
+        print(f"Saved features to {OUTPUT_FEATURE_CSV}, shape={(rows, len(cols))}")
+        return
+
+    # topics discovered on the fly: keep the compact per-attempt features (the raw
+    # responses are released chunk by chunk) and align columns once at the end
+    parts = []
+    all_topics = []
+    for df_feat, topics in iter_feature_chunks(INPUT_RAW_CSV):
+        parts.append(df_feat)
+        all_topics.extend(t for t in topics if t not in all_topics)
+    df_feat = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=output_columns([]))
+    for topic in all_topics:
+        df_feat[f"weak_topic__{topic}"] = df_feat[f"weak_topic__{topic}"].fillna(0).astype(np.int64)
+    df_feat = df_feat.reindex(columns=output_columns(all_topics))
 
     df_feat.to_csv(OUTPUT_FEATURE_CSV, index=False)
     print(f"Saved features to {OUTPUT_FEATURE_CSV}, shape={df_feat.shape}")
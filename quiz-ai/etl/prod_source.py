@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Prod-mode ETL source: build features for only the raw attempts added to Postgres since
+the last run, and upsert them into the feature store.
+
+  python etl/prod_source.py                         # attempts past the watermark
+  python etl/prod_source.py --workers 8 --method copy
+  python etl/prod_source.py --full                  # rebuild from the first attempt
+  python etl/prod_source.py --load raw_quiz_responses.csv   # fill a local test table
+
+The raw table (ETL_RAW_TABLE) holds one row per quiz attempt with the same columns as
+the raw CSV, plus an increasing integer key (ETL_WATERMARK_COLUMN), e.g.
+
+  CREATE TABLE quiz_attempts (id BIGSERIAL PRIMARY KEY, user_id TEXT, quiz_id TEXT,
+                              responses JSONB, start_time TIMESTAMPTZ, end_time TIMESTAMPTZ);
+
+The key range past the watermark, up to the largest key when the run starts, is cut
+into pages aligned to multiples of --page-size keys. Up to --workers pages are pulled
+at once, each on its own connection, either with COPY ... TO STDOUT (csv) or through
+a server-side cursor. Pages are handed in key order to build_features_columnar and
+written to FEATURE_STORE_DIR as part files named after the page. After each page the
+watermark (the page's upper key) is saved in the store's _prod_watermark.json, so an
+interrupted run resumes where it stopped.
+
+A run starts again at the beginning of the page holding the watermark. That page is
+rebuilt with the attempts it already had plus the new ones, and its files are
+replaced, so every attempt is in the store exactly once. The page size is kept in the
+watermark file; changing it needs --full (on an empty store).
+
+Keys are handed out when a row is inserted, not when it commits: a transaction
+holding a lower key can commit after a run has already read past it. Every run
+therefore also re-reads the --lookback keys (ETL_LOOKBACK_KEYS) behind the
+watermark, rebuilding those pages the same way, so an attempt is only missed if it
+commits after more than that many later keys were read. Size it to the insert rate
+times the longest transaction that writes to the raw table.
+
+Compare with the CSV path on a local database:
+  python etl/prod_source.py --load raw.csv && python etl/prod_source.py
+  RAW_INPUT_CSV=raw.csv FEATURE_STORE_DIR=/tmp/csv_store python etl/build_features.py
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import feature_store
+from build_features import CHUNK_SIZE, ETL_TOPICS, add_labels, build_features_columnar
+
+DATABASE_URL = os.environ.get("ETL_DATABASE_URL", os.environ.get("DATABASE_URL", "postgresql://localhost/postgres"))
+RAW_TABLE = os.environ.get("ETL_RAW_TABLE", "quiz_attempts")
+# increasing integer key of the raw table; also the partition key for parallel paging
+WATERMARK_COLUMN = os.environ.get("ETL_WATERMARK_COLUMN", "id")
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR", feature_store.FEATURE_STORE_DIR)
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", 4))
+# keys per page (pages are aligned to multiples of this)
+ETL_PAGE_SIZE = int(os.environ.get("ETL_PAGE_SIZE", CHUNK_SIZE))
+# keys behind the watermark read again every run, for rows that committed late
+ETL_LOOKBACK_KEYS = int(os.environ.get("ETL_LOOKBACK_KEYS", 10000))
+STATE_FILE = "_prod_watermark.json"
+
+RAW_COLUMNS = ["user_id", "quiz_id", "responses", "start_time", "end_time"]
+
+def read_state(store_dir):
+    path = os.path.join(store_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_state(store_dir, state):
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def quote_ident(name):
+    """A table or column name as a standard SQL quoted identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+# The watermark and paging queries are plain SQL text, so they run unchanged on any
+# DB-API connection (the tests run them on sqlite); only COPY and --load are Postgres-only.
+def key_range(conn, table, column):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT min({quote_ident(column)}), max({quote_ident(column)}) FROM {quote_ident(table)}")
+        return cur.fetchone()
+
+def plan_pages(watermark, upper, page_size):
+    """(lo, hi] key ranges covering (watermark, upper], starting at the page that holds watermark + 1."""
+    start = (watermark // page_size) * page_size
+    return [(lo, min(lo + page_size, upper)) for lo in range(start, upper, page_size)]
+
+def _page_query(table, column, lo, hi):
+    cols = ", ".join(map(quote_ident, [column] + RAW_COLUMNS))
+    c = quote_ident(column)
+    return f"SELECT {cols} FROM {quote_ident(table)} WHERE {c} > {int(lo)} AND {c} <= {int(hi)} ORDER BY {c}"
+
+def fetch_copy(conn, table, column, lo, hi):
+    """One page through COPY (...) TO STDOUT as CSV, parsed by pandas in one go."""
+    buf = io.StringIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({_page_query(table, column, lo, hi)}) TO STDOUT WITH (FORMAT csv, HEADER)", buf)
+    buf.seek(0)
+    return pd.read_csv(buf, dtype={"user_id": str, "quiz_id": str})
+
+def fetch_cursor(conn, table, column, lo, hi, batch_size=10000):
+    """One page through a named (server-side) cursor, fetched batch_size rows at a time."""
+    frames = []
+    with conn.cursor(name=f"etl_page_{lo}") as cur:
+        cur.itersize = batch_size
+        cur.execute(_page_query(table, column, lo, hi))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            frames.append(pd.DataFrame(rows, columns=[column] + RAW_COLUMNS))
+    # psycopg2 decodes JSONB into lists and other drivers return JSON text; the columnar builder takes both
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[column] + RAW_COLUMNS)
+
+class PageReader:
+    """Fetches pages on a pool of threads, one Postgres connection per thread."""
+
+    def __init__(self, dsn, table, column, method, workers):
+        self.dsn = dsn
+        self.table = table
+        self.column = column
+        self.fetch = fetch_copy if method == "copy" else fetch_cursor
+        self.workers = workers
+        self._conns = {}
+
+    def _fetch(self, lo, hi):
+        ident = threading.get_ident()
+        conn = self._conns.get(ident)
+        if conn is None:
+            conn = self._conns[ident] = psycopg2.connect(self.dsn)
+            conn.set_session(readonly=True)
+        try:
+            return self.fetch(conn, self.table, self.column, lo, hi)
+        finally:
+            # one short read-only transaction per page
+            conn.rollback()
+
+    def pages(self, ranges):
+        """Yield ((lo, hi), raw frame) in key order, with at most 2 * workers pages in flight."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for lo, hi in ranges:
+                pending.append(((lo, hi), pool.submit(self._fetch, lo, hi)))
+                if len(pending) >= 2 * self.workers:
+                    page, future = pending.popleft()
+                    yield page, future.result()
+            while pending:
+                page, future = pending.popleft()
+                yield page, future.result()
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+def upsert_page(df_raw, lo, store_dir):
+    """Features of one raw page, written over any earlier files of the same page."""
+    df_raw = df_raw.reset_index(drop=True)
+    df_feat, topics = build_features_columnar(df_raw)
+    if not len(df_feat):
+        return 0
+    df_feat = add_labels(df_feat, ETL_TOPICS or topics)
+    start_times = df_raw["start_time"].loc[df_feat.index].tolist()
+    dates = feature_store.attempt_dates(start_times)
+    df_feat["attempt_id"] = feature_store.attempt_ids(df_feat["user_id"], df_feat["quiz_id"], start_times)
+    # named after the page's aligned lower key, so a rebuilt page replaces its files
+    return feature_store.write_features(df_feat, store_dir, attempt_date=dates, basename=f"{RAW_TABLE}-{lo}")
+
+def load_csv(conn, path, table):
+    """Copy a raw CSV (build_features.py input format) into the raw table, creating it if needed."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {t} ({c} BIGSERIAL PRIMARY KEY, user_id TEXT, quiz_id TEXT, "
+            "responses JSONB, start_time TIMESTAMPTZ, end_time TIMESTAMPTZ)").format(
+            t=sql.Identifier(table), c=sql.Identifier(WATERMARK_COLUMN)))
+        with open(path) as f:
+            header = f.readline().strip().split(",")
+            f.seek(0)
+            query = sql.SQL("COPY {t} ({cols}) FROM STDIN WITH (FORMAT csv, HEADER)").format(
+                t=sql.Identifier(table), cols=sql.SQL(", ").join(map(sql.Identifier, header)))
+            cur.copy_expert(query.as_string(conn), f)
+        rows = cur.rowcount
+    conn.commit()
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", choices=["copy", "cursor"], default="copy")
+    parser.add_argument("--workers", type=int, default=ETL_WORKERS, help="pages fetched in parallel")
+    parser.add_argument("--page-size", type=int, default=ETL_PAGE_SIZE, help="keys per page")
+    parser.add_argument("--lookback", type=int, default=ETL_LOOKBACK_KEYS,
+                        help="keys behind the watermark read again, for rows that committed late")
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and start from the first key")
+    parser.add_argument("--load", metavar="CSV", help="copy a raw CSV into the raw table and exit")
+    args = parser.parse_args(argv)
+
+    if args.load:
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            print(f"Loaded {load_csv(conn, args.load, RAW_TABLE)} attempts into {RAW_TABLE}")
+        finally:
+            conn.close()
+        return 0
+
+    state = None if args.full else read_state(FEATURE_STORE_DIR)
+    if state is not None and (state["table"], state["column"]) != (RAW_TABLE, WATERMARK_COLUMN):
+        print(f"{STATE_FILE} in {FEATURE_STORE_DIR} tracks {state['table']}.{state['column']}; "
+              f"pass --full to start over for {RAW_TABLE}.{WATERMARK_COLUMN}")
+        return 1
+    page_size = state["page_size"] if state else args.page_size
+    if page_size != args.page_size:
+        print(f"Keeping the store's page size of {page_size} keys (changing it needs --full)")
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        first, last = key_range(conn, RAW_TABLE, WATERMARK_COLUMN)
+    finally:
+        conn.close()
+    if last is None:
+        print(f"{RAW_TABLE} is empty, nothing to do.")
+        return 0
+    watermark = state["watermark"] if state else first - 1
+    # late commits can only hide behind a watermark an earlier run saved
+    reread = max(watermark - args.lookback, first - 1) if state else watermark
+    if last <= reread:
+        print(f"No attempts past watermark {watermark}.")
+        return 0
+    ranges = plan_pages(reread, max(last, watermark), page_size)
+    print(f"Reading {RAW_TABLE}.{WATERMARK_COLUMN} in ({ranges[0][0]}, {last}] as {len(ranges)} pages "
+          f"with {args.workers} workers ({args.method})")
+
+    state = state or {"table": RAW_TABLE, "column": WATERMARK_COLUMN, "page_size": page_size}
+    reader = PageReader(DATABASE_URL, RAW_TABLE, WATERMARK_COLUMN, args.method, args.workers)
+    start = time.perf_counter()
+    attempts = rows = 0
+    try:
+        for (lo, hi), df_raw in reader.pages(ranges):
+            # attempts at or below the watermark are only rebuilt (or committed late)
+            attempts += int((df_raw[WATERMARK_COLUMN] > watermark).sum())
+            rows += upsert_page(df_raw, lo, FEATURE_STORE_DIR)
+            state.update(watermark=max(hi, state.get("watermark", hi)), updated_at=datetime.datetime.utcnow().isoformat() + "Z")
+            write_state(FEATURE_STORE_DIR, state)
+    finally:
+        reader.close()
+    print(f"Upserted {rows} feature rows ({attempts} new attempts) into {FEATURE_STORE_DIR} in "
+          f"{time.perf_counter() - start:.1f}s; watermark {state['watermark']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Partitioned Parquet feature store shared by the ETL, training and batch scoring.
+
+Layout (hive partitioning):
+  <FEATURE_STORE_DIR>/_schema.json
+  <FEATURE_STORE_DIR>/attempt_date=2025-11-04/part-<uuid>-0.parquet
+
+Only attempt_date is a directory level; quiz_id stays a column (filters on it use the
+parquet statistics). Partitioning by quiz as well gave every write one tiny file per
+(date, quiz) it touched. Stores written with quiz_id directories still read as before.
+
+_schema.json records which columns are ids, features and labels plus their dtypes, so
+readers no longer have to guess feature columns from CSV dtypes. Appends may introduce
+new topics; the schema is widened and older files read the new columns as null
+(weak_topic__* labels are filled with 0, matching the ETL's definition).
+
+Usage:
+  python feature_store.py import prepared_quiz_features.csv [--date 2025-11-04]
+  python feature_store.py info
+"""
+import os
+import sys
+import json
+import uuid
+import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR", os.path.join(BASE_DIR, "feature_store"))
+SCHEMA_FILE = "_schema.json"
+
+PARTITION_COLS = ["attempt_date"]
+ID_COLS = ["user_id", "quiz_id", "attempt_date", "attempt_id", "weak_topics_list"]
+LABEL_COLS = ["quiz_score", "skill_level_label", "confidence_score"]
+INT_COLS = ["attempt_id", "correct_count", "total_questions", "skill_level_label"]
+
+def is_label(col):
+    return col in LABEL_COLS or col.startswith("weak_topic__")
+
+def exists(store_dir=FEATURE_STORE_DIR):
+    return os.path.exists(os.path.join(store_dir, SCHEMA_FILE))
+
+def read_schema(store_dir=FEATURE_STORE_DIR):
+    with open(os.path.join(store_dir, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+def _write_schema(store_dir, schema):
+    path = os.path.join(store_dir, SCHEMA_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(schema, f, indent=2)
+    os.replace(tmp, path)
+
+def _column_type(col):
+    if col in ("user_id", "quiz_id", "attempt_date", "weak_topics_list"):
+        return "string"
+    if col in INT_COLS or col.startswith("weak_topic__"):
+        return "int64"
+    return "float64"
+
+def _merge_schema(schema, columns):
+    schema = schema or {"id_cols": [], "feature_cols": [], "label_cols": [], "dtypes": {},
+                        "partition_cols": PARTITION_COLS}
+    for c in columns:
+        if c in schema["dtypes"]:
+            continue
+        schema["dtypes"][c] = _column_type(c)
+        if c in ID_COLS:
+            schema["id_cols"].append(c)
+        elif is_label(c):
+            schema["label_cols"].append(c)
+        else:
+            schema["feature_cols"].append(c)
+    return schema
+
+def _arrow_schema(schema):
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64()}
+    return pa.schema([(c, types[t]) for c, t in schema["dtypes"].items()])
+
+def attempt_dates(start_times, default=None):
+    """Partition dates (YYYY-MM-DD) from raw start_time values; unparsable -> default (today)."""
+    default = default or datetime.date.today().isoformat()
+    parsed = pd.to_datetime(pd.Series(start_times), utc=True, errors="coerce")
+    return parsed.dt.strftime("%Y-%m-%d").fillna(default).to_numpy(dtype=object)
+
+def attempt_ids(user_ids, quiz_ids, start_times):
+    """Stable int64 key per attempt from (user_id, quiz_id, start_time), the same on every ETL run."""
+    raw = pd.Series(list(start_times), dtype=object)
+    # the CSV and Postgres sources format the same instant differently
+    start = pd.to_datetime(raw, utc=True, errors="coerce", format="ISO8601").dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    keys = pd.DataFrame({"user_id": pd.Series(list(user_ids), dtype=object).astype(str).to_numpy(),
+                         "quiz_id": pd.Series(list(quiz_ids), dtype=object).astype(str).to_numpy(),
+                         "start_time": start.fillna(raw.astype(str)).to_numpy()})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy().view(np.int64)
+
+def write_features(df, store_dir=FEATURE_STORE_DIR, attempt_date=None, basename=None):
+    """
+    Append a frame of per-attempt features to the store. `attempt_date` is a single
+    date string or an array aligned with df; if omitted df must carry attempt_date.
+    With `basename` the part files are named after it instead of a random id, so
+    writing the same rows again replaces the files (an upsert at file granularity).
+    Returns the number of rows written.
+    """
+    if not len(df):
+        return 0
+    os.makedirs(store_dir, exist_ok=True)
+    df = df.copy()
+    if attempt_date is not None:
+        df["attempt_date"] = attempt_date
+    schema = _merge_schema(read_schema(store_dir) if exists(store_dir) else None, df.columns)
+    for c in df.columns:
+        if schema["dtypes"][c] == "string":
+            df[c] = df[c].astype(object).where(df[c].notna(), None)
+        else:
+            df[c] = df[c].astype(schema["dtypes"][c])
+    schema["partition_cols"] = PARTITION_COLS
+    # widen the schema first so readers never see files with unknown columns
+    _write_schema(store_dir, schema)
+    # grouped by date, so each partition is written as one file in one pass
+    df = df.sort_values("attempt_date", kind="stable")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    n_dates = df["attempt_date"].nunique(dropna=False)
+    ds.write_dataset(
+        table,
+        store_dir,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLS]), flavor="hive"),
+        basename_template=f"part-{basename or uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_partitions=max(n_dates, 1),
+        max_open_files=max(n_dates, 1) + 1,
+    )
+    return len(df)
+
+def open_dataset(store_dir=FEATURE_STORE_DIR):
+    schema = read_schema(store_dir)
+    return ds.dataset(
+        store_dir,
+        format="parquet",
+        schema=_arrow_schema(schema),
+        partitioning="hive",
+        # memory-map the parquet files instead of reading them into buffers
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+        exclude_invalid_files=True,
+        ignore_prefixes=["_", "."],
+    )
+
+def _filter(dates=None, quiz_ids=None, since=None, start=None):
+    expr = None
+    parts = []
+    if dates is not None:
+        parts.append(ds.field("attempt_date").isin(list(dates)))
+    if since is not None:
+        parts.append(ds.field("attempt_date") > since)
+    if start is not None:
+        parts.append(ds.field("attempt_date") >= start)
+    if quiz_ids is not None:
+        parts.append(ds.field("quiz_id").isin(list(quiz_ids)))
+    for p in parts:
+        expr = p if expr is None else expr & p
+    return expr
+
+def _to_pandas(table):
+    df = table.to_pandas()
+    for c in df.columns:
+        if c.startswith("weak_topic__"):
+            # older partitions written before this topic existed
+            df[c] = df[c].fillna(0).astype(np.int64)
+    return df
+
+def read_features(store_dir=FEATURE_STORE_DIR, columns=None, dates=None, quiz_ids=None, since=None, start=None):
+    """
+    Read only the requested columns from the partitions matching dates/quiz_ids
+    (and attempt_date > since, attempt_date >= start). Partition filters prune whole
+    directories.
+    """
+    dataset = open_dataset(store_dir)
+    return _to_pandas(dataset.to_table(columns=columns, filter=_filter(dates, quiz_ids, since, start)))
+
+def iter_batches(store_dir=FEATURE_STORE_DIR, columns=None, batch_size=100000, dates=None, quiz_ids=None, since=None):
+    """Yield DataFrames of at most batch_size rows in a stable (file, row) order."""
+    dataset = open_dataset(store_dir)
+    scanner = dataset.scanner(columns=columns, filter=_filter(dates, quiz_ids, since), batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield _to_pandas(pa.Table.from_batches([batch]))
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == "import":
+        date = argv[argv.index("--date") + 1] if "--date" in argv else None
+        df = pd.read_csv(argv[1])
+        if "attempt_date" not in df.columns:
+            df["attempt_date"] = date or datetime.date.today().isoformat()
+        n = write_features(df, FEATURE_STORE_DIR)
+        print(f"Imported {n} rows from {argv[1]} into {FEATURE_STORE_DIR}")
+    elif argv and argv[0] == "info":
+        schema = read_schema(FEATURE_STORE_DIR)
+        print(json.dumps({k: v for k, v in schema.items() if k != "dtypes"}, indent=2))
+        print("rows:", open_dataset(FEATURE_STORE_DIR).count_rows())
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
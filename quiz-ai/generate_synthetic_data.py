@@ -1,3 +1,26 @@
+"""
+Synthetic quiz data.
+
+  python generate_synthetic_data.py
+      200 rows of already-aggregated features -> prepared_quiz_features.csv
+
+  python generate_synthetic_data.py raw --attempts 1000000 --shards 8 --workers 8 --out data/raw
+      raw attempts in the ETL input format (user_id, quiz_id, responses JSON,
+      start_time, end_time), written as data/raw/raw_attempts-00000.csv ...;
+      feed them to the ETL with RAW_INPUT_CSV='data/raw/*.csv'
+
+Raw attempts are generated with array operations only: every user has a latent skill
+(drawn from --skill-probs over Beginner/Intermediate/Advanced) and a fixed per-topic
+weakness, and each answer is correct with probability
+sigmoid(skill - difficulty - weakness). Shards are seeded from one SeedSequence, so a
+given (--seed, --shards) always produces the same files regardless of --workers.
+"""
+import os
+import sys
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import random
@@ -74,7 +97,163 @@ def generate_data(num_samples=200):
     df = pd.DataFrame(data)
     return df
 
+BASE_TOPICS = ["spelling", "grammar", "vocabulary", "phonics", "reading", "rhyming"]
+DIFFICULTIES = ["easy", "medium", "hard"]
+# latent skill of Beginner / Intermediate / Advanced users, and how much harder each
+# difficulty is, on the logit scale of P(correct)
+SKILL_MEANS = np.array([-0.8, 0.6, 2.0])
+DIFFICULTY_OFFSETS = np.array([-0.7, 0.0, 0.9])
+# seconds per answer: slower for weaker users and harder questions
+BASE_TIMES = np.array([22.0, 14.0, 9.0])
+DIFFICULTY_TIME_FACTORS = np.array([0.8, 1.0, 1.3])
+MAX_TENTHS = 3000
+
+def topic_names(n_topics):
+    return (BASE_TOPICS + [f"topic{i}" for i in range(len(BASE_TOPICS), n_topics)])[:n_topics]
+
+def _user_skills(seed, n_users, skill_probs):
+    # drawn from the root seed so every shard sees the same user population
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+    level = rng.choice(len(skill_probs), size=n_users, p=skill_probs)
+    return level, SKILL_MEANS[level] + rng.normal(0.0, 0.4, n_users)
+
+def _topic_weakness(users, topics, seed):
+    # fixed per (user, topic) without materialising an n_users x n_topics table
+    h = (users.astype(np.uint64) * np.uint64(2654435761) + topics.astype(np.uint64) * np.uint64(40503)
+         + np.uint64(seed & 0xFFFFFFFF)) % np.uint64(1000003)
+    u = h.astype(np.float64) / 1000003.0
+    # most topics are fine, roughly one in five is a real weakness
+    return np.where(u < 0.2, 1.5, 0.0) + 0.3 * u
+
+def _response_json(lengths, topic_idx, diff_idx, correct, tenths, topics, quote='"'):
+    """
+    One JSON list per attempt, assembled from precomputed string pieces. quote='""'
+    gives the CSV-escaped form, ready to go between double quotes in a CSV field.
+    """
+    if not len(lengths):
+        return np.array([], dtype=object)
+    max_len = int(lengths.max())
+    q = quote
+    # head: question id + topic/difficulty/correctness, tail: time + separator
+    combos = [f'{q}topic{q}: {q}{t}{q}, {q}difficulty{q}: {q}{d}{q}, {q}is_correct{q}: {c}, {q}time_taken{q}: '
+              for t in topics for d in DIFFICULTIES for c in ("false", "true")]
+    head = np.array([f'{{{q}question_id{q}: {q}q{j + 1}{q}, ' + c for j in range(max_len) for c in combos], dtype=object)
+    tail = np.array([f"{k / 10!r}}}" + sep for k in range(MAX_TENTHS + 1) for sep in (", ", "]")], dtype=object)
+
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    position = np.arange(len(topic_idx)) - np.repeat(starts, lengths)
+    last = np.zeros(len(topic_idx), dtype=np.int64)
+    last[starts + lengths - 1] = 1
+    pieces = head[position * len(combos) + (topic_idx * 3 + diff_idx) * 2 + correct] + tail[tenths * 2 + last]
+    return "[" + np.add.reduceat(pieces, starts)
+
+def _attempt_columns(n_attempts, seed=0, shard=0, n_shards=1, n_topics=6, n_users=None,
+                     n_quizzes=50, min_questions=5, max_questions=25,
+                     skill_probs=(0.3, 0.4, 0.3), start_date="2025-01-01", days=90, quote='"'):
+    topics = topic_names(n_topics)
+    n_users = n_users or max(1, n_attempts // 5)
+    user_level, user_skill = _user_skills(seed, n_users, np.asarray(skill_probs) / np.sum(skill_probs))
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(n_shards + 1)[shard + 1])
+
+    users = rng.integers(0, n_users, n_attempts)
+    quizzes = rng.integers(0, n_quizzes, n_attempts)
+    lengths = rng.integers(max(1, min_questions), max_questions + 1, n_attempts)
+    # each quiz mostly covers a few topics: a random window of the topic list
+    quiz_topic_start = np.random.default_rng(seed).integers(0, n_topics, n_quizzes)
+
+    n = int(lengths.sum())
+    attempt = np.repeat(np.arange(n_attempts), lengths)
+    q_user = users[attempt]
+    topic_idx = ((quiz_topic_start[quizzes[attempt]] + rng.integers(0, min(3, n_topics), n)) % n_topics)
+    diff_idx = rng.choice(3, size=n, p=[0.4, 0.4, 0.2])
+    logit = (user_skill[q_user] - DIFFICULTY_OFFSETS[diff_idx]
+             - _topic_weakness(q_user, topic_idx, seed) + rng.normal(0.0, 0.3, n))
+    correct = (rng.random(n) < 1.0 / (1.0 + np.exp(-logit))).astype(np.int64)
+    mean_time = BASE_TIMES[user_level[q_user]] * DIFFICULTY_TIME_FACTORS[diff_idx]
+    tenths = np.clip(np.rint(rng.gamma(4.0, mean_time / 4.0) * 10), 1, MAX_TENTHS).astype(np.int64)
+
+    start = (np.datetime64(start_date, "s")
+             + rng.integers(0, days * 86400, n_attempts).astype("timedelta64[s]"))
+    duration = np.bincount(attempt, weights=tenths, minlength=n_attempts) / 10.0
+    end = start + np.ceil(duration).astype("timedelta64[s]")
+
+    order = np.argsort(start, kind="stable")
+    return {
+        "user_id": np.char.add("u", users.astype(str))[order],
+        "quiz_id": np.char.add("q", quizzes.astype(str))[order],
+        "responses": _response_json(lengths, topic_idx, diff_idx, correct, tenths, topics, quote)[order],
+        "start_time": np.char.add(np.datetime_as_string(start, unit="s"), "Z")[order],
+        "end_time": np.char.add(np.datetime_as_string(end, unit="s"), "Z")[order],
+    }
+
+def generate_raw_attempts(n_attempts, **kwargs):
+    """
+    DataFrame of n_attempts raw attempts in the ETL input format, sorted by start_time.
+    Keyword arguments: seed, shard, n_shards, n_topics, n_users, n_quizzes,
+    min_questions, max_questions, skill_probs, start_date, days.
+    """
+    return pd.DataFrame(_attempt_columns(n_attempts, **kwargs))
+
+def _write_shard(args):
+    path, n_attempts, kwargs = args
+    # responses are generated CSV-escaped, so rows are joined directly instead of going
+    # through to_csv's per-field quoting
+    cols = _attempt_columns(n_attempts, quote='""', **kwargs)
+    lines = (cols["user_id"].astype(object) + "," + cols["quiz_id"].astype(object) + ',"' + cols["responses"]
+             + '",' + cols["start_time"].astype(object) + "," + cols["end_time"].astype(object) + "\n")
+    with open(path, "w") as f:
+        f.write("user_id,quiz_id,responses,start_time,end_time\n")
+        f.write("".join(lines.tolist()))
+    return path, n_attempts
+
+def write_raw_shards(out_dir, n_attempts, n_shards=1, workers=1, seed=0, **kwargs):
+    """Write n_attempts raw attempts split over n_shards CSV files; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    # the user population is shared by all shards
+    kwargs["n_users"] = kwargs.get("n_users") or max(1, n_attempts // 5)
+    sizes = [n_attempts // n_shards + (1 if i < n_attempts % n_shards else 0) for i in range(n_shards)]
+    jobs = [(os.path.join(out_dir, f"raw_attempts-{i:05d}.csv"), size,
+             dict(kwargs, seed=seed, shard=i, n_shards=n_shards)) for i, size in enumerate(sizes)]
+    if workers <= 1:
+        results = [_write_shard(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_write_shard, jobs))
+    return [path for path, _ in results]
+
+def main(argv):
+    if not argv or argv[0] != "raw":
+        df = generate_data(200)
+        df.to_csv("prepared_quiz_features.csv", index=False)
+        print("Generated 200 samples of synthetic data to prepared_quiz_features.csv")
+        return
+
+    parser = argparse.ArgumentParser(prog="generate_synthetic_data.py raw")
+    parser.add_argument("--attempts", type=int, default=100000)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="raw_quiz_responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--topics", type=int, default=6)
+    parser.add_argument("--users", type=int, default=None, help="default: attempts / 5")
+    parser.add_argument("--quizzes", type=int, default=50)
+    parser.add_argument("--min-questions", type=int, default=5)
+    parser.add_argument("--max-questions", type=int, default=25)
+    parser.add_argument("--skill-probs", default="0.3,0.4,0.3", help="Beginner,Intermediate,Advanced")
+    parser.add_argument("--start-date", default="2025-01-01")
+    parser.add_argument("--days", type=int, default=90)
+    args = parser.parse_args(argv[1:])
+
+    start = datetime.datetime.now()
+    paths = write_raw_shards(
+        args.out, args.attempts, n_shards=args.shards, workers=min(args.workers, args.shards), seed=args.seed,
+        n_topics=args.topics, n_users=args.users, n_quizzes=args.quizzes,
+        min_questions=args.min_questions, max_questions=args.max_questions,
+        skill_probs=[float(p) for p in args.skill_probs.split(",")],
+        start_date=args.start_date, days=args.days,
+    )
+    seconds = (datetime.datetime.now() - start).total_seconds()
+    print(f"Generated {args.attempts} raw attempts in {len(paths)} files under {args.out} ({seconds:.1f}s)")
+
 if __name__ == "__main__":
-    df = generate_data(200)
-    df.to_csv("prepared_quiz_features.csv", index=False)
-    print("Generated 200 samples of synthetic data to prepared_quiz_features.csv")
+    main(sys.argv[1:])
@@ -1,77 +1,278 @@
 import os
-import joblib
+import json
+import shutil
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 
 # Define paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, "models")
-DATA_CSV = os.path.join(BASE_DIR, "prepared_quiz_features.csv")
-OUTPUT_CSV = os.path.join(BASE_DIR, "model_predictions.csv")
+# score with the active registry version when there is one, else the pickles in MODEL_DIR
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(MODEL_DIR, "registry"))
+DATA_CSV = os.environ.get("FEATURE_CSV", os.path.join(BASE_DIR, "prepared_quiz_features.csv"))
+# a .parquet output is written as a directory of numbered part files, one per chunk
+OUTPUT_CSV = os.environ.get("PREDICTIONS_OUTPUT", os.path.join(BASE_DIR, "model_predictions.csv"))
+# when set, read only the needed columns from the Parquet feature store instead of DATA_CSV
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR")
+# streaming: rows per chunk and scoring processes (1 = score in this process)
+PREDICT_CHUNK_SIZE = int(os.environ.get("PREDICT_CHUNK_SIZE", 50000))
+PREDICT_WORKERS = int(os.environ.get("PREDICT_WORKERS", os.cpu_count() or 1))
+# PREDICT_RESUME=1 continues an interrupted run from its checkpoint instead of starting over
+PREDICT_RESUME = os.environ.get("PREDICT_RESUME", "0") == "1"
+CHECKPOINT_PATH = os.environ.get("PREDICT_CHECKPOINT", OUTPUT_CSV.rstrip("/") + ".checkpoint.json")
+
+SKILL_NAMES = np.array(["Beginner", "Intermediate", "Advanced"])
+
+# models of a scoring worker process, loaded once by init_worker()
+_bundle = None
+
+def load_bundle(version):
+    from server.model_registry import load_legacy_bundle, load_registry_bundle
+    # chunks are large, so Booster.predict beats the small-batch fused engine here
+    if version is None:
+        return load_legacy_bundle(MODEL_DIR, use_fused=False)
+    return load_registry_bundle(version, MODEL_REGISTRY_DIR, use_fused=False)
+
+def init_worker(version, threads):
+    global _bundle
+    # set before LightGBM starts its OpenMP pool so workers don't oversubscribe the cores
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    _bundle = load_bundle(version).warmup()
+
+def score_chunk(X):
+    """Prediction columns for one chunk's feature matrix, in output column order."""
+    preds = _bundle.predict(X)
+    out = {"pred_quiz_score": np.clip(preds["quiz_score"], 0.0, 100.0)}
+    skill_idx = np.argmax(preds["skill_level"], axis=1)
+    out["pred_skill_level"] = np.where(skill_idx < len(SKILL_NAMES),
+                                       SKILL_NAMES[np.minimum(skill_idx, len(SKILL_NAMES) - 1)], "Intermediate")
+    out["pred_confidence"] = np.clip(preds["confidence"], 0.0, 1.0)
+    for w_col in _bundle.weak_cols:
+        if w_col in preds:
+            out[f"pred_weak_{w_col.replace('weak_topic__', '')}"] = preds[w_col] > 0.5
+    return out
+
+def iter_input(feature_cols, chunk_size, skip_rows=0):
+    """Yield input DataFrames of at most chunk_size rows, skipping the first skip_rows."""
+    if FEATURE_STORE_DIR:
+        import feature_store
+        available = set(feature_store.read_schema(FEATURE_STORE_DIR)["dtypes"])
+        columns = ["user_id", "quiz_id", "attempt_date"] + [c for c in feature_cols if c in available]
+        missing = [c for c in feature_cols if c not in available]
+        for df in feature_store.iter_batches(FEATURE_STORE_DIR, columns=columns, batch_size=chunk_size):
+            if skip_rows >= len(df):
+                skip_rows -= len(df)
+                continue
+            df = df.iloc[skip_rows:].reset_index(drop=True)
+            skip_rows = 0
+            yield df.reindex(columns=columns + missing)
+    else:
+        yield from pd.read_csv(DATA_CSV, chunksize=chunk_size, skiprows=range(1, skip_rows + 1))
+
+class CsvOutput:
+    """Appends chunks to one CSV file; position() is the byte offset to resume from."""
+
+    def __init__(self, path, resume_from=None):
+        self.path = path
+        if resume_from is None:
+            self.f = open(path, "w", newline="")
+            self.header = True
+        else:
+            # drop anything written after the last checkpoint
+            os.truncate(path, resume_from)
+            self.f = open(path, "a", newline="")
+            self.header = resume_from == 0
+
+    def write(self, df):
+        df.to_csv(self.f, index=False, header=self.header)
+        self.header = False
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def position(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+class ParquetOutput:
+    """Writes each chunk as part-NNNNNN.parquet in a directory; position() is the part count."""
+
+    def __init__(self, path, resume_from=None, widen_cols=()):
+        import pyarrow.parquet as pq
+        self.path = path
+        self.widen_cols = set(widen_cols)
+        self.schema = None
+        if resume_from is None:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            os.makedirs(path)
+            self.parts = 0
+        else:
+            self.parts = resume_from
+            for name in os.listdir(path):
+                if name.startswith("part-") and int(name[5:11]) >= resume_from:
+                    os.remove(os.path.join(path, name))
+            if resume_from:
+                self.schema = pq.read_schema(self._part_path(0))
+
+    def _part_path(self, i):
+        return os.path.join(self.path, f"part-{i:06d}.parquet")
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.schema is None:
+            # every part shares the first chunk's schema; integer features are widened
+            # because a later CSV chunk may hold missing values in them
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            for i, field in enumerate(schema):
+                if field.name in self.widen_cols and pa.types.is_integer(field.type):
+                    schema = schema.set(i, field.with_type(pa.float64()))
+            self.schema = schema
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        tmp_path = self._part_path(self.parts) + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self._part_path(self.parts))
+        self.parts += 1
+
+    def position(self):
+        return self.parts
+
+    def close(self):
+        pass
+
+def source_fingerprint(source):
+    """Identifies the input as it is now: size and mtime of the CSV or of every file in the store."""
+    paths = [source]
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(d, f) for d, _, files in os.walk(source) for f in files)
+    h = hashlib.sha256(source.encode())
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def scored_chunks(chunks, feature_cols, version, workers):
+    """
+    Yield (chunk, prediction columns) in input order. With workers > 1 chunks are
+    scored by a process pool that loads the models once per worker; at most
+    2 * workers chunks are in flight, so memory stays bounded.
+    """
+    if workers <= 1:
+        global _bundle
+        _bundle = load_bundle(version)
+        for chunk in chunks:
+            yield chunk, score_chunk(chunk[feature_cols].to_numpy(dtype=np.float64))
+        return
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: LightGBM's OpenMP runtime is not fork-safe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=init_worker, initargs=(version, threads)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(score_chunk, chunk[feature_cols].to_numpy(dtype=np.float64))))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
 
 def main():
-    print(f"Loading models from {MODEL_DIR}...")
-    
-    # Load metadata and models
+    from server.model_registry import current_version
+    version = current_version(MODEL_REGISTRY_DIR)
+    print(f"Loading models from {MODEL_REGISTRY_DIR if version else MODEL_DIR} (version {version or 'legacy'})...")
+
+    # Load metadata and models (once here to fail fast; workers load their own copy)
     try:
-        meta = joblib.load(os.path.join(MODEL_DIR, "meta.pkl"))
-        feature_cols = meta["feature_cols"]
-        weak_cols = meta["weak_cols"]
-        
-        reg_model = joblib.load(os.path.join(MODEL_DIR, "lgb_reg_quiz_score.pkl"))
-        cls_model = joblib.load(os.path.join(MODEL_DIR, "lgb_cls_skill_level.pkl"))
-        conf_model = joblib.load(os.path.join(MODEL_DIR, "lgb_reg_confidence.pkl"))
-        
-        weak_models = {}
-        for w in weak_cols:
-            path = os.path.join(MODEL_DIR, f"lgb_weak_{w}.pkl")
-            if os.path.exists(path):
-                weak_models[w] = joblib.load(path)
-                
+        bundle = load_bundle(version).warmup()
     except FileNotFoundError as e:
         print(f"Error loading models: {e}")
         print("Make sure you have trained the models first.")
         return
+    feature_cols = bundle.feature_cols
 
-    print(f"Reading data from {DATA_CSV}...")
-    try:
-        df = pd.read_csv(DATA_CSV)
-    except FileNotFoundError:
+    source = FEATURE_STORE_DIR or DATA_CSV
+    if not FEATURE_STORE_DIR and not os.path.exists(DATA_CSV):
         print(f"Error: Could not find {DATA_CSV}")
         return
 
-    # Prepare features
-    print("Generating predictions...")
-    
-    # Ensure all feature columns exist, fill missing with 0 or NaN
-    X = df[feature_cols].values
-    
-    # Predict Quiz Score
-    pred_scores = reg_model.predict(X)
-    df["pred_quiz_score"] = [max(0.0, min(100.0, s)) for s in pred_scores]
-    
-    # Predict Skill Level
-    cls_probs = cls_model.predict(X)
-    skill_indices = np.argmax(cls_probs, axis=1)
-    skill_map = {0: "Beginner", 1: "Intermediate", 2: "Advanced"}
-    df["pred_skill_level"] = [skill_map.get(i, "Intermediate") for i in skill_indices]
-    
-    # Predict Confidence
-    pred_confs = conf_model.predict(X)
-    df["pred_confidence"] = [max(0.0, min(1.0, c)) for c in pred_confs]
-    
-    # Predict Weak Topics
-    for w_col, w_model in weak_models.items():
-        probs = w_model.predict(X)
-        topic_name = w_col.replace("weak_topic__", "")
-        df[f"pred_weak_{topic_name}"] = probs > 0.5
-
-    # Save results
-    print(f"Saving predictions to {OUTPUT_CSV}...")
-    df.to_csv(OUTPUT_CSV, index=False)
+    # rows are resumed by position, so a source that gained rows or files since the
+    # checkpoint (an ETL append, a new part file) must not be resumed
+    state = {"input": os.path.abspath(source), "input_fingerprint": source_fingerprint(os.path.abspath(source)),
+             "output": os.path.abspath(OUTPUT_CSV), "model_version": bundle.version, "chunk_size": PREDICT_CHUNK_SIZE,
+             "rows": 0, "chunks": 0, "position": 0, "complete": False}
+    resume_from = None
+    if PREDICT_RESUME:
+        checkpoint = read_checkpoint(CHECKPOINT_PATH)
+        if checkpoint is None:
+            print(f"No checkpoint at {CHECKPOINT_PATH}, starting from the beginning")
+        else:
+            mismatched = [k for k in ("input", "input_fingerprint", "output", "model_version")
+                          if checkpoint.get(k) != state[k]]
+            if mismatched:
+                print(f"Checkpoint {CHECKPOINT_PATH} does not match this run ({', '.join(mismatched)} differ); "
+                      f"rerun without PREDICT_RESUME to start over")
+                return
+            if checkpoint["complete"]:
+                print(f"{OUTPUT_CSV} is already complete ({checkpoint['rows']} rows)")
+                return
+            state = checkpoint
+            resume_from = state["position"]
+            print(f"Resuming after {state['rows']} rows ({state['chunks']} chunks)")
+    if resume_from is None:
+        write_checkpoint(CHECKPOINT_PATH, state)
+
+    print(f"Reading {source} in chunks of {PREDICT_CHUNK_SIZE} rows, scoring with {PREDICT_WORKERS} workers...")
+    if OUTPUT_CSV.endswith(".parquet"):
+        output = ParquetOutput(OUTPUT_CSV, resume_from, widen_cols=[] if FEATURE_STORE_DIR else feature_cols)
+    else:
+        output = CsvOutput(OUTPUT_CSV, resume_from)
+
+    sample = None
+    try:
+        chunks = iter_input(feature_cols, PREDICT_CHUNK_SIZE, skip_rows=state["rows"])
+        for chunk, preds in scored_chunks(chunks, feature_cols, version, PREDICT_WORKERS):
+            for col, values in preds.items():
+                chunk[col] = values
+            output.write(chunk)
+            state["rows"] += len(chunk)
+            state["chunks"] += 1
+            state["position"] = output.position()
+            write_checkpoint(CHECKPOINT_PATH, state)
+            print(f"  {state['rows']} rows scored")
+            if sample is None:
+                sample = chunk.head()
+    finally:
+        output.close()
+
+    state["complete"] = True
+    write_checkpoint(CHECKPOINT_PATH, state)
+    print(f"Saved predictions to {OUTPUT_CSV}")
     print("Done!")
-    print("\nSample predictions:")
-    print(df[["user_id", "quiz_id", "pred_quiz_score", "pred_skill_level"]].head())
+    if sample is not None:
+        print("\nSample predictions:")
+        print(sample[["user_id", "quiz_id", "pred_quiz_score", "pred_skill_level"]])
 
 if __name__ == "__main__":
     main()
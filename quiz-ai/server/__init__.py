@@ -1,2 +1,9 @@
 # __init__.py
-from .app import app
+# `uvicorn server:app` still works, but importing server.* submodules (e.g. from the
+# training scripts) no longer loads models or connects to Supabase.
+def __getattr__(name):
+    if name == "app":
+        from .app import app
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module 'server' has no attribute {name!r}")
@@ -1,38 +1,225 @@
 # server/app.py
 import os
-import joblib
 import uuid
 import datetime
-from fastapi import FastAPI, HTTPException
+import threading
+import anyio
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from server.feature_builder import build_features_from_submission
+from server.feature_builder import build_feature_matrix, build_feature_matrix_columnar
+from server.result_writer import ResultWriter
+from server.user_history import UserHistoryStore, history_features
+from server.progress import ProgressStore, class_summary, learner_summary
+from server.drift import DriftMonitor, compare as compare_drift
+from server.model_registry import ModelRegistry
+from server.prediction_cache import PredictionCache, feature_key, stored_key, submission_key
+from server.metrics import ServerMetrics, MetricsMiddleware, lap, set_model_version
+from server.columnar import parse_columnar
+from server.serialization import FastJSONResponse, UnsupportedMediaType, decode_body
+from server.batcher import MicroBatcher
 import numpy as np
 
 load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_KEY = os.environ["SUPABASE_KEY"]
 MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(os.path.dirname(__file__), "../models"))
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(MODEL_DIR, "registry"))
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", 5))
 PORT = int(os.environ.get("PORT", 8000))
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 1000))
+# "fused" evaluates all boosters in one vectorized pass, "lightgbm" calls Booster.predict
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "fused")
+# LightGBM threads per predict call (0 = LightGBM's default); server/serve.py sets it per worker
+LGBM_NUM_THREADS = int(os.environ.get("LGBM_NUM_THREADS", 0))
+# threads running sync endpoints, i.e. concurrent model calls per process (0 = anyio's default of 40)
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", 0))
+# write-behind settings for quiz_results inserts
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", 10000))
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 200))
+WRITE_FLUSH_SECONDS = float(os.environ.get("WRITE_FLUSH_SECONDS", 0.5))
+WRITE_MAX_RETRIES = int(os.environ.get("WRITE_MAX_RETRIES", 5))
+# unique column of quiz_results that makes inserts idempotent across workers; "" = plain
+# inserts. Opt-in, as the column has to exist first:
+#   ALTER TABLE quiz_results ADD COLUMN submission_key text UNIQUE;
+# then WRITE_UNIQUE_COLUMN=submission_key. Submissions without a start_time get a NULL
+# key, which never conflicts, so they are always inserted.
+WRITE_UNIQUE_COLUMN = os.environ.get("WRITE_UNIQUE_COLUMN", "")
+WRITE_SPILL_PATH = os.environ.get("WRITE_SPILL_PATH", os.path.join(os.path.dirname(__file__), "../quiz_results_spill.jsonl"))
+# per-user rolling aggregates (hist_* feature columns)
+USER_HISTORY_DB = os.environ.get("USER_HISTORY_DB", os.path.join(os.path.dirname(__file__), "../user_history.sqlite"))
+USER_HISTORY_DECAY = float(os.environ.get("USER_HISTORY_DECAY", 0.8))
+# No model built by etl/ and train/ reads hist_* columns yet (the ETL does not produce
+# them), so by default the history is recorded for every submission, off the request
+# path, to have it built up when such a model is deployed. 0 records it only while the
+# served model reads hist_* columns.
+USER_HISTORY_ALWAYS = os.environ.get("USER_HISTORY_ALWAYS", "1") == "1"
+# learner/class progress rollups and result history: an SQLite path or a postgres:// URL
+PROGRESS_DB = os.environ.get("PROGRESS_DB", os.path.join(os.path.dirname(__file__), "../progress.sqlite"))
+PROGRESS_TREND_DAYS = int(os.environ.get("PROGRESS_TREND_DAYS", 90))
+# drift sketches of live traffic; workers share them through snapshot files here ("" = this process only)
+DRIFT_SNAPSHOT_DIR = os.environ.get("DRIFT_SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "../drift"))
+DRIFT_FLUSH_SECONDS = float(os.environ.get("DRIFT_FLUSH_SECONDS", 10))
+# prediction caches (0 entries disables them)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", 300))
+# requests slower than this are logged with a per-stage breakdown
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 1.0))
+# fraction of requests run under cProfile; slow ones are dumped to PROFILE_DIR (0 = off)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "../profiles"))
+# micro-batching of concurrent /predict calls: wait up to the window for more requests,
+# at most PREDICT_BATCH_MAX per batch (PREDICT_BATCH_MAX=1 scores every request on its own)
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", 2))
+PREDICT_BATCH_MAX = int(os.environ.get("PREDICT_BATCH_MAX", 64))
+PREDICT_BATCH_CONCURRENCY = int(os.environ.get("PREDICT_BATCH_CONCURRENCY", 2))
+
+metrics = ServerMetrics(
+    slow_seconds=SLOW_REQUEST_SECONDS,
+    profile_sample_rate=PROFILE_SAMPLE_RATE,
+    profile_dir=PROFILE_DIR,
+)
+write_seconds = metrics.registry.histogram(
+    "quiz_result_write_seconds", "Latency of quiz_results insert attempts in seconds.", ("outcome",))
+
+def observe_write(seconds, n_rows, ok):
+    write_seconds.observe(seconds, "ok" if ok else "error")
+
+batch_size = metrics.registry.histogram(
+    "quiz_predict_batch_size", "Submissions per micro-batch of /predict calls.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+batch_wait_seconds = metrics.registry.histogram(
+    "quiz_predict_batch_wait_seconds", "Time a /predict call waited in the micro-batch queue in seconds.")
+batch_seconds = metrics.registry.histogram(
+    "quiz_predict_batch_seconds", "Time to score one micro-batch in seconds.")
+
+def observe_batch(n, waits, seconds):
+    batch_size.observe(n)
+    for w in waits:
+        batch_wait_seconds.observe(w)
+    batch_seconds.observe(seconds)
+
+def update_progress(rows):
+    # runs on the result writer thread once the rows are stored; best-effort like the
+    # rest, a failed update never loses the stored results
+    try:
+        progress.update_many([{"class_id": r.get("_class_id")} for r in rows], rows)
+    except Exception as e:
+        print("Progress update error:", e)
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+result_writer = ResultWriter(
+    supabase,
+    table="quiz_results",
+    max_queue=WRITE_QUEUE_SIZE,
+    batch_size=WRITE_BATCH_SIZE,
+    flush_interval=WRITE_FLUSH_SECONDS,
+    max_retries=WRITE_MAX_RETRIES,
+    spill_path=WRITE_SPILL_PATH,
+    on_write=observe_write,
+    unique_on=WRITE_UNIQUE_COLUMN or None,
+    on_stored=update_progress,
+)
+user_history = UserHistoryStore(USER_HISTORY_DB, decay=USER_HISTORY_DECAY)
+progress = ProgressStore(PROGRESS_DB, trend_days=PROGRESS_TREND_DAYS)
+drift_monitor = DriftMonitor(DRIFT_SNAPSHOT_DIR, flush_interval=DRIFT_FLUSH_SECONDS)
+
+# models are served from the versioned registry (falls back to the legacy pickles in MODEL_DIR)
+registry = ModelRegistry(
+    MODEL_REGISTRY_DIR,
+    legacy_dir=MODEL_DIR,
+    poll_interval=MODEL_POLL_SECONDS,
+    use_fused=INFERENCE_ENGINE == "fused",
+    num_threads=LGBM_NUM_THREADS,
+)
+registry.load_current()
+
+# model outputs keyed on the feature vector, and returned results keyed on the
+# submission itself so retries get the same answer (only submissions with a start_time
+# have such a key). The result cache is per worker: a retry that reaches another worker
+# is scored again, and WRITE_UNIQUE_COLUMN, if set, keeps the store from holding it twice.
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+result_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+# per-feature contributions for /explain, keyed on the feature vector
+explain_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
 
-# load models & meta
-meta = joblib.load(f"{MODEL_DIR}/meta.pkl")
-feature_cols = meta["feature_cols"]
-weak_cols = meta["weak_cols"]
+def invalidate_caches(old_bundle, new_bundle):
+    prediction_cache.clear()
+    result_cache.clear()
+    explain_cache.clear()
 
-reg_model = joblib.load(f"{MODEL_DIR}/lgb_reg_quiz_score.pkl")
-cls_model = joblib.load(f"{MODEL_DIR}/lgb_cls_skill_level.pkl")
-conf_model = joblib.load(f"{MODEL_DIR}/lgb_reg_confidence.pkl")
-weak_models = {}
-for w in weak_cols:
-    path = f"{MODEL_DIR}/lgb_weak_{w}.pkl"
-    if os.path.exists(path):
-        weak_models[w] = joblib.load(path)
+registry.on_swap(invalidate_caches)
+
+# scrape-time gauges and counters
+metrics.registry.gauge("quiz_result_queue_depth", "Results waiting in the write-behind queue.").set_function(
+    result_writer.pending)
+metrics.registry.gauge("quiz_user_history_queue_depth", "Submissions waiting to be folded into user history.").set_function(
+    user_history.pending)
+metrics.registry.counter("quiz_result_writer_events_total", "Write-behind queue events (rows, batches, retries).", ("event",)).set_function(
+    lambda: {(k,): v for k, v in result_writer.stats.items()})
+metrics.registry.gauge("quiz_cache_entries", "Entries held by each prediction cache.", ("cache",)).set_function(
+    lambda: {("predictions",): len(prediction_cache), ("submissions",): len(result_cache),
+             ("explanations",): len(explain_cache)})
+metrics.registry.counter("quiz_cache_lookups_total", "Prediction cache lookups by result.", ("cache", "result")).set_function(
+    lambda: {
+        ("predictions", "hit"): prediction_cache.hits, ("predictions", "miss"): prediction_cache.misses,
+        ("submissions", "hit"): result_cache.hits, ("submissions", "miss"): result_cache.misses,
+        ("explanations", "hit"): explain_cache.hits, ("explanations", "miss"): explain_cache.misses,
+    })
+metrics.registry.gauge("quiz_predict_batch_queue_depth", "/predict calls waiting for a micro-batch.").set_function(
+    lambda: batcher.pending() if batcher is not None else 0)
+metrics.registry.gauge("quiz_model_info", "The model version currently served.", ("model_version", "engine")).set_function(
+    lambda: {(registry.active().version, INFERENCE_ENGINE): 1})
+
+skill_map = {0: "Beginner", 1: "Intermediate", 2: "Advanced"}
 
 app = FastAPI(title="Quiz AI Inference API")
+app.add_middleware(MetricsMiddleware, metrics=metrics, paths=["/predict", "/predict/batch", "/predict/columnar", "/predict/columnar/batch",
+                                                               "/explain", "/explain/batch", "/health", "/cache/stats", "/drift"])
+
+# set once the models are warm in this process; /ready answers 503 until then
+ready = threading.Event()
+
+@app.on_event("startup")
+async def size_threadpool():
+    if THREADPOOL_SIZE > 0:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+@app.on_event("startup")
+def start_result_writer():
+    # uvicorn only starts accepting connections after the startup handlers, so the
+    # first request never pays for loading models or LightGBM's first-call setup
+    registry.active().warmup()
+    result_writer.start()
+    user_history.start()
+    registry.start_watcher()
+    drift_monitor.start()
+    ready.set()
+
+@app.on_event("startup")
+async def start_batcher():
+    if batcher is not None:
+        batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    # score whatever is still queued while the result writer is running
+    if batcher is not None:
+        await batcher.stop()
+
+@app.on_event("shutdown")
+def stop_result_writer():
+    ready.clear()
+    # drain queued results before the process exits
+    registry.stop_watcher()
+    drift_monitor.stop()
+    result_writer.stop()
+    user_history.stop()
+    user_history.close()
+    progress.close()
 
 class ResponseItem(BaseModel):
     question_id: str
@@ -44,69 +231,388 @@ class ResponseItem(BaseModel):
 class QuizSubmission(BaseModel):
     user_id: str
     quiz_id: str
+    # optional: the result is also rolled up into this class's progress
+    class_id: str | None = None
     responses: list[ResponseItem]
     start_time: str | None = None
     end_time: str | None = None
 
-@app.post("/predict")
-def predict(sub: QuizSubmission):
-    # convert to dict
-    submission = sub.dict()
-    # build raw features
-    feats = build_features_from_submission(submission, known_topics=[c.replace("topic_acc__", "") for c in meta["feature_cols"] if c.startswith("topic_acc__")])
-    # ensure feature order
-    x = []
-    for c in feature_cols:
-        v = feats.get(c)
-        # LightGBM accepts np.nan for missing numeric
-        x.append(np.nan if v is None else v)
-    import numpy as np
-    X = np.array(x).reshape(1, -1)
+class BatchSubmission(BaseModel):
+    submissions: list[QuizSubmission]
 
-    # predictions
-    try:
-        pred_score = float(reg_model.predict(X)[0])
-        pred_score = max(0.0, min(100.0, pred_score))
-        cls_probs = cls_model.predict(X)
-        skill_idx = int(np.argmax(cls_probs, axis=1)[0])
-        skill_map = {0: "Beginner", 1: "Intermediate", 2: "Advanced"}
-        pred_skill = skill_map.get(skill_idx, "Intermediate")
-        pred_conf = float(conf_model.predict(X)[0])
-        pred_conf = float(max(0.0, min(1.0, pred_conf)))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Model prediction error: {e}")
+def score_matrix(bundle, X):
+    """
+    Run every model of the bundle exactly once over the feature matrix X (n_rows x n_features).
+    Returns (scores, skill_levels, confidences, weak_topics) with one entry per row.
+    """
+    timings = {}
+    preds = bundle.predict(X, timings)
+    metrics.observe_models(bundle.version, timings)
+    pred_scores = np.clip(preds["quiz_score"], 0.0, 100.0)
+    skill_idx = np.argmax(preds["skill_level"], axis=1)
+    pred_confs = np.clip(preds["confidence"], 0.0, 1.0)
+    weak_topics = [[] for _ in range(X.shape[0])]
+    for w_col in bundle.weak_models:
+        topic_name = w_col.replace("weak_topic__", "")
+        for i in np.flatnonzero(preds[w_col] > 0.5):
+            weak_topics[i].append(topic_name)
+    skills = [skill_map.get(int(i), "Intermediate") for i in skill_idx]
+    return pred_scores, skills, pred_confs, weak_topics
 
-    # weak topics decisions
-    weak_topics = []
-    for w_col, w_model in weak_models.items():
-        p = float(w_model.predict(X)[0])
-        if p > 0.5:
-            topic_name = w_col.replace("weak_topic__", "")
-            weak_topics.append(topic_name)
+def cached_predictions(bundle, X):
+    """
+    Per-row (score, skill, confidence, weak_topics) for X, running the models only on
+    rows whose feature vector is not already in the prediction cache.
+    """
+    keys = [feature_key(bundle.version, x) for x in X]
+    rows = [prediction_cache.get(k) for k in keys]
+    miss = [i for i, r in enumerate(rows) if r is None]
+    if miss:
+        scores, skills, confs, weak_topics = score_matrix(bundle, X[miss])
+        for j, i in enumerate(miss):
+            rows[i] = (float(scores[j]), skills[j], float(confs[j]), weak_topics[j])
+            prediction_cache.put(keys[i], rows[i])
+    return rows
 
-    # result JSON
-    result = {
+def make_result(submission, score, skill, conf, weak_topics):
+    return {
         "id": str(uuid.uuid4()),
         "user_id": submission["user_id"],
         "quiz_id": submission["quiz_id"],
-        "quiz_score": round(pred_score, 2),
-        "skill_level": pred_skill,
+        "quiz_score": round(float(score), 2),
+        "skill_level": skill,
         "weak_topics": weak_topics,
-        "confidence_score": round(pred_conf, 2),
+        "confidence_score": round(float(conf), 2),
         "taken_at": datetime.datetime.utcnow().isoformat() + "Z"
     }
 
-    # store to Supabase
+def update_history(bundle, submissions):
+    # folded in by the history thread, off the request path; best-effort like the rest
+    if bundle.hist_cols or USER_HISTORY_ALWAYS:
+        user_history.submit(submissions)
+
+def store_results(submissions, results):
+    # hand off to the write-behind queue; the insert happens off the request path, and
+    # the progress rollups follow once it succeeded (the class only goes to the rollups)
+    rows = [dict(r, _class_id=s.get("class_id")) for s, r in zip(submissions, results)]
+    if WRITE_UNIQUE_COLUMN:
+        rows = [dict(r, **{WRITE_UNIQUE_COLUMN: stored_key(s)}) for s, r in zip(submissions, rows)]
+    result_writer.submit(rows)
+
+def observe_drift(bundle, X, rows):
+    # monitoring must never fail a prediction either
+    try:
+        drift_monitor.observe(bundle, X, rows)
+    except Exception as e:
+        print("Drift sketch error:", e)
+
+@metrics.instrument
+def predict_single(submission):
+    # one bundle for the whole request, even if a new version is swapped in meanwhile
+    bundle = registry.active()
+    set_model_version(bundle.version)
+    # a retried submission gets its original result and is not stored twice
+    sub_key = submission_key(bundle.version, submission)
+    previous = result_cache.get(sub_key) if sub_key else None
+    lap("cache")
+    if previous is not None:
+        return FastJSONResponse(previous)
+    # features written straight into the model's column order (np.nan = missing)
+    x = bundle.layout.fill(submission.get("responses", []))
+    lap("features")
+    # learner history before this submission
+    if bundle.hist_cols:
+        hist = history_features(user_history.get(submission["user_id"]), bundle.hist_topics)
+        for j, c in bundle.hist_cols:
+            x[j] = hist[c]
+    lap("history")
+    X = x.reshape(1, -1)
+
+    # predictions
+    try:
+        row = cached_predictions(bundle, X)[0]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model prediction error: {e}")
+    lap("model")
+    observe_drift(bundle, X, [row])
+    lap("drift")
+
+    # result JSON
+    result = make_result(submission, *row)
+    if sub_key:
+        result_cache.put(sub_key, result)
+    store_results([submission], [result])
+    lap("store")
+    update_history(bundle, [submission])
+    lap("history_update")
+    return FastJSONResponse(result)
+
+def submission_matrix(bundle, submissions, build_matrix):
+    """Feature matrix for submissions (built by build_matrix) with the learners' history filled in."""
+    X = build_matrix(submissions, bundle.feature_cols, known_topics=bundle.known_topics)
+    lap("features")
+    if bundle.hist_cols:
+        states = user_history.get_many([s["user_id"] for s in submissions])
+        for i, sub in enumerate(submissions):
+            hist = history_features(states[sub["user_id"]], bundle.hist_topics)
+            for j, c in bundle.hist_cols:
+                X[i, j] = hist[c]
+    lap("history")
+    return X
+
+def predict_many(submissions, build_matrix):
+    """
+    Results for a list of submissions, in order: retried submissions come from the
+    result cache and each distinct new one is scored once, with one feature matrix
+    (built by build_matrix) and one call per booster for all of them.
+    """
+    bundle = registry.active()
+    set_model_version(bundle.version)
+    keys = [submission_key(bundle.version, sub) for sub in submissions]
+    results = [result_cache.get(k) if k else None for k in keys]
+    lap("cache")
+    # score each distinct, not previously seen submission once; one without a key
+    # (no start_time) is never taken for another
+    slots = [k if k else i for i, k in enumerate(keys)]
+    todo = {}
+    for i, k in enumerate(slots):
+        if results[i] is None and k not in todo:
+            todo[k] = i
+    if todo:
+        fresh = [submissions[i] for i in todo.values()]
+        X = submission_matrix(bundle, fresh, build_matrix)
+        try:
+            rows = cached_predictions(bundle, X)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Model prediction error: {e}")
+        lap("model")
+        observe_drift(bundle, X, rows)
+        lap("drift")
+
+        new_results = {}
+        for (k, i), row in zip(todo.items(), rows):
+            new_results[k] = make_result(submissions[i], *row)
+            if keys[i]:
+                result_cache.put(k, new_results[k])
+        results = [r if r is not None else new_results[k] for r, k in zip(results, slots)]
+        store_results(fresh, list(new_results.values()))
+        lap("store")
+        update_history(bundle, fresh)
+        lap("history_update")
+    return results
+
+def predict_coalesced(submissions):
+    return predict_many(submissions, build_feature_matrix)
+
+# concurrent /predict calls are scored together; see server/batcher.py
+batcher = (MicroBatcher(predict_coalesced, window=PREDICT_BATCH_WINDOW_MS / 1000.0, max_batch=PREDICT_BATCH_MAX,
+                        max_concurrency=PREDICT_BATCH_CONCURRENCY, on_batch=observe_batch)
+           if PREDICT_BATCH_MAX > 1 else None)
+
+@app.post("/predict")
+async def predict(sub: QuizSubmission):
+    # convert to dict
+    submission = sub.dict()
+    if batcher is None:
+        return await run_in_threadpool(predict_single, submission)
+    set_model_version(registry.active().version)
+    lap("parse")
+    result = await batcher.submit(submission)
+    lap("batch")
+    return FastJSONResponse(result)
+
+@app.post("/predict/batch")
+@metrics.instrument
+def predict_batch(batch: BatchSubmission):
+    if len(batch.submissions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(batch.submissions)} > {MAX_BATCH_SIZE}")
+    if not batch.submissions:
+        return FastJSONResponse({"results": []})
+    results = predict_many([s.dict() for s in batch.submissions], build_feature_matrix)
+    return FastJSONResponse({"results": results})
+
+def decode_columnar(body, content_type, batch):
+    """Decode and validate a columnar request body into a list of columnar submissions."""
+    try:
+        payload = decode_body(body, content_type)
+    except UnsupportedMediaType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed body: {e}")
+    items = payload.get("submissions") if batch and isinstance(payload, dict) else [payload]
+    if not isinstance(items, list):
+        raise HTTPException(status_code=422, detail="Expected {\"submissions\": [...]}")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(items)} > {MAX_BATCH_SIZE}")
+    try:
+        submissions = [parse_columnar(item) for item in items]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid columnar submission: {e}")
+    lap("decode")
+    return submissions
+
+@metrics.instrument
+def predict_columnar_body(body, content_type, batch):
+    submissions = decode_columnar(body, content_type, batch)
+    if not submissions:
+        return FastJSONResponse({"results": []})
+    results = predict_many(submissions, build_feature_matrix_columnar)
+    return FastJSONResponse({"results": results} if batch else results[0])
+
+# columnar payloads (see server/columnar.py) as JSON or msgpack; the body is decoded
+# by hand so there is no per-response pydantic validation
+@app.post("/predict/columnar")
+async def predict_columnar(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(predict_columnar_body, body, request.headers.get("content-type"), False)
+
+@app.post("/predict/columnar/batch")
+async def predict_columnar_batch(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(predict_columnar_body, body, request.headers.get("content-type"), True)
+
+def cached_contributions(bundle, X):
+    """Per-row {model: contributions} for X, computing only rows not in the explanation cache."""
+    keys = [feature_key(bundle.version, x) for x in X]
+    rows = [explain_cache.get(k) for k in keys]
+    miss = [i for i, r in enumerate(rows) if r is None]
+    if miss:
+        # one pred_contrib call per booster for all uncached rows
+        contrib = bundle.explain(X[miss])
+        for j, i in enumerate(miss):
+            rows[i] = {name: c[j] for name, c in contrib.items()}
+            explain_cache.put(keys[i], rows[i])
+    return rows
+
+def _ranked_contributions(feature_cols, contrib, top):
+    values = contrib[:-1]
+    order = np.argsort(-np.abs(values), kind="stable")
+    if top > 0:
+        order = order[:top]
+    return {
+        "base_value": float(contrib[-1]),
+        "contributions": {feature_cols[j]: float(values[j]) for j in order},
+    }
+
+def format_explanation(bundle, row, top):
+    models = {}
+    for name, contrib in row.items():
+        if contrib.ndim == 2:
+            # multiclass: one explanation per class
+            labels = [skill_map.get(k, str(k)) if name == "skill_level" else str(k) for k in range(len(contrib))]
+            models[name] = {"classes": {label: _ranked_contributions(bundle.feature_cols, c, top)
+                                        for label, c in zip(labels, contrib)}}
+        else:
+            models[name] = _ranked_contributions(bundle.feature_cols, contrib, top)
+    return models
+
+def explain_many(submissions, top):
+    bundle = registry.active()
+    set_model_version(bundle.version)
+    X = submission_matrix(bundle, submissions, build_feature_matrix)
     try:
-        resp = supabase.table("quiz_results").insert(result).execute()
-        # resp.data may contain row; ignore for now
+        rows = cached_contributions(bundle, X)
     except Exception as e:
-        # log error but still return prediction
-        print("Supabase insert error:", e)
+        raise HTTPException(status_code=500, detail=f"Model explanation error: {e}")
+    lap("model")
+    return [
+        {"user_id": sub["user_id"], "quiz_id": sub["quiz_id"], "model_version": bundle.version,
+         "models": format_explanation(bundle, row, top)}
+        for sub, row in zip(submissions, rows)
+    ]
+
+# Why a submission got its scores: per-feature contributions of every model, in raw
+# score space (log-odds for the classifiers), largest first; ?top=N keeps the N largest.
+# Read-only: nothing is stored, and the history features are the learner's current ones.
+@app.post("/explain")
+@metrics.instrument
+def explain(sub: QuizSubmission, top: int = 0):
+    return FastJSONResponse(explain_many([sub.dict()], top)[0])
+
+@app.post("/explain/batch")
+@metrics.instrument
+def explain_batch(batch: BatchSubmission, top: int = 0):
+    if len(batch.submissions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(batch.submissions)} > {MAX_BATCH_SIZE}")
+    if not batch.submissions:
+        return FastJSONResponse({"results": []})
+    return FastJSONResponse({"results": explain_many([s.dict() for s in batch.submissions], top)})
+
+# Progress for dashboards, served from the rollups (the cost does not grow with the
+# number of attempts); ?days= sets the trend window, ?top= the weak topics listed.
+# Results are rolled up once they are stored, so progress trails /predict by the
+# write-behind delay (and a result that is never stored is never counted).
+@app.get("/progress/learners/{user_id}")
+def learner_progress(user_id: str, days: int = Query(30, ge=1), top: int = Query(5, ge=0)):
+    state = progress.learner(user_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No results for learner {user_id}")
+    return FastJSONResponse(learner_summary(user_id, state, min(days, PROGRESS_TREND_DAYS), top))
+
+# a learner's results, newest first; pass next_cursor back as ?cursor= for the next page
+@app.get("/progress/learners/{user_id}/history")
+def learner_history(user_id: str, limit: int = Query(50, ge=1, le=500), cursor: int | None = None):
+    items, next_cursor = progress.history(user_id, limit, before=cursor)
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
 
-    return result
+@app.get("/progress/classes/{class_id}")
+def classroom_progress(class_id: str, days: int = Query(30, ge=1), top: int = Query(5, ge=0)):
+    state = progress.classroom(class_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No results for class {class_id}")
+    return FastJSONResponse(class_summary(class_id, state, min(days, PROGRESS_TREND_DAYS), top))
+
+# a class's learners by user_id with their current level, paged like the history
+@app.get("/progress/classes/{class_id}/learners")
+def classroom_learners(class_id: str, limit: int = Query(50, ge=1, le=500), cursor: str | None = None):
+    items, next_cursor = progress.class_learners(class_id, limit, after=cursor)
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+# Traffic seen by the running workers since they started vs the training baseline of the
+# active model (snapshots of stopped or crashed workers are dropped):
+# per-column PSI, null rates and quantiles, most shifted first (?top=N keeps N columns).
+@app.get("/drift")
+def drift(top: int = Query(0, ge=0)):
+    bundle = registry.active()
+    merged, workers = drift_monitor.merged(bundle)
+    report = compare_drift(merged, top)
+    report["workers"] = workers
+    if not merged.baseline["rows"]:
+        report["detail"] = "This model version has no training baseline; retrain to record one."
+    return FastJSONResponse(report)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "model_version": registry.active().version,
+        "predictions": prediction_cache.stats(),
+        "submissions": result_cache.stats(),
+        "explanations": explain_cache.stats(),
+    }
+
+@app.get("/predict/batcher/stats")
+def batcher_stats():
+    if batcher is None:
+        return {"enabled": False}
+    return dict(batcher.summary(), enabled=True)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# readiness probe: 503 until this worker's models are warm, and again while it drains
+@app.get("/ready")
+def readiness():
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"status": "ready", "model_version": registry.active().version, "pid": os.getpid()}
 
 # health endpoint
 @app.get("/health")
 def health():
-    return {"status": "ok", "time": datetime.datetime.utcnow().isoformat() + "Z"}
+    return {
+        "status": "ok",
+        "time": datetime.datetime.utcnow().isoformat() + "Z",
+        "model_version": registry.active().version,
+        "pending_writes": result_writer.pending(),
+    }
@@ -0,0 +1,144 @@
+# server/batcher.py
+import time
+import asyncio
+from collections import deque
+from starlette.concurrency import run_in_threadpool
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests into batches.
+
+    Async handlers call `await submit(item)`. A dispatcher task takes the oldest
+    waiting item and keeps collecting until `window` seconds after that item arrived
+    or until `max_batch` items are waiting, then calls `process(items)` in the
+    threadpool; it must return one result per item, in order. Each caller gets its
+    own result, or the exception if the whole batch failed.
+
+    The window adapts to load: an item that arrives while nothing else is queued or
+    being processed is dispatched straight away, so a lone request pays no wait, and
+    items that pile up while up to `max_concurrency` batches are busy go out together.
+
+    `on_batch`, if given, is called as on_batch(batch_size, waits, seconds), where
+    waits holds each item's time in the queue and seconds is the time in process().
+    """
+
+    def __init__(self, process, window=0.005, max_batch=64, max_concurrency=2, on_batch=None):
+        self.process = process
+        self.window = window
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.on_batch = on_batch
+        # (item, future, enqueue time)
+        self._queue = deque()
+        self._arrived = None
+        self._slots = None
+        self._task = None
+        self._batches = set()
+        self._closing = False
+        self._in_flight = 0
+        self.stats = {"requests": 0, "batches": 0, "max_batch_size": 0, "wait_seconds": 0.0,
+                      "max_wait_seconds": 0.0, "failed_batches": 0}
+
+    def start(self):
+        """Start the dispatcher on the running event loop."""
+        self._closing = False
+        self._arrived = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self):
+        """Dispatch everything still queued and wait for running batches to finish."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._arrived.set()
+        await self._task
+        self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    async def submit(self, item):
+        if self._task is None or self._closing:
+            raise RuntimeError("MicroBatcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((item, future, time.perf_counter()))
+        self._arrived.set()
+        return await future
+
+    def pending(self):
+        return len(self._queue)
+
+    def summary(self):
+        s = dict(self.stats)
+        s["mean_batch_size"] = s["requests"] / s["batches"] if s["batches"] else 0.0
+        s["mean_wait_seconds"] = s["wait_seconds"] / s["requests"] if s["requests"] else 0.0
+        s["pending"] = self.pending()
+        s["in_flight_batches"] = self._in_flight
+        s["window_seconds"] = self.window
+        s["max_batch"] = self.max_batch
+        return s
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                if self._closing:
+                    return
+                self._arrived.clear()
+                await self._arrived.wait()
+            if self.window > 0 and not self._closing and (len(self._queue) > 1 or self._in_flight):
+                await self._collect()
+            await self._slots.acquire()
+            # items that arrived while waiting for a free slot join this batch too
+            n = min(len(self._queue), self.max_batch)
+            batch = [self._queue.popleft() for _ in range(n)]
+            self._in_flight += 1
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _collect(self):
+        deadline = self._queue[0][2] + self.window
+        while len(self._queue) < self.max_batch and not self._closing:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _dispatch(self, batch):
+        start = time.perf_counter()
+        waits = [start - enqueued for _, _, enqueued in batch]
+        try:
+            results = await run_in_threadpool(self.process, [item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"process() returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            for _, future, _ in batch:
+                # the caller may have gone away (client disconnect cancels its future)
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            self._observe(batch, waits, time.perf_counter() - start)
+
+    def _observe(self, batch, waits, seconds):
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+        self.stats["wait_seconds"] += sum(waits)
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], max(waits))
+        if self.on_batch is not None:
+            try:
+                self.on_batch(len(batch), waits, seconds)
+            except Exception as e:
+                print("Batch metrics callback error:", e)
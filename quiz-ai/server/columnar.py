@@ -0,0 +1,132 @@
+# server/columnar.py
+"""
+Columnar submission payload: one array per response field instead of one object per
+response.
+
+{
+  "user_id": "...", "quiz_id": "...",
+  "class_id": "...",                      # optional, see server/progress.py
+  "topics": ["spelling", "grammar"],      # vocabulary that topic_ids index into
+  "topic_ids": [0, 1, 1, 0],              # list, or bytes of uint8 (msgpack)
+  "difficulty": [0, 1, 2, 1],             # 0 easy, 1 medium, 2 hard; optional (all medium)
+  "correct": "Cw==",                      # bitmap, bit i = response i (LSB first), base64
+                                          # in JSON / raw bytes in msgpack; a 0/1 list also works
+  "time_taken": [12.3, 8.0, 9.1, 30.2],   # list, or bytes of little-endian float32/float64
+  "question_ids": ["q1", ...],            # optional
+  "start_time": "...", "end_time": "..."  # optional
+}
+
+parse_columnar() validates a decoded payload into a plain dict holding numpy arrays,
+which build_feature_matrix_columnar() and the user history consume without building
+per-response objects.
+"""
+import base64
+import numpy as np
+from server.feature_builder import DIFFICULTIES
+
+MEDIUM = DIFFICULTIES.index("medium")
+
+def _as_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return base64.b64decode(value, validate=True)
+    return None
+
+def _int_array(value, name):
+    raw = _as_bytes(value) if not isinstance(value, str) else None
+    if raw is not None:
+        return np.frombuffer(raw, dtype=np.uint8).astype(np.int64)
+    arr = np.asarray(value)
+    if arr.ndim != 1 or (arr.size and not np.issubdtype(arr.dtype, np.integer)):
+        raise ValueError(f"{name} must be a list of integers")
+    return arr.astype(np.int64)
+
+def _bitmap(value, n):
+    raw = _as_bytes(value)
+    if raw is not None:
+        if len(raw) != (n + 7) // 8:
+            raise ValueError(f"correct bitmap has {len(raw)} bytes, expected {(n + 7) // 8}")
+        return np.unpackbits(np.frombuffer(raw, dtype=np.uint8), count=n, bitorder="little").astype(bool)
+    arr = np.asarray(value)
+    if arr.shape != (n,):
+        raise ValueError(f"correct must have {n} entries")
+    return arr.astype(bool)
+
+def _float_array(value, n):
+    raw = _as_bytes(value) if not isinstance(value, str) else None
+    if raw is not None:
+        if len(raw) == 8 * n:
+            return np.frombuffer(raw, dtype="<f8").astype(np.float64)
+        if len(raw) == 4 * n:
+            return np.frombuffer(raw, dtype="<f4").astype(np.float64)
+        raise ValueError(f"time_taken has {len(raw)} bytes, expected {4 * n} or {8 * n}")
+    arr = np.asarray(value, dtype=np.float64)
+    if arr.shape != (n,):
+        raise ValueError(f"time_taken must have {n} entries")
+    return arr
+
+def parse_columnar(payload):
+    """Validate one decoded columnar payload; raises ValueError when it is malformed."""
+    if not isinstance(payload, dict):
+        raise ValueError("submission must be an object")
+    try:
+        topics = [str(t) for t in payload["topics"]]
+        topic_ids = _int_array(payload["topic_ids"], "topic_ids")
+        n = len(topic_ids)
+        difficulty = (_int_array(payload["difficulty"], "difficulty") if payload.get("difficulty") is not None
+                      else np.full(n, MEDIUM, dtype=np.int64))
+        sub = {
+            "user_id": str(payload["user_id"]),
+            "quiz_id": str(payload["quiz_id"]),
+            "class_id": None if payload.get("class_id") is None else str(payload["class_id"]),
+            "topics": topics,
+            "topic_ids": topic_ids,
+            "difficulty": difficulty,
+            "correct": _bitmap(payload["correct"], n),
+            "time_taken": _float_array(payload["time_taken"], n),
+            "question_ids": payload.get("question_ids"),
+            "start_time": payload.get("start_time"),
+            "end_time": payload.get("end_time"),
+        }
+    except KeyError as e:
+        raise ValueError(f"missing field {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e))
+    if len(difficulty) != n:
+        raise ValueError(f"difficulty must have {n} entries")
+    if n and (topic_ids.min() < 0 or topic_ids.max() >= len(topics)):
+        raise ValueError("topic_ids must index into topics")
+    if n and (difficulty.min() < 0 or difficulty.max() >= len(DIFFICULTIES)):
+        raise ValueError(f"difficulty codes must be 0..{len(DIFFICULTIES) - 1}")
+    return sub
+
+def is_columnar(submission):
+    return "topic_ids" in submission
+
+def to_columnar(submission):
+    """Per-item submission dict -> columnar payload (JSON-ready), e.g. for clients and tests."""
+    responses = submission.get("responses", [])
+    topics = []
+    index = {}
+    topic_ids = []
+    for r in responses:
+        t = r.get("topic", "unknown")
+        if t not in index:
+            index[t] = len(topics)
+            topics.append(t)
+        topic_ids.append(index[t])
+    correct = np.array([bool(r.get("is_correct")) for r in responses], dtype=bool)
+    return {
+        "user_id": submission["user_id"],
+        "quiz_id": submission["quiz_id"],
+        "class_id": submission.get("class_id"),
+        "topics": topics,
+        "topic_ids": topic_ids,
+        "difficulty": [DIFFICULTIES.index(r.get("difficulty", "medium")) for r in responses],
+        "correct": base64.b64encode(np.packbits(correct, bitorder="little").tobytes()).decode(),
+        "time_taken": [float(r.get("time_taken", 0)) for r in responses],
+        "question_ids": [r.get("question_id") for r in responses],
+        "start_time": submission.get("start_time"),
+        "end_time": submission.get("end_time"),
+    }
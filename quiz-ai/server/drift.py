@@ -0,0 +1,381 @@
+# server/drift.py
+"""
+Streaming drift monitoring: does live /predict traffic look like the training data?
+
+train/train_models.py stores a baseline in the bundle manifest (build_baseline): for
+every feature column and numeric model output, bin edges at the training quantiles
+(DRIFT_BINS equal-frequency bins), the rows per bin, null count, min and max; for the
+categorical outputs (skill level, each weak-topic flag), the count of every label.
+
+The server keeps a DriftSketch per model version with the same layout: live rows are
+counted into the baseline's bins, so memory is fixed (columns x bins) whatever the
+traffic, and observing a request is a handful of vectorized numpy operations. Sketches
+are plain counts, so merging the snapshots of several workers is addition.
+
+compare() scores every column with the population stability index over its bins
+(< 0.1 stable, < 0.25 moderate, else major shift), and reports null rates and
+approximate quantiles read off the bins next to the baseline's.
+"""
+import os
+import json
+import glob
+import math
+import time
+import threading
+import numpy as np
+
+SKILL_NAMES = ["Beginner", "Intermediate", "Advanced"]
+# numeric model outputs (features come first, in feature_cols order)
+NUMERIC_OUTPUTS = ["quiz_score", "confidence"]
+QUANTILES = (0.1, 0.5, 0.9)
+# a snapshot not rewritten for this many flush intervals belongs to a worker that is gone
+STALE_FLUSHES = 3
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+
+def _edges(values, bins):
+    v = values[~np.isnan(values)]
+    if not len(v):
+        return []
+    # interior edges at the quantiles; ties collapse (e.g. integer columns)
+    return np.unique(np.quantile(v, np.linspace(0.0, 1.0, bins + 1)[1:-1])).tolist()
+
+def _bin_counts(values, edges):
+    # bin i holds edges[i-1] <= v < edges[i], the same rule DriftSketch.observe uses
+    v = values[~np.isnan(values)]
+    return np.bincount(np.searchsorted(np.asarray(edges, dtype=np.float64), v, side="right"),
+                       minlength=len(edges) + 1).tolist()
+
+def decode_outputs(preds, weak_cols):
+    """Raw bundle outputs -> the values the server returns (clipped scores, skill names, weak flags)."""
+    skill_idx = np.argmax(preds["skill_level"], axis=1)
+    outputs = {
+        "quiz_score": np.clip(preds["quiz_score"], 0.0, 100.0),
+        "confidence": np.clip(preds["confidence"], 0.0, 1.0),
+        "skill_level": [SKILL_NAMES[i] if i < len(SKILL_NAMES) else "Intermediate" for i in skill_idx],
+    }
+    for w_col in weak_cols:
+        if w_col in preds:
+            outputs[w_col] = preds[w_col] > 0.5
+    return outputs
+
+def build_baseline(X, feature_cols, outputs, bins=20):
+    """
+    Training-time reference for the drift monitor. X holds the training features
+    (rows x feature_cols); outputs are decode_outputs() of the models on held-out rows.
+    """
+    numeric = {}
+    columns = [(c, X[:, j]) for j, c in enumerate(feature_cols)]
+    columns += [(c, np.asarray(outputs[c], dtype=np.float64)) for c in NUMERIC_OUTPUTS]
+    for name, values in columns:
+        values = np.asarray(values, dtype=np.float64)
+        present = values[~np.isnan(values)]
+        edges = _edges(values, bins)
+        numeric[name] = {
+            "edges": edges,
+            "counts": _bin_counts(values, edges),
+            "nulls": int(len(values) - len(present)),
+            "min": float(present.min()) if len(present) else None,
+            "max": float(present.max()) if len(present) else None,
+        }
+    categorical = {}
+    for name, values in outputs.items():
+        if name in NUMERIC_OUTPUTS:
+            continue
+        values = np.asarray(values)
+        # weak-topic flags are counted as "true"/"false", like the live sketch does
+        labels = np.where(values, "true", "false") if values.dtype == bool else values.astype(str)
+        names, counts = np.unique(labels, return_counts=True)
+        categorical[name] = {str(l): int(n) for l, n in zip(names, counts)}
+    return {"bins": bins, "rows": int(X.shape[0]), "numeric": numeric, "categorical": categorical}
+
+class DriftSketch:
+    """
+    Fixed-size live counterpart of a baseline for one model version. observe() takes
+    the feature matrix of scored submissions and their result rows
+    (score, skill, confidence, weak_topics); snapshot()/merge() move counts between workers.
+    """
+
+    def __init__(self, version, feature_cols, weak_cols, baseline=None):
+        self.version = version
+        self.baseline = baseline or {"bins": 0, "rows": 0, "numeric": {}, "categorical": {}}
+        self.numeric_cols = list(feature_cols) + NUMERIC_OUTPUTS
+        self.weak_cols = list(weak_cols)
+        edges = [self.baseline["numeric"].get(c, {}).get("edges", []) for c in self.numeric_cols]
+        width = max((len(e) for e in edges), default=0)
+        # padded with +inf, so a column with fewer edges never reaches its unused bins
+        self._edges = np.full((len(self.numeric_cols), width), np.inf)
+        for i, e in enumerate(edges):
+            self._edges[i, :len(e)] = e
+        self._n_bins = width + 1
+        self._offsets = np.arange(len(self.numeric_cols)) * self._n_bins
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        k = len(self.numeric_cols)
+        with self._lock:
+            self.rows = 0
+            self.counts = np.zeros((k, self._n_bins), dtype=np.int64)
+            self.nulls = np.zeros(k, dtype=np.int64)
+            self.mins = np.full(k, np.inf)
+            self.maxs = np.full(k, -np.inf)
+            self.skills = {}
+            self.weak = np.zeros(len(self.weak_cols), dtype=np.int64)
+
+    def observe(self, X, rows):
+        n = len(rows)
+        if not n:
+            return
+        V = np.empty((n, len(self.numeric_cols)))
+        V[:, :X.shape[1]] = X
+        V[:, -2] = [r[0] for r in rows]
+        V[:, -1] = [r[2] for r in rows]
+        null = np.isnan(V)
+        bins = (V[:, :, None] >= self._edges).sum(axis=2)
+        counts = np.bincount((bins + self._offsets)[~null], minlength=self.counts.size).reshape(self.counts.shape)
+        lo, hi = np.fmin.reduce(V, axis=0), np.fmax.reduce(V, axis=0)
+        weak = [set(r[3]) for r in rows]
+        flags = np.array([sum(1 for w in weak if c[len("weak_topic__"):] in w) for c in self.weak_cols], dtype=np.int64)
+        with self._lock:
+            self.rows += n
+            self.counts += counts
+            self.nulls += null.sum(axis=0)
+            np.fmin(self.mins, lo, out=self.mins)
+            np.fmax(self.maxs, hi, out=self.maxs)
+            for r in rows:
+                self.skills[r[1]] = self.skills.get(r[1], 0) + 1
+            self.weak += flags
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "rows": self.rows,
+                "counts": self.counts.tolist(),
+                "nulls": self.nulls.tolist(),
+                "mins": [None if math.isinf(v) else v for v in self.mins.tolist()],
+                "maxs": [None if math.isinf(v) else v for v in self.maxs.tolist()],
+                "skills": dict(self.skills),
+                "weak": self.weak.tolist(),
+            }
+
+    def merge(self, snapshot):
+        """Add another worker's snapshot (same version) into this sketch."""
+        if snapshot["version"] != self.version:
+            raise ValueError(f"cannot merge a {snapshot['version']} sketch into {self.version}")
+        mins = np.array([np.inf if v is None else v for v in snapshot["mins"]])
+        maxs = np.array([-np.inf if v is None else v for v in snapshot["maxs"]])
+        with self._lock:
+            self.rows += snapshot["rows"]
+            self.counts += np.asarray(snapshot["counts"], dtype=np.int64)
+            self.nulls += np.asarray(snapshot["nulls"], dtype=np.int64)
+            np.fmin(self.mins, mins, out=self.mins)
+            np.fmax(self.maxs, maxs, out=self.maxs)
+            for label, n in snapshot["skills"].items():
+                self.skills[label] = self.skills.get(label, 0) + n
+            self.weak += np.asarray(snapshot["weak"], dtype=np.int64)
+        return self
+
+    def categorical_counts(self):
+        out = {"skill_level": dict(self.skills)}
+        for c, n in zip(self.weak_cols, self.weak.tolist()):
+            out[c] = {"true": n, "false": self.rows - n}
+        return out
+
+def psi(expected, actual, eps=1e-4):
+    """Population stability index between two count vectors (smoothed so empty bins stay finite)."""
+    e = np.asarray(expected, dtype=np.float64)
+    a = np.asarray(actual, dtype=np.float64)
+    if e.sum() == 0 or a.sum() == 0:
+        return None
+    e = np.maximum(e / e.sum(), eps)
+    a = np.maximum(a / a.sum(), eps)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+def approx_quantiles(counts, edges, lo, hi, qs=QUANTILES):
+    """Quantiles read off binned counts, interpolating linearly inside each bin."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if total == 0 or lo is None:
+        return {str(q): None for q in qs}
+    bounds = [lo] + list(edges[:len(counts) - 1]) + [hi]
+    cum = np.cumsum(counts)
+    out = {}
+    for q in qs:
+        k = int(np.searchsorted(cum, q * total))
+        k = min(k, len(counts) - 1)
+        left, right = max(bounds[k], lo), min(bounds[k + 1], hi)
+        before = cum[k] - counts[k]
+        frac = (q * total - before) / counts[k] if counts[k] else 0.0
+        out[str(q)] = float(left + (right - left) * frac)
+    return out
+
+def _status(value):
+    if value is None:
+        return "unknown"
+    return "stable" if value < PSI_MODERATE else "moderate" if value < PSI_MAJOR else "major"
+
+def compare(sketch, top=0):
+    """Drift report of a (merged) live sketch against its baseline, most shifted columns first."""
+    base = sketch.baseline
+    columns = []
+    for i, name in enumerate(sketch.numeric_cols):
+        b = base["numeric"].get(name)
+        live = sketch.counts[i, :len(b["counts"])] if b else sketch.counts[i, :1]
+        present = int(live.sum())
+        entry = {
+            "column": name,
+            "kind": "output" if name in NUMERIC_OUTPUTS else "feature",
+            "null_rate": float(sketch.nulls[i] / sketch.rows) if sketch.rows else None,
+            "live_quantiles": approx_quantiles(live, b["edges"] if b else [],
+                                               None if math.isinf(sketch.mins[i]) else float(sketch.mins[i]),
+                                               None if math.isinf(sketch.maxs[i]) else float(sketch.maxs[i])),
+            "live_min": None if not present else float(sketch.mins[i]),
+            "live_max": None if not present else float(sketch.maxs[i]),
+        }
+        if b:
+            base_rows = sum(b["counts"]) + b["nulls"]
+            entry.update(
+                psi=psi(b["counts"], live),
+                baseline_null_rate=b["nulls"] / base_rows if base_rows else None,
+                baseline_quantiles=approx_quantiles(b["counts"], b["edges"], b["min"], b["max"]),
+                baseline_min=b["min"],
+                baseline_max=b["max"],
+            )
+        else:
+            entry["psi"] = None
+        entry["status"] = _status(entry["psi"])
+        columns.append(entry)
+    for name, live in sketch.categorical_counts().items():
+        b = base["categorical"].get(name, {})
+        labels = sorted(set(b) | set(live))
+        value = psi([b.get(l, 0) for l in labels], [live.get(l, 0) for l in labels]) if b else None
+        columns.append({"column": name, "kind": "output", "live_counts": live, "baseline_counts": b,
+                        "psi": value, "status": _status(value)})
+    columns.sort(key=lambda c: -1.0 if c["psi"] is None else c["psi"], reverse=True)
+    if top > 0:
+        columns = columns[:top]
+    scored = [c["psi"] for c in columns if c["psi"] is not None]
+    return {
+        "model_version": sketch.version,
+        "rows": sketch.rows,
+        "baseline_rows": base["rows"],
+        "status": _status(max(scored)) if scored else "unknown",
+        "columns": columns,
+    }
+
+class DriftMonitor:
+    """
+    This process's sketch for the active model version, plus the snapshot files through
+    which pre-forked workers share theirs: each worker rewrites
+    <snapshot_dir>/<version>/worker-<pid>.json every `flush_interval` seconds and
+    removes it on stop(). merged() adds this worker's sketch to the snapshots of the
+    other running workers; files older than STALE_FLUSHES intervals (a worker that
+    crashed, or an earlier server run) are skipped and deleted.
+    """
+
+    def __init__(self, snapshot_dir=None, flush_interval=10.0):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval
+        self._sketch = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sketch(self, bundle):
+        """The live sketch for bundle's version (a new model version starts a new one)."""
+        sketch = self._sketch
+        if sketch is None or sketch.version != bundle.version:
+            with self._lock:
+                if self._sketch is None or self._sketch.version != bundle.version:
+                    if self._sketch is not None:
+                        self.flush()
+                    self._sketch = DriftSketch(bundle.version, bundle.feature_cols, bundle.weak_cols,
+                                               bundle.manifest.get("drift_baseline"))
+                sketch = self._sketch
+        return sketch
+
+    def observe(self, bundle, X, rows):
+        self.sketch(bundle).observe(X, rows)
+
+    def _path(self, version):
+        return os.path.join(self.snapshot_dir, version, f"worker-{os.getpid()}.json")
+
+    def flush(self):
+        sketch = self._sketch
+        if not self.snapshot_dir or sketch is None or not sketch.rows:
+            return
+        path = self._path(sketch.version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(sketch.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _is_stale(self, path, now):
+        return now - os.path.getmtime(path) > STALE_FLUSHES * self.flush_interval
+
+    def prune(self):
+        """Delete the snapshots of workers that stopped writing them."""
+        if not self.snapshot_dir:
+            return
+        now = time.time()
+        for path in glob.glob(os.path.join(self.snapshot_dir, "*", "worker-*.json")):
+            try:
+                if self._is_stale(path, now):
+                    os.remove(path)
+            except OSError:
+                # another worker pruned it first
+                pass
+
+    def merged(self, bundle):
+        """This worker's live sketch plus the latest snapshot of every other running worker."""
+        live = self.sketch(bundle)
+        merged = DriftSketch(live.version, live.numeric_cols[:-len(NUMERIC_OUTPUTS)], live.weak_cols, live.baseline)
+        merged.merge(live.snapshot())
+        workers = 1
+        if self.snapshot_dir:
+            own = self._path(live.version)
+            now = time.time()
+            for path in glob.glob(os.path.join(self.snapshot_dir, live.version, "worker-*.json")):
+                if path == own:
+                    continue
+                try:
+                    if self._is_stale(path, now):
+                        continue
+                    with open(path) as f:
+                        merged.merge(json.load(f))
+                    workers += 1
+                except (OSError, ValueError) as e:
+                    print(f"Skipping drift snapshot {path}:", e)
+        return merged, workers
+
+    def start(self):
+        if self.snapshot_dir and (self._thread is None or not self._thread.is_alive()):
+            self.prune()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="drift-snapshots", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 1.0)
+            self._thread = None
+        # this worker's counts leave the merged view with it
+        sketch = self._sketch
+        if self.snapshot_dir and sketch is not None:
+            try:
+                os.remove(self._path(sketch.version))
+            except FileNotFoundError:
+                pass
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.prune()
+            except Exception as e:
+                print("Drift snapshot error:", e)
@@ -1,5 +1,6 @@
 # server/feature_builder.py
 import json
+import math
 import numpy as np
 from collections import defaultdict
 
@@ -63,3 +64,170 @@ def build_features_from_submission(submission: dict, known_topics: list = None):
 
     # final features - order will be controlled by meta.feature_cols
     return feat
+
+DIFFICULTIES = ("easy", "medium", "hard")
+TOPIC_PREFIX = "topic_acc__"
+# submission-level features, in the order FeatureLayout.fill computes them
+BASE_FEATURES = ("correct_count", "total_questions", "avg_time", "median_time", "time_std")
+
+class FeatureLayout:
+    """
+    A model's feature layout compiled once from its feature_cols: the column of each
+    base feature, difficulty and known topic. fill() writes one submission's features
+    straight into a float64 row in that order with a single pass over the responses,
+    giving the same values as build_features_from_submission() re-ordered by
+    feature_cols. Columns it does not compute (hist_*) stay NaN for the caller.
+    """
+
+    def __init__(self, feature_cols):
+        self.feature_cols = list(feature_cols)
+        self.width = len(self.feature_cols)
+        index = {c: j for j, c in enumerate(self.feature_cols)}
+        self.known_topics = [c[len(TOPIC_PREFIX):] for c in self.feature_cols if c.startswith(TOPIC_PREFIX)]
+        # accumulator slots: one per difficulty, then one per known topic
+        self.difficulty_slot = {d: i for i, d in enumerate(DIFFICULTIES)}
+        self.topic_slot = {t: len(DIFFICULTIES) + i for i, t in enumerate(self.known_topics)}
+        self.n_slots = len(DIFFICULTIES) + len(self.known_topics)
+        # output column of each slot and base feature (-1: not a model feature)
+        self.slot_cols = ([index.get(f"{d}_acc", -1) for d in DIFFICULTIES]
+                          + [index[TOPIC_PREFIX + t] for t in self.known_topics])
+        self.base_cols = [index.get(c, -1) for c in BASE_FEATURES]
+        self._empty = np.full(self.width, np.nan)
+
+    def fill(self, responses, out=None):
+        """Features of one submission's responses; written into `out` (overwritten) when given."""
+        if out is None:
+            out = self._empty.copy()
+        else:
+            out.fill(np.nan)
+        tot = [0] * self.n_slots
+        cor = [0] * self.n_slots
+        times = []
+        correct = 0
+        difficulty_slot, topic_slot = self.difficulty_slot, self.topic_slot
+        for r in responses:
+            c = 1 if r.get("is_correct") else 0
+            correct += c
+            times.append(max(0.001, float(r.get("time_taken", 0))))
+            i = difficulty_slot.get(r.get("difficulty", "medium"))
+            if i is not None:
+                tot[i] += 1
+                cor[i] += c
+            i = topic_slot.get(r.get("topic", "unknown"))
+            if i is not None:
+                tot[i] += 1
+                cor[i] += c
+        n = len(times)
+        if n:
+            avg_time = sum(times) / n
+            ordered = sorted(times)
+            median_time = (ordered[(n - 1) // 2] + ordered[n // 2]) / 2.0
+            time_std = math.sqrt(sum((t - avg_time) ** 2 for t in times) / n)
+        else:
+            avg_time = median_time = time_std = 0.0
+        for j, v in zip(self.base_cols, (correct, n, avg_time, median_time, time_std)):
+            if j >= 0:
+                out[j] = v
+        for i, j in enumerate(self.slot_cols):
+            if j >= 0 and tot[i]:
+                out[j] = cor[i] / tot[i]
+        return out
+
+def build_feature_matrix(submissions: list, feature_cols: list, known_topics: list = None):
+    """
+    Vectorized counterpart of build_features_from_submission for many submissions at once.
+    All responses are flattened into arrays tagged with their submission index, and the
+    per-submission aggregates are computed with bincount/lexsort instead of Python dicts.
+    Returns a float64 array of shape (len(submissions), len(feature_cols)) in feature_cols
+    order, with np.nan for missing values (same convention as the single-row path).
+    """
+    n = len(submissions)
+    if known_topics is None:
+        known_topics = [c.replace("topic_acc__", "") for c in feature_cols if c.startswith("topic_acc__")]
+    topic_idx = {t: i for i, t in enumerate(known_topics)}
+    diff_idx = {d: i for i, d in enumerate(DIFFICULTIES)}
+
+    per_sub = [s.get("responses", []) for s in submissions]
+    counts = np.fromiter((len(r) for r in per_sub), dtype=np.int64, count=n)
+    flat = [r for rs in per_sub for r in rs]
+    m = len(flat)
+    is_c = np.fromiter((bool(r.get("is_correct", False)) for r in flat), dtype=np.float64, count=m)
+    times = np.fromiter((max(0.001, float(r.get("time_taken", 0))) for r in flat), dtype=np.float64, count=m)
+    t_ids = np.fromiter((topic_idx.get(r.get("topic", "unknown"), -1) for r in flat), dtype=np.int64, count=m)
+    d_ids = np.fromiter((diff_idx.get(r.get("difficulty", "medium"), -1) for r in flat), dtype=np.int64, count=m)
+    return _matrix_from_arrays(counts, is_c, times, t_ids, d_ids, feature_cols, known_topics)
+
+def build_feature_matrix_columnar(submissions: list, feature_cols: list, known_topics: list = None):
+    """
+    build_feature_matrix for columnar submissions (see server/columnar.py): the response
+    arrays are concatenated as they are, only each submission's topic vocabulary is
+    mapped onto known_topics.
+    """
+    if known_topics is None:
+        known_topics = [c.replace("topic_acc__", "") for c in feature_cols if c.startswith("topic_acc__")]
+    topic_idx = {t: i for i, t in enumerate(known_topics)}
+    counts = np.fromiter((len(s["topic_ids"]) for s in submissions), dtype=np.int64, count=len(submissions))
+    if not submissions:
+        empty = np.zeros(0)
+        return _matrix_from_arrays(counts, empty, empty, empty.astype(np.int64), empty.astype(np.int64),
+                                   feature_cols, known_topics)
+    t_ids = np.concatenate([
+        np.array([topic_idx.get(t, -1) for t in s["topics"]], dtype=np.int64)[s["topic_ids"]]
+        for s in submissions
+    ])
+    is_c = np.concatenate([s["correct"] for s in submissions]).astype(np.float64)
+    # fmax, not maximum: a NaN time becomes 0.001 like max(0.001, nan) on the per-item path
+    times = np.fmax(np.concatenate([s["time_taken"] for s in submissions]), 0.001)
+    d_ids = np.concatenate([s["difficulty"] for s in submissions])
+    return _matrix_from_arrays(counts, is_c, times, t_ids, d_ids, feature_cols, known_topics)
+
+def _matrix_from_arrays(counts, is_c, times, t_ids, d_ids, feature_cols, known_topics):
+    """Per-submission aggregates from flat response arrays grouped by `counts`."""
+    n = len(counts)
+    m = len(times)
+    topic_idx = {t: i for i, t in enumerate(known_topics)}
+    owner = np.repeat(np.arange(n), counts)
+
+    has = counts > 0
+    safe_counts = np.where(has, counts, 1)
+    correct = np.bincount(owner, weights=is_c, minlength=n)
+    avg_time = np.where(has, np.bincount(owner, weights=times, minlength=n) / safe_counts, 0.0)
+    sq_dev = (times - avg_time[owner]) ** 2
+    time_std = np.where(has, np.sqrt(np.bincount(owner, weights=sq_dev, minlength=n) / safe_counts), 0.0)
+
+    # median: sort times within each submission, then average the two middle elements
+    sorted_t = times[np.lexsort((times, owner))]
+    starts = np.cumsum(counts) - counts
+    lo = np.where(has, starts + (counts - 1) // 2, 0)
+    hi = np.where(has, starts + counts // 2, 0)
+    median_time = np.where(has, (sorted_t[lo] + sorted_t[hi]) / 2.0, 0.0) if m else np.zeros(n)
+
+    def grouped_acc(ids, width):
+        keep = ids >= 0
+        key = owner[keep] * width + ids[keep]
+        tot = np.bincount(key, minlength=n * width).reshape(n, width)
+        cor = np.bincount(key, weights=is_c[keep], minlength=n * width).reshape(n, width)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(tot > 0, cor / tot, np.nan)
+
+    diff_acc = grouped_acc(d_ids, len(DIFFICULTIES))
+    columns = {
+        "correct_count": correct,
+        "total_questions": counts.astype(np.float64),
+        "avg_time": avg_time,
+        "median_time": median_time,
+        "time_std": time_std,
+        "easy_acc": diff_acc[:, 0],
+        "medium_acc": diff_acc[:, 1],
+        "hard_acc": diff_acc[:, 2],
+    }
+    if known_topics:
+        topic_acc = grouped_acc(t_ids, len(known_topics))
+        for topic, i in topic_idx.items():
+            columns[f"topic_acc__{topic}"] = topic_acc[:, i]
+
+    X = np.full((n, len(feature_cols)), np.nan, dtype=np.float64)
+    for j, c in enumerate(feature_cols):
+        if c in columns:
+            X[:, j] = columns[c]
+    return X
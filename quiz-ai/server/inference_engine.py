@@ -0,0 +1,297 @@
+# server/inference_engine.py
+"""
+Fused tree inference for the LightGBM boosters served by server/app.py.
+
+All trees of all models are flattened into contiguous NumPy node arrays (leaves are
+self-looping nodes), so every target is evaluated in one vectorized walk of
+max_depth steps over a (rows x trees) index matrix, followed by one segmented sum
+and the objective transforms. This avoids LightGBM's per-call input validation and
+setup cost, which dominates when scoring single rows. Trees are walked deepest-first
+so each step only advances the trees that have not reached a leaf yet.
+
+The walk costs a few gathers per (row, tree, level); past a few dozen rows
+LightGBM's multithreaded native loop is faster, so inputs with more than
+`max_fused_rows` rows are delegated to Booster.predict. The walk also grows with the
+number of trees while LightGBM's per-call overhead does not, so for large models
+Booster.predict wins even on one row: calibrate() times both on the models at hand
+and lowers max_fused_rows to the batch sizes where the fused walk is faster (0 when
+it never is).
+
+Only what our training script produces is supported: numerical splits, regression /
+binary / multiclass objectives, no linear trees. FusedEngine raises
+NotImplementedError for anything else so callers can fall back to Booster.predict.
+
+Run as a script to check parity against Booster.predict and compare latency:
+  python server/inference_engine.py [prepared_quiz_features.csv] [models/]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+FUSED_MAX_ROWS = int(os.environ.get("FUSED_MAX_ROWS", 64))
+
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+# LightGBM's kZeroThreshold
+ZERO_THRESHOLD = 1e-35
+
+def _parse_objective(objective):
+    parts = objective.split()
+    name = parts[0]
+    opts = dict(p.split(":", 1) for p in parts[1:] if ":" in p)
+    if name in ("regression", "regression_l1", "huber", "fair", "quantile", "mape") and len(parts) == 1:
+        return "identity", 1, 1.0
+    if name == "binary":
+        return "sigmoid", 1, float(opts.get("sigmoid", 1.0))
+    if name == "multiclass":
+        return "softmax", int(opts["num_class"]), 1.0
+    raise NotImplementedError(f"Unsupported objective for fused inference: {objective}")
+
+class FusedEngine:
+    """
+    Evaluate several boosters in one pass. `boosters` maps an output name to a
+    lightgbm.Booster; predict() returns the same mapping to arrays shaped like
+    Booster.predict (n,) or (n, num_class).
+    """
+
+    def __init__(self, boosters, max_fused_rows=FUSED_MAX_ROWS, num_threads=0):
+        self.names = list(boosters)
+        self.boosters = dict(boosters)
+        self.max_fused_rows = max_fused_rows
+        # threads for the Booster.predict fallback on large batches (0 = LightGBM's default)
+        self._predict_kwargs = {"num_threads": num_threads} if num_threads else {}
+        feat, thr, nan_left, zero_default, children, value = [], [], [], [], [], []
+        roots, slots, depths = [], [], []
+        # per output: (transform, first slot, number of slots, sigmoid scale)
+        self.outputs = {}
+        self.num_features = None
+        max_depth = 0
+        next_slot = 0
+
+        for name, booster in boosters.items():
+            dump = booster.dump_model()
+            if self.num_features is None:
+                self.num_features = dump["max_feature_idx"] + 1
+            elif dump["max_feature_idx"] + 1 != self.num_features:
+                raise ValueError(f"Model {name} expects a different number of features")
+            transform, num_class, scale = _parse_objective(dump["objective"])
+            if dump.get("average_output"):
+                raise NotImplementedError("Random-forest (average_output) boosters are not supported")
+            first_slot = next_slot
+            next_slot += num_class
+            self.outputs[name] = (transform, first_slot, num_class, scale)
+
+            # LightGBM stores multiclass trees iteration-major; regroup them per class so
+            # every output slot is one contiguous run of trees
+            trees = dump["tree_info"]
+            for k in range(num_class):
+                for tree in trees[k::num_class]:
+                    if tree.get("is_linear"):
+                        raise NotImplementedError("Linear trees are not supported")
+                    root, depth = self._flatten(tree["tree_structure"], feat, thr, nan_left, zero_default, children, value)
+                    roots.append(root)
+                    slots.append(first_slot + k)
+                    depths.append(depth)
+                    max_depth = max(max_depth, depth)
+
+        # nodes are addressed by 2 * node so that the next node is children[cur + go_left];
+        # per-node arrays are repeated twice to be indexable by the same value
+        self.feat = np.repeat(np.asarray(feat, dtype=np.intp), 2)
+        self.thr = np.repeat(np.asarray(thr, dtype=np.float64), 2)
+        self.nan_left = np.repeat(np.asarray(nan_left, dtype=bool), 2)
+        self.zero_default = np.repeat(np.asarray(zero_default, dtype=np.int8), 2)
+        self.children = 2 * np.asarray(children, dtype=np.intp)
+        self.value = np.repeat(np.asarray(value, dtype=np.float64), 2)
+        # walk trees deepest-first: at step k only the first active_trees[k] columns move
+        depths = np.asarray(depths, dtype=np.intp)
+        order = np.argsort(-depths, kind="stable")
+        self.roots = 2 * np.asarray(roots, dtype=np.intp)[order]
+        self.unsort = np.argsort(order)
+        self.active_trees = [int((depths > k).sum()) for k in range(max_depth)]
+        self.max_depth = max_depth
+        # features only split with missing_type None treat NaN as 0.0 everywhere, so NaN
+        # can be replaced up front instead of being routed node by node
+        is_split = np.asarray(children[1::2]) != np.arange(len(feat))
+        special = is_split & (np.asarray(nan_left) != (0.0 <= np.asarray(thr)))
+        special |= is_split & (np.asarray(zero_default) >= 0)
+        self.nan_to_zero = np.ones(self.num_features or 0, dtype=bool)
+        self.nan_to_zero[np.asarray(feat, dtype=np.intp)[special]] = False
+        slots = np.asarray(slots, dtype=np.intp)
+        self.num_slots = int(slots.max()) + 1 if len(slots) else 0
+        self.slot_starts = np.searchsorted(slots, np.arange(self.num_slots))
+        self.has_zero_nodes = bool((self.zero_default >= 0).any())
+
+    @property
+    def num_trees(self):
+        return len(self.roots)
+
+    def _flatten(self, node, feat, thr, nan_left, zero_default, children, value):
+        idx = len(feat)
+        feat.append(0)
+        thr.append(0.0)
+        nan_left.append(False)
+        zero_default.append(-1)
+        children.extend((idx, idx))
+        value.append(0.0)
+        if "leaf_value" in node:
+            # leaves loop onto themselves so every row can take max_depth steps
+            value[idx] = node["leaf_value"]
+            return idx, 0
+        if node["decision_type"] != "<=":
+            raise NotImplementedError("Categorical splits are not supported")
+        missing = MISSING_TYPES[node["missing_type"]]
+        default_left = bool(node["default_left"])
+        feat[idx] = node["split_feature"]
+        thr[idx] = node["threshold"]
+        if missing == MISSING_NAN:
+            nan_left[idx] = default_left
+        elif missing == MISSING_ZERO:
+            # NaN is converted to 0.0, which then takes the default branch
+            nan_left[idx] = default_left
+            zero_default[idx] = int(default_left)
+        else:
+            nan_left[idx] = 0.0 <= node["threshold"]
+        left, dl = self._flatten(node["left_child"], feat, thr, nan_left, zero_default, children, value)
+        right, dr = self._flatten(node["right_child"], feat, thr, nan_left, zero_default, children, value)
+        children[2 * idx] = right
+        children[2 * idx + 1] = left
+        return idx, 1 + max(dl, dr)
+
+    def raw_scores(self, X):
+        """Summed raw tree outputs per slot, shape (n, num_slots)."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n, f = X.shape
+        if f != self.num_features:
+            raise ValueError(f"Expected {self.num_features} features, got {f}")
+        check_nan = False
+        nan_mask = np.isnan(X)
+        if nan_mask.any():
+            check_nan = bool((nan_mask & ~self.nan_to_zero).any())
+            X = np.where(nan_mask & self.nan_to_zero, 0.0, X)
+        Xf = X.ravel()
+        row_off = (np.arange(n, dtype=np.intp) * f)[:, None]
+        cur = np.empty((n, len(self.roots)), dtype=np.intp)
+        cur[:] = self.roots
+        for active in self.active_trees:
+            c = cur[:, :active]
+            x = Xf.take(row_off + self.feat.take(c))
+            go_left = x <= self.thr.take(c)
+            if check_nan:
+                isnan = np.isnan(x)
+                go_left[isnan] = self.nan_left.take(c[isnan])
+            if self.has_zero_nodes:
+                zd = self.zero_default.take(c)
+                at_zero = (zd >= 0) & (np.abs(x) <= ZERO_THRESHOLD)
+                go_left[at_zero] = zd[at_zero].astype(bool)
+            cur[:, :active] = self.children.take(c + go_left)
+        leaf = self.value.take(cur)[:, self.unsort]
+        return np.add.reduceat(leaf, self.slot_starts, axis=1)
+
+    def calibrate(self, sizes=(1, 8, 64), reps=30, seed=0):
+        """
+        Time the fused walk against Booster.predict at each batch size (up to
+        max_fused_rows) and keep fusing only up to the largest size where it is faster.
+        Returns the new max_fused_rows and records the timings in self.calibration.
+        """
+        X_all = np.random.default_rng(seed).normal(size=(max(sizes), self.num_features or 0))
+        self.calibration = {}
+        best = 0
+        for n in sizes:
+            if n > self.max_fused_rows:
+                break
+            X = X_all[:n]
+            fused = _median_seconds(lambda: self._fused(X), reps)
+            native = _median_seconds(lambda: self._native(X), reps)
+            self.calibration[n] = {"fused_us": fused * 1e6, "lightgbm_us": native * 1e6}
+            # the fused walk only loses ground as batches grow
+            if fused >= native:
+                break
+            best = n
+        self.max_fused_rows = best
+        return best
+
+    def _native(self, X):
+        return {name: b.predict(X, **self._predict_kwargs) for name, b in self.boosters.items()}
+
+    def predict(self, X):
+        if len(X) > self.max_fused_rows:
+            return self._native(X)
+        return self._fused(X)
+
+    def _fused(self, X):
+        raw = self.raw_scores(X)
+        out = {}
+        for name, (transform, first, num_class, scale) in self.outputs.items():
+            r = raw[:, first:first + num_class]
+            if transform == "identity":
+                out[name] = r[:, 0]
+            elif transform == "sigmoid":
+                out[name] = 1.0 / (1.0 + np.exp(-scale * r[:, 0]))
+            else:
+                e = np.exp(r - r.max(axis=1, keepdims=True))
+                out[name] = e / e.sum(axis=1, keepdims=True)
+        return out
+
+def _median_seconds(fn, reps):
+    fn()
+    samples = []
+    for _ in range(reps):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+def _compare(data_csv, model_dir):
+    import joblib
+    import pandas as pd
+
+    meta = joblib.load(os.path.join(model_dir, "meta.pkl"))
+    boosters = {
+        "quiz_score": joblib.load(os.path.join(model_dir, "lgb_reg_quiz_score.pkl")),
+        "skill_level": joblib.load(os.path.join(model_dir, "lgb_cls_skill_level.pkl")),
+        "confidence": joblib.load(os.path.join(model_dir, "lgb_reg_confidence.pkl")),
+    }
+    for w in meta["weak_cols"]:
+        path = os.path.join(model_dir, f"lgb_weak_{w}.pkl")
+        if os.path.exists(path):
+            boosters[w] = joblib.load(path)
+    X = pd.read_csv(data_csv).reindex(columns=meta["feature_cols"]).to_numpy(dtype=np.float64)
+    engine = FusedEngine(boosters)
+
+    fused = {}
+    for i in range(0, len(X), engine.max_fused_rows):
+        for name, v in engine.predict(X[i:i + engine.max_fused_rows]).items():
+            fused.setdefault(name, []).append(v)
+    fused = {name: np.concatenate(v) for name, v in fused.items()}
+    worst = 0.0
+    for name, b in boosters.items():
+        diff = float(np.max(np.abs(fused[name] - b.predict(X))))
+        worst = max(worst, diff)
+        print(f"{name:32s} max |fused - lightgbm| = {diff:.3e}")
+    assert worst < 1e-9, f"fused engine deviates from Booster.predict by {worst}"
+
+    def bench(fn, reps):
+        fn()
+        t = time.perf_counter()
+        for _ in range(reps):
+            fn()
+        return (time.perf_counter() - t) / reps * 1e6
+
+    row = X[:1]
+    print(f"\n{'case':24s} {'lightgbm (us)':>14s} {'fused (us)':>12s}")
+    cases = [("single row", row, 2000), ("batch of 16", X[:16], 500),
+             (f"batch of {engine.max_fused_rows}", X[:engine.max_fused_rows], 200),
+             (f"batch of {len(X)} (delegated)", X, 50)]
+    for label, data, reps in cases:
+        lgb_us = bench(lambda: [b.predict(data) for b in boosters.values()], reps)
+        fused_us = bench(lambda: engine.predict(data), reps)
+        print(f"{label:24s} {lgb_us:14.1f} {fused_us:12.1f}")
+
+if __name__ == "__main__":
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    data_csv = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base, "prepared_quiz_features.csv")
+    model_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(base, "models")
+    _compare(data_csv, model_dir)
@@ -0,0 +1,299 @@
+# server/metrics.py
+"""
+In-process request metrics, rendered in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain dicts keyed by label values behind one
+lock per metric, so recording a sample costs a bisect plus a couple of additions.
+Gauges and counters can also be backed by a callback that is only evaluated when
+/metrics is scraped (queue depth, writer stats, cache sizes).
+
+Per-request stage timing uses lap timers: MetricsMiddleware starts a RequestTimer
+for each instrumented path, endpoint code calls lap("stage") after each stage, and
+the time since the previous lap is attributed to that stage. The stages therefore
+add up to the request total. Timers travel in a contextvar, which the threadpool
+running sync endpoints inherits.
+
+The sampled profiler is off by default. With PROFILE_SAMPLE_RATE > 0 that fraction
+of requests run under cProfile, and the ones slower than SLOW_REQUEST_SECONDS are
+dumped to PROFILE_DIR as .prof files (open with `python -m pstats` or snakeviz).
+"""
+import os
+import time
+import bisect
+import random
+import cProfile
+import datetime
+import functools
+import threading
+import contextvars
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set_function(self, fn):
+        """Evaluate fn() at scrape time: a number, or {label_values_tuple: number}."""
+        self._function = fn
+        return self
+
+    def _items(self):
+        if self._function is not None:
+            value = self._function()
+            return value.items() if isinstance(value, dict) else [((), value)]
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._items():
+            lines.append(f"{self.name}{_labels(list(zip(self.labelnames, labels)))} {_number(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (last slot is +Inf), sum, count
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items()]
+        for labels, (counts, total, count) in items:
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # one broken callback must not take the whole scrape down
+                print(f"Metric {metric.name} failed to render:", e)
+        return "\n".join(lines) + "\n"
+
+_current_timer = contextvars.ContextVar("request_timer", default=None)
+
+class RequestTimer:
+    """Lap timer for one request; lap(stage) charges the time since the last lap to stage."""
+
+    __slots__ = ("endpoint", "model_version", "start", "last", "stages", "sampled", "profiler")
+
+    def __init__(self, endpoint, sampled=False):
+        self.endpoint = endpoint
+        self.model_version = ""
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+        self.sampled = sampled
+        self.profiler = None
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+def lap(stage):
+    """Close `stage` on the current request's timer (no-op outside an instrumented request)."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.lap(stage)
+
+def set_model_version(version):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.model_version = version
+
+class ServerMetrics:
+    """The inference server's metric set plus request bookkeeping and the slow-request profiler."""
+
+    def __init__(self, slow_seconds=1.0, profile_sample_rate=0.0, profile_dir=None, buckets=DEFAULT_BUCKETS):
+        self.slow_seconds = slow_seconds
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_dir = profile_dir
+        self.registry = MetricsRegistry()
+        r = self.registry
+        self.requests = r.counter("quiz_requests_total", "Requests handled, by endpoint and status code.",
+                                  ("endpoint", "status"))
+        self.request_seconds = r.histogram("quiz_request_seconds", "End-to-end request latency in seconds.",
+                                           ("endpoint", "model_version"), buckets)
+        self.stage_seconds = r.histogram("quiz_stage_seconds", "Latency of each request stage in seconds.",
+                                         ("endpoint", "stage", "model_version"), buckets)
+        self.model_seconds = r.histogram("quiz_model_seconds", "Model evaluation latency per call in seconds.",
+                                         ("model", "model_version"), buckets)
+        self.in_flight = r.gauge("quiz_requests_in_flight", "Requests currently being handled.", ("endpoint",))
+        self.slow_requests = r.counter("quiz_slow_requests_total", "Requests slower than the slow threshold.",
+                                       ("endpoint",))
+        self.profiles = r.counter("quiz_profiles_written_total", "Slow-request profiles written to disk.")
+
+    def begin(self, endpoint):
+        sampled = self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+        timer = RequestTimer(endpoint, sampled)
+        self.in_flight.inc(endpoint)
+        return timer, _current_timer.set(timer)
+
+    def end(self, timer, token, status):
+        _current_timer.reset(token)
+        self.in_flight.dec(timer.endpoint)
+        total = time.perf_counter() - timer.start
+        self.requests.inc(timer.endpoint, str(status))
+        self.request_seconds.observe(total, timer.endpoint, timer.model_version)
+        for stage, seconds in timer.stages:
+            self.stage_seconds.observe(seconds, timer.endpoint, stage, timer.model_version)
+        if total >= self.slow_seconds:
+            self.slow_requests.inc(timer.endpoint)
+            breakdown = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timer.stages)
+            print(f"Slow request {timer.endpoint} {total * 1000:.1f}ms: {breakdown}")
+            if timer.profiler is not None:
+                self._dump_profile(timer, total)
+
+    def observe_models(self, model_version, timings):
+        for model, seconds in timings.items():
+            self.model_seconds.observe(seconds, model, model_version)
+
+    def instrument(self, fn):
+        """
+        Decorator for sync endpoints: charges everything before the handler (body read,
+        validation, threadpool hand-off) to the "parse" stage and runs sampled requests
+        under cProfile in the handler's own thread.
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timer = _current_timer.get()
+            if timer is None:
+                return fn(*args, **kwargs)
+            timer.lap("parse")
+            if not timer.sampled:
+                return fn(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already active in this interpreter
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+                timer.profiler = profiler
+        return wrapper
+
+    def _dump_profile(self, timer, total):
+        if not self.profile_dir:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{stamp}-{timer.endpoint.strip('/').replace('/', '_')}-{total * 1000:.0f}ms.prof"
+        path = os.path.join(self.profile_dir, name)
+        timer.profiler.dump_stats(path)
+        self.profiles.inc()
+        print("Wrote profile", path)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (cheaper than BaseHTTPMiddleware) that times requests to
+    `paths`; the time from the handler's last lap until the response headers go out
+    (building and serializing the response) is recorded as the "respond" stage.
+    """
+
+    def __init__(self, app, metrics, paths):
+        self.app = app
+        self.metrics = metrics
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        timer, token = self.metrics.begin(scope["path"])
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timer.lap("respond")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.metrics.end(timer, token, status)
@@ -0,0 +1,352 @@
+# server/model_registry.py
+"""
+Versioned model registry.
+
+Layout:
+  <MODEL_REGISTRY_DIR>/CURRENT                      name of the active version
+  <MODEL_REGISTRY_DIR>/<version>/manifest.json      feature_cols, weak_cols, files + sha256
+  <MODEL_REGISTRY_DIR>/<version>/<model>.txt        native LightGBM model files
+  <MODEL_REGISTRY_DIR>/<version>/<name>.json        extra data kept with the version (not loaded with it)
+
+train/train_models.py publishes a bundle with publish_bundle(); the server keeps a
+ModelRegistry that polls CURRENT and hot-swaps to a new version once it has been
+fully loaded and warmed up. Requests grab one bundle reference at the start and use
+it to the end, so a swap never changes models under an in-flight request.
+
+When the registry has no CURRENT file the legacy joblib layout in MODEL_DIR
+(meta.pkl + lgb_*.pkl) is served as version "legacy".
+
+  python -m server.model_registry import-legacy [models/]   publish the pickled models
+  python -m server.model_registry activate <version>        roll forward / back
+  python -m server.model_registry list
+"""
+import os
+import sys
+import json
+import uuid
+import hashlib
+import datetime
+import time
+import threading
+import numpy as np
+from server.feature_builder import FeatureLayout
+from server.user_history import HIST_PREFIX
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(BASE_DIR, "models"))
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(MODEL_DIR, "registry"))
+# time the fused engine against Booster.predict per model at warmup (0 = always fuse small batches)
+FUSED_CALIBRATE = os.environ.get("FUSED_CALIBRATE", "1") == "1"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def current_version(registry_dir=MODEL_REGISTRY_DIR):
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def list_versions(registry_dir=MODEL_REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(v for v in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, v, MANIFEST_FILE)))
+
+def read_manifest(version, registry_dir=MODEL_REGISTRY_DIR):
+    with open(os.path.join(registry_dir, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+def read_bundle_file(version, name, registry_dir=MODEL_REGISTRY_DIR):
+    """A JSON file published with the version through publish_bundle(data_files=...)."""
+    with open(os.path.join(registry_dir, version, name)) as f:
+        return json.load(f)
+
+def activate(version, registry_dir=MODEL_REGISTRY_DIR):
+    if not os.path.exists(os.path.join(registry_dir, version, MANIFEST_FILE)):
+        raise FileNotFoundError(f"Unknown model version: {version}")
+    _write_atomic(os.path.join(registry_dir, CURRENT_FILE), version + "\n")
+
+def publish_bundle(boosters, feature_cols, weak_cols, registry_dir=MODEL_REGISTRY_DIR,
+                   version=None, activate_now=True, extra=None, data_files=None):
+    """
+    Save boosters (name -> lightgbm.Booster; quiz_score, skill_level, confidence and one
+    per weak column) as a new immutable version. The bundle is written to a temporary
+    directory and renamed into place, so readers never see a partial bundle. `data_files`
+    (file name -> JSON-serialisable data) is written next to the manifest for tools to
+    read with read_bundle_file(); loading the bundle never reads it.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    version = version or datetime.datetime.utcnow().strftime("v%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    tmp_dir = os.path.join(registry_dir, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+    files = {}
+    for name, booster in boosters.items():
+        fname = f"{name}.txt"
+        path = os.path.join(tmp_dir, fname)
+        booster.save_model(path)
+        files[name] = {"file": fname, "sha256": _sha256(path)}
+    manifest = {
+        "version": version,
+        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "feature_cols": list(feature_cols),
+        "weak_cols": list(weak_cols),
+        "models": files,
+    }
+    manifest.update(extra or {})
+    for fname, data in (data_files or {}).items():
+        with open(os.path.join(tmp_dir, fname), "w") as f:
+            json.dump(data, f)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp_dir, os.path.join(registry_dir, version))
+    if activate_now:
+        activate(version, registry_dir)
+    return version
+
+class ModelBundle:
+    """
+    One immutable set of models plus the feature layout derived from its metadata.
+    Boosters (and the fused engine) are loaded on first use; warmup() forces it.
+    """
+
+    def __init__(self, version, feature_cols, weak_cols, loader, manifest=None, use_fused=True, num_threads=0):
+        self.version = version
+        self.manifest = manifest or {}
+        self.feature_cols = list(feature_cols)
+        self.weak_cols = list(weak_cols)
+        # column positions for building a feature row in one pass (see FeatureLayout)
+        self.layout = FeatureLayout(self.feature_cols)
+        self.known_topics = self.layout.known_topics
+        # history columns the models were trained with (none until the ETL emits them)
+        self.hist_topics = [c.replace("hist_topic_acc__", "") for c in self.feature_cols if c.startswith("hist_topic_acc__")]
+        self.hist_cols = [(j, c) for j, c in enumerate(self.feature_cols) if c.startswith(HIST_PREFIX)]
+        self.use_fused = use_fused
+        # LightGBM threads per Booster.predict call (0 = LightGBM's default)
+        self.num_threads = num_threads
+        self._predict_kwargs = {"num_threads": num_threads} if num_threads else {}
+        self._loader = loader
+        self._boosters = None
+        self._engine = None
+        self._lock = threading.Lock()
+
+    @property
+    def boosters(self):
+        if self._boosters is None:
+            with self._lock:
+                if self._boosters is None:
+                    boosters = self._loader()
+                    if self.use_fused:
+                        from server.inference_engine import FusedEngine
+                        try:
+                            self._engine = FusedEngine(boosters, num_threads=self.num_threads)
+                        except NotImplementedError as e:
+                            print("Fused inference unavailable, using Booster.predict:", e)
+                    self._boosters = boosters
+        return self._boosters
+
+    @property
+    def weak_models(self):
+        return {w: b for w, b in self.boosters.items() if w in self.weak_cols}
+
+    def predict(self, X, timings=None):
+        """
+        Raw model outputs for X: name -> array, like Booster.predict. When `timings`
+        is a dict it receives the seconds spent per model ("fused" for the fused engine).
+        """
+        boosters = self.boosters
+        if self._engine is not None:
+            if timings is None:
+                return self._engine.predict(X)
+            start = time.perf_counter()
+            preds = self._engine.predict(X)
+            timings["fused"] = time.perf_counter() - start
+            return preds
+        if timings is None:
+            return {name: b.predict(X, **self._predict_kwargs) for name, b in boosters.items()}
+        preds = {}
+        for name, b in boosters.items():
+            start = time.perf_counter()
+            preds[name] = b.predict(X, **self._predict_kwargs)
+            timings[name] = time.perf_counter() - start
+        return preds
+
+    def explain(self, X, names=None):
+        """
+        Per-feature contributions from LightGBM's tree contributions (pred_contrib), for
+        every model or only `names`: name -> (n_rows, n_features + 1), the last column
+        being the expected value; multiclass models give (n_rows, num_class,
+        n_features + 1). Values are raw scores (log-odds for classifiers), so each row
+        sums to the model's raw output.
+        """
+        out = {}
+        for name, b in self.boosters.items():
+            if names is not None and name not in names:
+                continue
+            contrib = b.predict(X, pred_contrib=True, **self._predict_kwargs)
+            num_class = b.num_model_per_iteration()
+            out[name] = contrib.reshape(len(X), num_class, -1) if num_class > 1 else contrib
+        return out
+
+    def warmup(self):
+        """
+        Load the models and run each once, so the first request pays no setup cost.
+        With the fused engine, also time it against Booster.predict on these models and
+        keep it only for the batch sizes where it is faster.
+        """
+        X = np.zeros((1, len(self.feature_cols)))
+        self.predict(X)
+        engine = self._engine
+        if engine is not None and FUSED_CALIBRATE and not hasattr(engine, "calibration"):
+            rows = engine.calibrate()
+            if rows == 0:
+                print(f"Model {self.version}: Booster.predict is faster than the fused engine "
+                      f"({engine.num_trees} trees), not using it")
+                self._engine = None
+            else:
+                print(f"Model {self.version}: fused engine for batches of up to {rows} rows ({engine.num_trees} trees)")
+        if self._engine is not None:
+            # batches above the fused engine's row limit still go through Booster.predict
+            for b in self._boosters.values():
+                b.predict(X, **self._predict_kwargs)
+        return self
+
+def load_registry_bundle(version, registry_dir=MODEL_REGISTRY_DIR, use_fused=True, num_threads=0):
+    import lightgbm as lgb
+    manifest = read_manifest(version, registry_dir)
+    bundle_dir = os.path.join(registry_dir, version)
+
+    def loader():
+        boosters = {}
+        for name, entry in manifest["models"].items():
+            path = os.path.join(bundle_dir, entry["file"])
+            if _sha256(path) != entry["sha256"]:
+                raise ValueError(f"Checksum mismatch for {path}")
+            boosters[name] = lgb.Booster(model_file=path)
+        return boosters
+
+    return ModelBundle(version, manifest["feature_cols"], manifest["weak_cols"], loader,
+                       manifest=manifest, use_fused=use_fused, num_threads=num_threads)
+
+def load_legacy_bundle(model_dir=MODEL_DIR, use_fused=True, num_threads=0):
+    import joblib
+    meta = joblib.load(os.path.join(model_dir, "meta.pkl"))
+
+    def loader():
+        boosters = {
+            "quiz_score": joblib.load(os.path.join(model_dir, "lgb_reg_quiz_score.pkl")),
+            "skill_level": joblib.load(os.path.join(model_dir, "lgb_cls_skill_level.pkl")),
+            "confidence": joblib.load(os.path.join(model_dir, "lgb_reg_confidence.pkl")),
+        }
+        for w in meta["weak_cols"]:
+            path = os.path.join(model_dir, f"lgb_weak_{w}.pkl")
+            if os.path.exists(path):
+                boosters[w] = joblib.load(path)
+        return boosters
+
+    manifest = {"drift_baseline": meta["drift_baseline"]} if "drift_baseline" in meta else None
+    return ModelBundle("legacy", meta["feature_cols"], meta["weak_cols"], loader, manifest=manifest,
+                       use_fused=use_fused, num_threads=num_threads)
+
+class ModelRegistry:
+    """Serves the active ModelBundle and hot-swaps it when CURRENT changes."""
+
+    def __init__(self, registry_dir=MODEL_REGISTRY_DIR, legacy_dir=MODEL_DIR, poll_interval=5.0, use_fused=True,
+                 num_threads=0):
+        self.registry_dir = registry_dir
+        self.legacy_dir = legacy_dir
+        self.poll_interval = poll_interval
+        self.use_fused = use_fused
+        self.num_threads = num_threads
+        self._active = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def _load(self, version):
+        if version is None:
+            return load_legacy_bundle(self.legacy_dir, use_fused=self.use_fused, num_threads=self.num_threads)
+        return load_registry_bundle(version, self.registry_dir, use_fused=self.use_fused, num_threads=self.num_threads)
+
+    def load_current(self):
+        self._set_active(self._load(current_version(self.registry_dir)))
+        return self._active
+
+    def active(self):
+        if self._active is None:
+            self.load_current()
+        return self._active
+
+    def on_swap(self, callback):
+        """Register callback(old_bundle, new_bundle), run after every swap."""
+        self._listeners.append(callback)
+
+    def _set_active(self, bundle):
+        old = self._active
+        # a single reference assignment: in-flight requests keep the bundle they hold
+        self._active = bundle
+        if old is not None:
+            for cb in self._listeners:
+                cb(old, bundle)
+
+    def check_for_update(self):
+        version = current_version(self.registry_dir)
+        active = self._active
+        if active is not None and (version or "legacy") == active.version:
+            return False
+        try:
+            # load and warm up off the request path before swapping
+            bundle = self._load(version).warmup()
+        except Exception as e:
+            print(f"Model reload to {version} failed, keeping {active.version if active else None}:", e)
+            return False
+        self._set_active(bundle)
+        print(f"Switched models to version {bundle.version}")
+        return True
+
+    def start_watcher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval + 1.0)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.check_for_update()
+
+def main(argv):
+    if argv and argv[0] == "import-legacy":
+        bundle = load_legacy_bundle(argv[1] if len(argv) > 1 else MODEL_DIR, use_fused=False)
+        version = publish_bundle(bundle.boosters, bundle.feature_cols, bundle.weak_cols)
+        print(f"Published legacy models as {version}")
+    elif len(argv) == 2 and argv[0] == "activate":
+        activate(argv[1])
+        print(f"Activated {argv[1]}")
+    elif argv and argv[0] == "list":
+        cur = current_version()
+        for v in list_versions():
+            print(("* " if v == cur else "  ") + v)
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+# server/prediction_cache.py
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def feature_key(model_version, x):
+    """Content hash of one feature vector (NaNs canonicalised) for a model version."""
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    x = np.where(np.isnan(x), np.nan, x)
+    h = hashlib.sha256(model_version.encode())
+    h.update(x.tobytes())
+    return h.hexdigest()
+
+def submission_key(model_version, submission):
+    """
+    Hash of (user_id, quiz_id, start_time, responses), used to recognise retried
+    submissions; a retake with the same answers has its own start_time. None when the
+    submission has no start_time: a retry then cannot be told from a retake, so it is
+    scored and stored again.
+    """
+    if not submission.get("start_time"):
+        return None
+    if "topic_ids" in submission:
+        return _columnar_key(model_version, submission)
+    payload = json.dumps(
+        [submission["user_id"], submission["quiz_id"], submission.get("start_time"), submission.get("responses", [])],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(f"{model_version}\0{payload}".encode()).hexdigest()
+
+def stored_key(submission):
+    """
+    Key of the stored quiz_results row: the submission itself (user, quiz, start_time,
+    answers) without the model version, so a retry that reaches another worker, or
+    arrives after a model swap, maps to the row the first attempt wrote. None without
+    a start_time (the row is always inserted).
+    """
+    return submission_key("", submission)
+
+def _columnar_key(model_version, submission):
+    # same idea for columnar submissions (server/columnar.py), hashing the raw arrays
+    h = hashlib.sha256(f"{model_version}\0columnar\0".encode())
+    h.update(json.dumps([submission["user_id"], submission["quiz_id"], submission.get("start_time"),
+                         submission["topics"]]).encode())
+    for name, dtype in (("topic_ids", np.int64), ("difficulty", np.int64), ("correct", np.bool_), ("time_taken", np.float64)):
+        h.update(np.ascontiguousarray(submission[name], dtype=dtype).tobytes())
+    return h.hexdigest()
+
+class PredictionCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,463 @@
+# server/progress.py
+"""
+Learner and class progress, kept as rollups that are updated as results are stored.
+
+Every stored result is folded into one row per learner and, when the submission
+names a class_id, one row per class. Each row holds a JSON state: attempt and score
+totals, the last few scores, daily score buckets for the trend (the most recent
+`trend_days` days), skill-level counts and transitions and weak-topic frequencies.
+Reading a learner's or a class's progress is a primary-key lookup, so it costs the
+same after ten attempts or ten thousand. The results themselves are appended to
+progress_history and paged newest first by keyset (seq < cursor) on the
+(user_id, seq) index, never by OFFSET.
+
+A class's skill distribution counts each learner's level as of their latest attempt
+in that class (class_learners remembers which level was counted).
+
+The store is SQLite by default. A postgres:// or postgresql:// URL uses psycopg2
+instead, with the same tables. There an update locks only the rollup rows it
+touches: each batch claims its learner rows, then its class rows, in key order with
+one INSERT ... ON CONFLICT DO UPDATE ... RETURNING per table (which also creates rows
+for new learners and classes), so concurrent workers only wait on each other for the
+same learner or class. A class row also guards that class's class_learners rows. On
+SQLite writers serialize on the database write lock. A Postgres connection that drops
+is reopened and the call retried once.
+
+Results stored before the rollups existed are folded in with
+
+  python -m server.progress backfill [--classes roster.csv]   (from quiz-ai/)
+
+which empties the rollups and history, then replays quiz_results oldest first through
+the same update path. quiz_results has no class_id: the class of each result is taken
+from the history being replaced, else from the roster CSV (user_id,class_id). Results
+the server folds in while the backfill runs are recognized by id and not counted twice.
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+import threading
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS progress_history ("
+    " seq {serial}, result_id TEXT, user_id TEXT NOT NULL, class_id TEXT, quiz_id TEXT,"
+    " quiz_score {float}, skill_level TEXT, confidence_score {float}, weak_topics TEXT, taken_at TEXT)",
+    "CREATE INDEX IF NOT EXISTS progress_history_user ON progress_history (user_id, seq)",
+    "CREATE INDEX IF NOT EXISTS progress_history_result ON progress_history (result_id)",
+    "CREATE TABLE IF NOT EXISTS learner_progress (user_id TEXT PRIMARY KEY, state TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS class_progress (class_id TEXT PRIMARY KEY, state TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS class_learners ("
+    " class_id TEXT NOT NULL, user_id TEXT NOT NULL, skill_level TEXT, last_at TEXT,"
+    " PRIMARY KEY (class_id, user_id))",
+]
+DIALECTS = {
+    "sqlite": {"serial": "INTEGER PRIMARY KEY", "float": "REAL"},
+    "postgres": {"serial": "BIGSERIAL PRIMARY KEY", "float": "DOUBLE PRECISION"},
+}
+
+def empty_learner():
+    return {
+        "attempts": 0,
+        "score_sum": 0.0,
+        "best_score": None,
+        "recent_scores": [],
+        "first_at": None,
+        "last_at": None,
+        "skill_level": None,
+        # attempts per predicted level, and {from: {to: count}} for level changes
+        "skill_counts": {},
+        "skill_transitions": {},
+        # attempts in which each topic was predicted weak
+        "weak_topics": {},
+        # "YYYY-MM-DD" -> [attempts, score sum]
+        "daily": {},
+    }
+
+def empty_class():
+    return {
+        "learners": 0,
+        "attempts": 0,
+        "score_sum": 0.0,
+        "last_at": None,
+        # learners per level (each learner counted once, at their latest level)
+        "skill_levels": {},
+        "weak_topics": {},
+        "daily": {},
+    }
+
+def _add_daily(daily, day, score, keep_days):
+    bucket = daily.setdefault(day, [0, 0.0])
+    bucket[0] += 1
+    bucket[1] += score
+    if len(daily) > keep_days:
+        # ISO dates sort chronologically
+        for old in sorted(daily)[:len(daily) - keep_days]:
+            del daily[old]
+
+def _count(counts, key, amount=1):
+    counts[key] = counts.get(key, 0) + amount
+    if counts[key] <= 0:
+        del counts[key]
+
+def apply_result(state, result, keep_days, recent):
+    """Fold one stored result into a learner's rollup."""
+    score = float(result["quiz_score"])
+    skill = result["skill_level"]
+    taken_at = result["taken_at"]
+    state["attempts"] += 1
+    state["score_sum"] += score
+    state["best_score"] = score if state["best_score"] is None else max(state["best_score"], score)
+    state["recent_scores"] = (state["recent_scores"] + [score])[-recent:]
+    state["first_at"] = state["first_at"] or taken_at
+    state["last_at"] = taken_at
+    previous = state["skill_level"]
+    if previous is not None and previous != skill:
+        _count(state["skill_transitions"].setdefault(previous, {}), skill)
+    state["skill_level"] = skill
+    _count(state["skill_counts"], skill)
+    for topic in result["weak_topics"]:
+        _count(state["weak_topics"], topic)
+    _add_daily(state["daily"], taken_at[:10], score, keep_days)
+    return state
+
+def apply_class_result(state, result, previous_skill, is_new, keep_days):
+    """Fold one stored result into a class rollup; previous_skill is the level last counted for the learner."""
+    score = float(result["quiz_score"])
+    state["attempts"] += 1
+    state["score_sum"] += score
+    state["last_at"] = result["taken_at"]
+    if is_new:
+        state["learners"] += 1
+    elif previous_skill is not None:
+        _count(state["skill_levels"], previous_skill, -1)
+    _count(state["skill_levels"], result["skill_level"])
+    for topic in result["weak_topics"]:
+        _count(state["weak_topics"], topic)
+    _add_daily(state["daily"], result["taken_at"][:10], score, keep_days)
+    return state
+
+def _trend(daily, days):
+    since = (datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)).isoformat()
+    return [{"date": day, "attempts": n, "mean_score": round(total / n, 2)}
+            for day, (n, total) in sorted(daily.items()) if day >= since]
+
+def _top(counts, top):
+    ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    return [{"topic": t, "attempts": n} for t, n in (ranked[:top] if top > 0 else ranked)]
+
+def learner_summary(user_id, state, days=30, top=5):
+    """Dashboard view of a learner's rollup: scores, trend over `days`, skill changes, weak topics."""
+    n = state["attempts"]
+    return {
+        "user_id": user_id,
+        "attempts": n,
+        "mean_score": round(state["score_sum"] / n, 2) if n else None,
+        "best_score": state["best_score"],
+        "last_score": state["recent_scores"][-1] if state["recent_scores"] else None,
+        "recent_scores": state["recent_scores"],
+        "first_at": state["first_at"],
+        "last_at": state["last_at"],
+        "skill_level": state["skill_level"],
+        "skill_counts": state["skill_counts"],
+        "skill_transitions": [{"from": a, "to": b, "count": c}
+                              for a, to in sorted(state["skill_transitions"].items()) for b, c in sorted(to.items())],
+        "weak_topics": _top(state["weak_topics"], top),
+        "trend": _trend(state["daily"], days),
+    }
+
+def class_summary(class_id, state, days=30, top=5):
+    n = state["attempts"]
+    return {
+        "class_id": class_id,
+        "learners": state["learners"],
+        "attempts": n,
+        "mean_score": round(state["score_sum"] / n, 2) if n else None,
+        "last_at": state["last_at"],
+        "skill_levels": state["skill_levels"],
+        "weak_topics": _top(state["weak_topics"], top),
+        "trend": _trend(state["daily"], days),
+    }
+
+class ProgressStore:
+    """
+    Progress rollups and result history in SQLite (a file path) or Postgres (a URL).
+    update_many() folds a list of stored results into the learner and class rows and
+    appends them to the history in one transaction; the read methods are single-row
+    lookups or one index range scan.
+    """
+
+    def __init__(self, target, trend_days=90, recent_scores=10):
+        self.target = target
+        self.trend_days = trend_days
+        self.recent_scores = recent_scores
+        self.dialect = "postgres" if target.startswith(("postgres://", "postgresql://")) else "sqlite"
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self._pid = os.getpid()
+        if self.dialect == "postgres":
+            import psycopg2
+            self._conn = psycopg2.connect(self.target)
+            # transactions are opened explicitly, as on SQLite
+            self._conn.autocommit = True
+            # a dropped connection: reopen it and run the call again
+            self._lost = (psycopg2.OperationalError, psycopg2.InterfaceError)
+        else:
+            self._conn = sqlite3.connect(self.target, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._lost = ()
+        for statement in SCHEMA:
+            self._execute(statement.format(**DIALECTS[self.dialect]))
+
+    def _connection(self):
+        # reopened in a forked server worker (callers hold self._lock)
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def _call(self, fn, *args):
+        """Run fn(*args) under the lock; on Postgres, reconnect and retry once if the connection dropped."""
+        with self._lock:
+            self._connection()
+            try:
+                return fn(*args)
+            except self._lost as e:
+                print("Progress store connection lost, reconnecting:", e)
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._connect()
+                return fn(*args)
+
+    def _execute(self, sql, params=(), many=False):
+        if self.dialect == "postgres":
+            sql = sql.replace("?", "%s")
+        cur = self._conn.cursor()
+        if many:
+            cur.executemany(sql, params)
+        else:
+            cur.execute(sql, params)
+        return cur
+
+    def _claim(self, table, key, ids, empty):
+        """
+        States of the rows `ids` of a rollup table, locked until the transaction ends.
+        Missing rows are created with the empty state; ids are claimed in sorted order so
+        two batches never wait on each other's rows in opposite orders.
+        """
+        ids = sorted(ids)
+        if not ids:
+            return {}
+        blank = json.dumps(empty())
+        # the no-op update takes the row lock and returns the stored state
+        rows = self._execute(
+            f"INSERT INTO {table} ({key}, state) VALUES {', '.join(['(?, ?)'] * len(ids))} "
+            f"ON CONFLICT({key}) DO UPDATE SET state = {table}.state RETURNING {key}, state",
+            [v for i in ids for v in (i, blank)]).fetchall()
+        return {k: json.loads(state) for k, state in rows}
+
+    def update_many(self, submissions, results):
+        """Fold stored results (one per submission, in order) into the rollups in one transaction."""
+        return self._call(self._update_many, submissions, results)
+
+    def _update_many(self, submissions, results):
+        self._execute("BEGIN" if self.dialect == "postgres" else "BEGIN IMMEDIATE")
+        try:
+            pairs = list(zip(submissions, results))
+            # learners before classes, in every batch
+            learners = self._claim("learner_progress", "user_id", {r["user_id"] for _, r in pairs}, empty_learner)
+            classes = self._claim("class_progress", "class_id", {s.get("class_id") for s, _ in pairs} - {None, ""},
+                                  empty_class)
+            members = {}
+            history = []
+            for sub, result in pairs:
+                user_id, class_id = result["user_id"], sub.get("class_id")
+                apply_result(learners[user_id], result, self.trend_days, self.recent_scores)
+                if class_id:
+                    key = (class_id, user_id)
+                    if key not in members:
+                        # the class row claimed above guards its learners
+                        row = self._execute("SELECT skill_level FROM class_learners WHERE class_id = ? AND user_id = ?",
+                                            key).fetchone()
+                        members[key] = {"known": row is not None, "skill_level": row[0] if row else None}
+                    member = members[key]
+                    apply_class_result(classes[class_id], result, member["skill_level"], not member["known"],
+                                       self.trend_days)
+                    member.update(known=True, skill_level=result["skill_level"], last_at=result["taken_at"])
+                history.append((result["id"], user_id, class_id, result["quiz_id"], result["quiz_score"],
+                                result["skill_level"], result["confidence_score"],
+                                json.dumps(result["weak_topics"]), result["taken_at"]))
+            self._execute(
+                "INSERT INTO progress_history (result_id, user_id, class_id, quiz_id, quiz_score, skill_level,"
+                " confidence_score, weak_topics, taken_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", history, many=True)
+            self._execute(
+                "UPDATE learner_progress SET state = ? WHERE user_id = ?",
+                [(json.dumps(s), u) for u, s in learners.items()], many=True)
+            if classes:
+                self._execute(
+                    "UPDATE class_progress SET state = ? WHERE class_id = ?",
+                    [(json.dumps(s), c) for c, s in classes.items()], many=True)
+                self._execute(
+                    "INSERT INTO class_learners (class_id, user_id, skill_level, last_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(class_id, user_id) DO UPDATE SET skill_level = excluded.skill_level,"
+                    " last_at = excluded.last_at",
+                    [(c, u, m["skill_level"], m["last_at"]) for (c, u), m in members.items()], many=True)
+            self._execute("COMMIT")
+        except Exception:
+            self._rollback()
+            raise
+        return learners
+
+    def _rollback(self):
+        try:
+            self._execute("ROLLBACK")
+        except Exception as e:
+            # the connection is gone, and the transaction with it
+            print("Progress store rollback failed:", e)
+
+    def seen_results(self, result_ids):
+        """The ids among result_ids that are already in the history."""
+        ids = list(result_ids)
+        if not ids:
+            return set()
+        sql = f"SELECT result_id FROM progress_history WHERE result_id IN ({', '.join(['?'] * len(ids))})"
+        return {r[0] for r in self._call(lambda: self._execute(sql, ids).fetchall())}
+
+    def result_classes(self):
+        """result_id -> class_id for every result in the history that was rolled up into a class."""
+        sql = "SELECT result_id, class_id FROM progress_history WHERE class_id IS NOT NULL AND result_id IS NOT NULL"
+        return dict(self._call(lambda: self._execute(sql).fetchall()))
+
+    def reset(self):
+        """Empty the rollups and the history."""
+        def clear():
+            self._execute("BEGIN" if self.dialect == "postgres" else "BEGIN IMMEDIATE")
+            try:
+                for table in ("progress_history", "learner_progress", "class_progress", "class_learners"):
+                    self._execute(f"DELETE FROM {table}")
+                self._execute("COMMIT")
+            except Exception:
+                self._rollback()
+                raise
+        self._call(clear)
+
+    def learner(self, user_id):
+        """A learner's rollup state, or None if no result was stored for them."""
+        row = self._call(lambda: self._execute("SELECT state FROM learner_progress WHERE user_id = ?",
+                                               (user_id,)).fetchone())
+        return json.loads(row[0]) if row else None
+
+    def classroom(self, class_id):
+        row = self._call(lambda: self._execute("SELECT state FROM class_progress WHERE class_id = ?",
+                                               (class_id,)).fetchone())
+        return json.loads(row[0]) if row else None
+
+    def history(self, user_id, limit=50, before=None):
+        """
+        One page of a learner's results, newest first: (items, next_cursor). Pass
+        next_cursor back as `before` for the following page; it is None on the last one.
+        """
+        sql = ("SELECT seq, result_id, quiz_id, class_id, quiz_score, skill_level, confidence_score, weak_topics,"
+               " taken_at FROM progress_history WHERE user_id = ?")
+        params = [user_id]
+        if before is not None:
+            sql += " AND seq < ?"
+            params.append(before)
+        sql += " ORDER BY seq DESC LIMIT ?"
+        # one row past the page tells whether there is another page
+        params.append(limit + 1)
+        rows = self._call(lambda: self._execute(sql, params).fetchall())
+        items = [
+            {"id": r[1], "user_id": user_id, "quiz_id": r[2], "class_id": r[3], "quiz_score": r[4],
+             "skill_level": r[5], "confidence_score": r[6], "weak_topics": json.loads(r[7]), "taken_at": r[8]}
+            for r in rows[:limit]
+        ]
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return items, next_cursor
+
+    def class_learners(self, class_id, limit=50, after=None):
+        """One page of a class's learners by user_id: (items, next_cursor), keyset on user_id > after."""
+        sql = "SELECT user_id, skill_level, last_at FROM class_learners WHERE class_id = ?"
+        params = [class_id]
+        if after is not None:
+            sql += " AND user_id > ?"
+            params.append(after)
+        sql += " ORDER BY user_id LIMIT ?"
+        params.append(limit + 1)
+        rows = self._call(lambda: self._execute(sql, params).fetchall())
+        items = [{"user_id": r[0], "skill_level": r[1], "last_at": r[2]} for r in rows[:limit]]
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return items, next_cursor
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._conn.close()
+
+def _stored_result(row):
+    # a quiz_results row as the server built it (weak_topics may come back as JSON text)
+    topics = row.get("weak_topics") or []
+    return dict(row, weak_topics=json.loads(topics) if isinstance(topics, str) else topics)
+
+def read_roster(path):
+    """user_id -> class_id from a CSV with those two columns."""
+    import csv
+    with open(path, newline="") as f:
+        return {r["user_id"]: r["class_id"] for r in csv.DictReader(f) if r.get("class_id")}
+
+def backfill(store, client, table="quiz_results", roster=None, page_size=1000):
+    """
+    Rebuild the rollups and history from every stored result, oldest first; returns
+    how many results were folded in. `client` is a supabase Client (or anything with
+    table(t).select().order().range().execute().data).
+    """
+    classes = store.result_classes()
+    roster = roster or {}
+    store.reset()
+    folded = offset = 0
+    while True:
+        rows = (client.table(table).select("*").order("taken_at").order("id")
+                .range(offset, offset + page_size - 1).execute().data)
+        if not rows:
+            break
+        offset += len(rows)
+        # folded in by a running server since the reset
+        seen = store.seen_results(r["id"] for r in rows)
+        fresh = [_stored_result(r) for r in rows if r["id"] not in seen]
+        if fresh:
+            store.update_many([{"class_id": classes.get(r["id"]) or roster.get(r["user_id"])} for r in fresh], fresh)
+            folded += len(fresh)
+        print(f"Backfilled {folded} results (read {offset})")
+        if len(rows) < page_size:
+            break
+    return folded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m server.progress", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("backfill", help="rebuild the rollups from the stored results")
+    cmd.add_argument("--classes", metavar="CSV", help="user_id,class_id roster for results the history has no class for")
+    cmd.add_argument("--table", default="quiz_results")
+    cmd.add_argument("--page-size", type=int, default=1000, help="results read per request")
+    args = parser.parse_args(argv)
+
+    from supabase import create_client
+    client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+    # the server's settings (server/app.py)
+    store = ProgressStore(os.environ.get("PROGRESS_DB", os.path.join(os.path.dirname(__file__), "../progress.sqlite")),
+                          trend_days=int(os.environ.get("PROGRESS_TREND_DAYS", 90)))
+    try:
+        roster = read_roster(args.classes) if args.classes else None
+        print(f"Folded {backfill(store, client, args.table, roster, args.page_size)} results into {store.target}")
+    finally:
+        store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+# server/result_writer.py
+import os
+import json
+import time
+import queue
+import glob
+import fcntl
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+class ResultWriter:
+    """
+    Write-behind queue for prediction results.
+
+    Request handlers call submit() which only enqueues rows; a background thread
+    coalesces them into multi-row inserts, flushing when `batch_size` rows are
+    pending or `flush_interval` seconds have passed since the oldest pending row.
+    Failed inserts are retried with exponential backoff; once retries are exhausted
+    (or the queue is full) rows are appended to `spill_path` as JSON lines and
+    replayed after the next successful insert, and once when the writer starts (which
+    also picks up a replay an earlier process did not finish). submit() never touches
+    the spill file itself: rows that do not fit in the queue are handed to the writer
+    thread, which spills them, and once `max_queue` more are waiting there the rest are
+    dropped and counted as "dropped". Unreadable spill lines
+    are skipped and counted as "corrupt"; an error while flushing is logged and never
+    stops the writer thread.
+
+    The spill file may be shared by several processes (server/serve.py workers all
+    get the same WRITE_SPILL_PATH): appends and the move to a replay file happen under
+    an flock on `<spill_path>.lock`, and each process replays from its own
+    `<spill_path>.replay-<pid>`. Replay files of processes that are gone are taken over.
+
+    `client` only needs `client.table(name).insert(rows).execute()`, so any
+    in-process stand-in for the supabase Client can be passed in. With `unique_on`
+    set, rows are written with upsert(rows, on_conflict=unique_on,
+    ignore_duplicates=True) instead: a row whose key is already stored is skipped, so
+    retried submissions and replays are written at most once. `on_write`, if
+    given, is called as on_write(seconds, n_rows, ok) after every insert attempt, and
+    `on_stored` as on_stored(rows) on the writer thread once rows were inserted
+    (replayed ones included). Keys of a row that start with "_" are kept with it
+    through the spill file and passed to on_stored, but never sent to the table.
+    """
+
+    def __init__(self, client, table="quiz_results", max_queue=10000, batch_size=200,
+                 flush_interval=0.5, max_retries=5, backoff_base=0.2, backoff_max=5.0,
+                 spill_path=None, on_write=None, unique_on=None, on_stored=None):
+        self.client = client
+        self.table = table
+        self.unique_on = unique_on
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.spill_path = spill_path
+        self.on_write = on_write
+        self.on_stored = on_stored
+        self._queue = queue.Queue(maxsize=max_queue)
+        # rows the queue had no room for, spilled by the writer thread
+        self._overflow = deque()
+        self._max_overflow = max_queue
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # updated from request threads and the writer thread
+        self._stats_lock = threading.Lock()
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "retries": 0, "spilled": 0,
+                      "replayed": 0, "failed": 0, "corrupt": 0, "errors": 0, "dropped": 0}
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, rows):
+        """Enqueue one result dict or a list of them; never blocks the caller."""
+        if isinstance(rows, dict):
+            rows = [rows]
+        for i, row in enumerate(rows):
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                # backend can't keep up: the writer thread moves the rest to disk
+                self._overflowed(rows[i:])
+                self._count("enqueued", i)
+                return False
+        self._count("enqueued", len(rows))
+        return True
+
+    def _overflowed(self, rows):
+        room = max(0, self._max_overflow - len(self._overflow))
+        self._overflow.extend(rows[:room])
+        if len(rows) > room:
+            self._count("dropped", len(rows) - room)
+            print(f"Dropping {len(rows) - room} results (write queue and overflow full)")
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def pending(self):
+        return self._queue.qsize() + len(self._overflow)
+
+    def stop(self, timeout=10.0):
+        """Stop accepting new work and drain everything that is queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # anything the thread could not drain in time goes to the spill file
+        self._spill_overflow()
+        leftover = self._take(self._queue.qsize(), block=False)
+        if leftover:
+            self._spill(leftover)
+
+    def _take(self, limit, block=True):
+        rows = []
+        deadline = None
+        while len(rows) < limit:
+            try:
+                if not block:
+                    rows.append(self._queue.get_nowait())
+                elif deadline is None:
+                    # wait for the first row, waking up periodically to check for stop
+                    rows.append(self._queue.get(timeout=self.flush_interval))
+                    deadline = time.monotonic() + self.flush_interval
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    rows.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        # results spilled (or left mid-replay) by an earlier run
+        self._guarded(self._replay_spill)
+        while not self._stop.is_set():
+            self._guarded(self._spill_overflow)
+            batch = self._take(self.batch_size)
+            if batch:
+                self._guarded(self._flush, batch)
+        # drain on shutdown
+        self._guarded(self._spill_overflow)
+        while True:
+            batch = self._take(self.batch_size, block=False)
+            if not batch:
+                break
+            self._guarded(self._flush, batch)
+
+    def _spill_overflow(self):
+        rows = []
+        while self._overflow:
+            try:
+                rows.append(self._overflow.popleft())
+            except IndexError:
+                break
+        if rows:
+            self._spill(rows)
+
+    def _guarded(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self._count("errors")
+            print("Result writer error:", repr(e))
+
+    def _flush(self, batch):
+        written = False
+        try:
+            written = self._write(batch)
+        finally:
+            if not written:
+                self._spill(batch)
+        if written:
+            self._replay_spill()
+
+    def _write(self, rows):
+        payload = [{k: v for k, v in row.items() if not k.startswith("_")} for row in rows]
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                if self.unique_on:
+                    self.client.table(self.table).upsert(payload, on_conflict=self.unique_on, ignore_duplicates=True).execute()
+                else:
+                    self.client.table(self.table).insert(payload).execute()
+                self._count("written", len(rows))
+                self._count("batches")
+                self._observe(start, rows, True)
+                self._stored(rows)
+                return True
+            except Exception as e:
+                self._observe(start, rows, False)
+                if attempt == self.max_retries or self._stop.is_set():
+                    print("Supabase insert error:", e)
+                    self._count("failed")
+                    return False
+                self._count("retries")
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        return False
+
+    def _observe(self, start, rows, ok):
+        if self.on_write is not None:
+            try:
+                self.on_write(time.perf_counter() - start, len(rows), ok)
+            except Exception as e:
+                print("Result writer metrics error:", e)
+
+    def _stored(self, rows):
+        if self.on_stored is not None:
+            try:
+                self.on_stored(rows)
+            except Exception as e:
+                print("Result writer on_stored error:", e)
+
+    def _spill(self, rows):
+        if not self.spill_path:
+            print(f"Dropping {len(rows)} results (no spill file configured)")
+            return
+        with self._spill_locked():
+            with open(self.spill_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+        self._count("spilled", len(rows))
+
+    @contextmanager
+    def _spill_locked(self):
+        # the thread lock orders this process; the flock orders the other workers
+        with self._spill_lock, open(self.spill_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _replay_spill(self):
+        if not self.spill_path:
+            return
+        for path in self._claim_spill():
+            if not self._replay_file(path):
+                # the rest stay claimed and are retried after the next successful insert
+                break
+
+    def _claim_spill(self):
+        """Move the spill file and orphaned replay files to this process's replay files."""
+        pid = os.getpid()
+        claimed = []
+        with self._spill_locked():
+            # left by a process that died mid-replay (or by this one, after an error)
+            for path in sorted(glob.glob(glob.escape(self.spill_path) + ".replay*")):
+                owner = path.rsplit(".replay", 1)[1].lstrip("-").split("-")[0]
+                if owner.isdigit() and int(owner) != pid and _alive(int(owner)):
+                    continue
+                claimed.append(path)
+            if os.path.exists(self.spill_path):
+                claimed.append(self.spill_path)
+            own = []
+            for i, path in enumerate(claimed):
+                target = f"{self.spill_path}.replay-{pid}-{time.time_ns()}-{i}"
+                os.replace(path, target)
+                own.append(target)
+        return own
+
+    def _replay_file(self, path):
+        """Insert the rows of a claimed spill file in batches; the rest goes back to the spill file."""
+        ok = True
+        with open(path) as f:
+            chunk = []
+            for line in f:
+                row = self._parse_spilled(line)
+                if row is not None:
+                    chunk.append(row)
+                if len(chunk) == self.batch_size:
+                    ok = self._replay_chunk(chunk, f)
+                    if not ok:
+                        break
+                    chunk = []
+            else:
+                if chunk:
+                    ok = self._replay_chunk(chunk, f)
+        os.remove(path)
+        return ok
+
+    def _replay_chunk(self, chunk, rest):
+        if self._write(chunk):
+            self._count("replayed", len(chunk))
+            return True
+        # backend went away again: put this chunk and the unread lines back on disk
+        rows = chunk + [row for row in map(self._parse_spilled, rest) if row is not None]
+        self._spill(rows)
+        return False
+
+    def _parse_spilled(self, line):
+        if not line.strip():
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            # e.g. a line cut short when the process died mid-append
+            self._count("corrupt")
+            print("Skipping unreadable spilled result:", line[:200].rstrip())
+            return None
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,57 @@
+# server/serialization.py
+"""
+Request/response encoding for the prediction endpoints.
+
+orjson and msgpack are optional: without orjson the stdlib json module is used, and
+without msgpack only JSON bodies are accepted.
+"""
+import json
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+class UnsupportedMediaType(ValueError):
+    pass
+
+def dumps(obj):
+    """JSON bytes; orjson also turns numpy scalars/arrays into plain JSON values."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def decode_body(body, content_type):
+    """Decode a JSON or msgpack request body according to its Content-Type."""
+    media_type = (content_type or JSON_TYPE).split(";")[0].strip().lower()
+    if media_type in MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedMediaType("msgpack bodies need the msgpack package installed")
+        return msgpack.unpackb(body, raw=False)
+    if media_type == JSON_TYPE or media_type.endswith("+json"):
+        return loads(body)
+    raise UnsupportedMediaType(f"Unsupported content type {media_type}")
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with dumps(). Returning an instance from an endpoint skips
+    FastAPI's jsonable_encoder pass over the result.
+    """
+    media_type = JSON_TYPE
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,124 @@
+# server/serve.py
+"""
+Pre-fork serving: load the models once, then fork workers that share them.
+
+  python -m server.serve          (from quiz-ai/; SERVE_WORKERS, HOST, PORT)
+
+`uvicorn --workers N` spawns fresh interpreters, so every worker imports server.app
+again and holds its own copy of every booster. Here the parent imports the app, loads
+the active bundle (boosters and the compiled fused engine), freezes the garbage
+collector so it never writes to those objects again, binds the listening socket and
+forks SERVE_WORKERS children that accept on it. Model memory stays shared
+copy-on-write; each worker only adds its own caches and request state.
+
+The parent runs LightGBM with OMP_NUM_THREADS=1 so it never starts an OpenMP thread
+pool (which does not survive fork). Each worker predicts with LGBM_NUM_THREADS
+threads, by default the cores divided evenly between workers, and warms every model
+in its startup handler before it starts accepting connections; /ready answers 503
+until then. Background threads (result writer, registry watcher) are started per
+worker after the fork. All workers spill to the same WRITE_SPILL_PATH; ResultWriter
+serializes appends and replays across processes with an flock.
+
+The parent restarts workers that exit unexpectedly and forwards SIGTERM/SIGINT, so
+workers drain their write queues before the server stops. A model version swapped in
+later is loaded by each worker on its own; restart the server to share it again.
+Metrics are per worker: a /metrics scrape reports the worker that answered it.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import importlib
+
+# before anything imports lightgbm or numpy
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1))
+HOST = os.environ.get("HOST", "0.0.0.0")
+# cores per worker for LightGBM (server/app.py reads LGBM_NUM_THREADS at import)
+os.environ.setdefault("LGBM_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // SERVE_WORKERS)))
+# seconds to wait before replacing a worker that died, so a crash loop can't spin
+RESPAWN_DELAY = float(os.environ.get("SERVE_RESPAWN_DELAY", 1.0))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+
+def bind(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock):
+    import uvicorn
+    # the parent's handlers must not run in the worker; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    server = uvicorn.Server(uvicorn.Config(app, log_level=LOG_LEVEL, lifespan="on"))
+    server.run(sockets=[sock])
+
+def spawn(app, sock):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock)
+        except BaseException as e:
+            print(f"Worker {os.getpid()} failed:", e)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    return pid
+
+def main():
+    # no collections while the models load, and none over them afterwards
+    gc.disable()
+    # the module, not the FastAPI object that `from server import app` resolves to
+    server_app = importlib.import_module("server.app")
+    bundle = server_app.registry.active()
+    start = time.perf_counter()
+    bundle.boosters  # loads the boosters and compiles the fused engine
+    print(f"Loaded model version {bundle.version} in {time.perf_counter() - start:.2f}s")
+    gc.freeze()
+
+    sock = bind(HOST, server_app.PORT)
+    print(f"Serving on {HOST}:{server_app.PORT} with {SERVE_WORKERS} workers, "
+          f"{server_app.LGBM_NUM_THREADS} LightGBM threads each")
+
+    workers = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(SERVE_WORKERS):
+        workers.add(spawn(server_app.app, sock))
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            time.sleep(RESPAWN_DELAY)
+            if not stopping:
+                workers.add(spawn(server_app.app, sock))
+    sock.close()
+    print("All workers stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# server/user_history.py
+import os
+import json
+import math
+import queue
+import sqlite3
+import threading
+import numpy as np
+from server.feature_builder import DIFFICULTIES
+
+HIST_PREFIX = "hist_"
+HIST_BASE_COLS = ["hist_attempts", "hist_score_ewm", "hist_time_mean", "hist_time_std",
+                  "hist_easy_acc", "hist_medium_acc", "hist_hard_acc"]
+
+def empty_state():
+    return {
+        "attempts": 0,
+        "score_ewm": None,
+        # Welford running mean / sum of squared deviations over question times
+        "time_n": 0,
+        "time_mean": 0.0,
+        "time_m2": 0.0,
+        # exponentially decayed [correct, total] per topic and per difficulty
+        "topics": {},
+        "difficulty": {},
+    }
+
+def summarize_submission(submission):
+    """Per-topic / per-difficulty counts and question times of one submission."""
+    if "topic_ids" in submission:
+        return _summarize_columnar(submission)
+    topics = {}
+    difficulty = {}
+    times = []
+    correct = 0
+    for r in submission.get("responses", []):
+        is_c = 1 if r.get("is_correct") else 0
+        correct += is_c
+        t = topics.setdefault(r.get("topic", "unknown"), [0, 0])
+        t[0] += is_c
+        t[1] += 1
+        d = difficulty.setdefault(r.get("difficulty", "medium"), [0, 0])
+        d[0] += is_c
+        d[1] += 1
+        times.append(max(0.001, float(r.get("time_taken", 0))))
+    return correct, topics, difficulty, times
+
+def _summarize_columnar(submission):
+    # columnar submissions (server/columnar.py) carry numpy arrays instead of response dicts
+    correct = submission["correct"].astype(np.int64)
+    topic_tot = np.bincount(submission["topic_ids"], minlength=len(submission["topics"]))
+    topic_cor = np.bincount(submission["topic_ids"], weights=correct, minlength=len(submission["topics"]))
+    diff_tot = np.bincount(submission["difficulty"], minlength=len(DIFFICULTIES))
+    diff_cor = np.bincount(submission["difficulty"], weights=correct, minlength=len(DIFFICULTIES))
+    topics = {t: [int(topic_cor[i]), int(topic_tot[i])] for i, t in enumerate(submission["topics"]) if topic_tot[i]}
+    difficulty = {d: [int(diff_cor[i]), int(diff_tot[i])] for i, d in enumerate(DIFFICULTIES) if diff_tot[i]}
+    # fmax turns NaN into 0.001, as max(0.001, nan) does for response dicts
+    times = np.fmax(submission["time_taken"], 0.001).tolist()
+    return int(correct.sum()), topics, difficulty, times
+
+def apply_submission(state, submission, decay):
+    """Fold one submission into a user's running aggregates (O(questions), O(1) in history)."""
+    correct, topics, difficulty, times = summarize_submission(submission)
+    if not times:
+        return state
+    score = correct / len(times) * 100.0
+    state["attempts"] += 1
+    prev = state["score_ewm"]
+    state["score_ewm"] = score if prev is None else decay * prev + (1.0 - decay) * score
+
+    # merge this submission's times into the running Welford state (Chan et al.)
+    n_b = len(times)
+    mean_b = sum(times) / n_b
+    m2_b = sum((t - mean_b) ** 2 for t in times)
+    n_a = state["time_n"]
+    n = n_a + n_b
+    delta = mean_b - state["time_mean"]
+    state["time_mean"] += delta * n_b / n
+    state["time_m2"] += m2_b + delta * delta * n_a * n_b / n
+    state["time_n"] = n
+
+    for key, counts in (("topics", topics), ("difficulty", difficulty)):
+        decayed = state[key]
+        for name in decayed:
+            decayed[name][0] *= decay
+            decayed[name][1] *= decay
+        for name, (c, t) in counts.items():
+            cur = decayed.setdefault(name, [0.0, 0.0])
+            cur[0] += c
+            cur[1] += t
+    return state
+
+def history_features(state, topics=()):
+    """Flatten a user's state into hist_* feature columns (np.nan when unknown)."""
+    def acc(pair):
+        return pair[0] / pair[1] if pair and pair[1] > 0 else np.nan
+    diff = state["difficulty"]
+    feat = {
+        "hist_attempts": state["attempts"],
+        "hist_score_ewm": np.nan if state["score_ewm"] is None else state["score_ewm"],
+        "hist_time_mean": state["time_mean"] if state["time_n"] else np.nan,
+        "hist_time_std": math.sqrt(state["time_m2"] / state["time_n"]) if state["time_n"] else np.nan,
+        "hist_easy_acc": acc(diff.get("easy")),
+        "hist_medium_acc": acc(diff.get("medium")),
+        "hist_hard_acc": acc(diff.get("hard")),
+    }
+    for topic in topics:
+        feat[f"hist_topic_acc__{topic}"] = acc(state["topics"].get(topic))
+    return feat
+
+class UserHistoryStore:
+    """
+    Per-user rolling aggregates persisted in SQLite (one row per user, primary-key
+    lookups). Reads return the state before the current submission; update() folds a
+    submission in afterwards inside an immediate transaction, so several worker
+    processes can share the same database file.
+
+    The server calls submit() instead, which only enqueues: after start() a background
+    thread folds the queued submissions in, up to `batch_size` per transaction. A
+    submission is therefore visible to reads shortly after its response, not before.
+    """
+
+    def __init__(self, path, decay=0.8, max_queue=10000, batch_size=500):
+        self.path = path
+        self.decay = decay
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.dropped = 0
+        self._connect()
+
+    def _connect(self):
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS user_history (user_id TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def _connection(self):
+        # an SQLite connection must not be carried across fork(): a forked server
+        # worker opens its own on first use (callers hold self._lock)
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def get(self, user_id):
+        with self._lock:
+            row = self._connection().execute("SELECT state FROM user_history WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else empty_state()
+
+    def get_many(self, user_ids):
+        ids = list(dict.fromkeys(user_ids))
+        states = {u: empty_state() for u in ids}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                q = f"SELECT user_id, state FROM user_history WHERE user_id IN ({','.join('?' * len(chunk))})"
+                for user_id, state in conn.execute(q, chunk):
+                    states[user_id] = json.loads(state)
+        return states
+
+    def update_many(self, submissions):
+        """Fold submissions (in order) into their users' aggregates in one transaction."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                states = {}
+                for sub in submissions:
+                    user_id = sub["user_id"]
+                    if user_id not in states:
+                        row = conn.execute("SELECT state FROM user_history WHERE user_id = ?", (user_id,)).fetchone()
+                        states[user_id] = json.loads(row[0]) if row else empty_state()
+                    apply_submission(states[user_id], sub, self.decay)
+                conn.executemany(
+                    "INSERT INTO user_history (user_id, state) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state",
+                    [(u, json.dumps(s)) for u, s in states.items()],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return states
+
+    def update(self, user_id, submission):
+        return self.update_many([dict(submission, user_id=user_id)])[user_id]
+
+    def submit(self, submissions):
+        """Queue submissions for the background updater; never blocks the caller."""
+        for i, sub in enumerate(submissions):
+            try:
+                self._queue.put_nowait(sub)
+            except queue.Full:
+                # history is best-effort: shed it rather than slow down requests
+                self.dropped += len(submissions) - i
+                return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="user-history", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """Fold in everything queued so far, then stop the updater thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            batch = [sub for sub in batch if sub is not None]
+            if batch:
+                try:
+                    self.update_many(batch)
+                except Exception as e:
+                    print("User history update error:", e)
+            if stopping:
+                return
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._conn.close()
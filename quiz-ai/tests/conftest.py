@@ -0,0 +1,10 @@
+# tests/conftest.py
+# run from quiz-ai/: python -m pytest -q
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules are imported the way the scripts import them: quiz-ai/, quiz-ai/etl/ and quiz-ai/train/ on the path
+for path in (ROOT, os.path.join(ROOT, "etl"), os.path.join(ROOT, "train")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,134 @@
+# tests/test_app.py
+import time
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+class StoredResults:
+    """quiz_results as the result writer sees it: insert(rows) / upsert(rows, on_conflict=...)"""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    def table(self, name):
+        return self
+
+    def insert(self, rows):
+        self.pending, self.unique_on = rows, None
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.pending, self.unique_on = rows, on_conflict
+        return self
+
+    def execute(self):
+        if self.down:
+            raise ConnectionError("quiz_results unavailable")
+        for row in self.pending:
+            key = row.get(self.unique_on) if self.unique_on else None
+            # ON CONFLICT DO NOTHING; NULL keys never conflict, as in Postgres
+            if key is None or all(r.get(self.unique_on) != key for r in self.rows):
+                self.rows.append(row)
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("server")
+    patch = pytest.MonkeyPatch()
+    for name, value in {"SUPABASE_URL": "http://localhost", "SUPABASE_KEY": "test",
+                        "USER_HISTORY_DB": str(tmp / "history.sqlite"), "PROGRESS_DB": str(tmp / "progress.sqlite"),
+                        "WRITE_SPILL_PATH": str(tmp / "spill.jsonl"), "WRITE_FLUSH_SECONDS": "0.01",
+                        "DRIFT_SNAPSHOT_DIR": ""}.items():
+        patch.setenv(name, value)
+    app = importlib.import_module("server.app")
+    app.result_writer.client = StoredResults()
+    with TestClient(app.app) as client:
+        yield app, client
+    patch.undo()
+
+@pytest.fixture
+def stored(server):
+    app, _ = server
+    app.result_writer.client = StoredResults()
+    app.result_cache.clear()
+    return app.result_writer.client
+
+def submission(user_id="u1", start_time="2026-05-01T10:00:00Z", correct=(True, False, True)):
+    sub = {"user_id": user_id, "quiz_id": "q1", "class_id": "c1",
+           "responses": [{"question_id": f"q{i}", "topic": "phonics", "difficulty": "easy", "is_correct": c,
+                          "time_taken": 4.0 + i} for i, c in enumerate(correct)]}
+    if start_time:
+        sub["start_time"] = start_time
+    return sub
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def drain(app):
+    # stop() drains the queue; start again for the next test
+    app.result_writer.stop()
+    app.result_writer.start()
+
+def test_retry_is_answered_from_the_result_cache(server, stored):
+    app, client = server
+    first = client.post("/predict", json=submission()).json()
+    again = client.post("/predict", json=submission()).json()
+    drain(app)
+    assert again["id"] == first["id"]
+    assert len(stored.rows) == 1
+
+def test_retake_without_start_time_is_stored_again(server, stored):
+    app, client = server
+    first = client.post("/predict", json=submission(start_time=None)).json()
+    again = client.post("/predict", json=submission(start_time=None)).json()
+    batch = client.post("/predict/batch", json={"submissions": [submission(start_time=None)] * 2}).json()
+    drain(app)
+    ids = {first["id"], again["id"]} | {r["id"] for r in batch["results"]}
+    assert len(ids) == 4
+    assert len(stored.rows) == 4
+
+def test_unique_column_is_opt_in(server, stored, monkeypatch):
+    app, client = server
+    assert app.WRITE_UNIQUE_COLUMN == ""
+    client.post("/predict", json=submission())
+    drain(app)
+    assert stored.unique_on is None and "submission_key" not in stored.rows[0]
+
+    monkeypatch.setattr(app, "WRITE_UNIQUE_COLUMN", "submission_key")
+    monkeypatch.setattr(app.result_writer, "unique_on", "submission_key")
+    client.post("/predict", json=submission(user_id="u2"))
+    # the same submission scored again by another worker (empty result cache)
+    app.result_cache.clear()
+    client.post("/predict", json=submission(user_id="u2"))
+    client.post("/predict", json=submission(user_id="u2", start_time=None))
+    drain(app)
+    keys = [r["submission_key"] for r in stored.rows[1:]]
+    assert len(keys) == 2 and keys[1] is None
+
+def test_progress_counts_only_stored_results(server, stored, monkeypatch):
+    app, client = server
+    monkeypatch.setattr(app.result_writer, "max_retries", 0)
+    stored.down = True
+    client.post("/predict", json=submission(user_id="p1"))
+    drain(app)
+    # the insert failed and the row went to the spill file: nothing rolled up yet
+    assert app.progress.learner("p1") is None
+    stored.down = False
+    # replayed when the writer starts again, and rolled up with its class
+    drain(app)
+    wait_for(lambda: app.progress.learner("p1") is not None)
+    assert len(stored.rows) == 1 and "_class_id" not in stored.rows[0]
+    assert app.progress.learner("p1")["attempts"] == 1
+    assert app.progress.history("p1")[0][0]["class_id"] == "c1"
+    assert client.get("/progress/learners/p1").json()["attempts"] == 1
+
+def test_history_is_recorded_although_no_model_reads_it(server, stored):
+    app, client = server
+    assert not app.registry.active().hist_cols
+    client.post("/predict", json=submission(user_id="h1"))
+    client.post("/predict/batch", json={"submissions": [submission(user_id="h1", start_time="2026-05-02T10:00:00Z")]})
+    wait_for(lambda: app.user_history.get("h1")["attempts"] == 2)
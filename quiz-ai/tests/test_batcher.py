@@ -0,0 +1,121 @@
+# tests/test_batcher.py
+import time
+import asyncio
+import threading
+
+import pytest
+
+from server.batcher import MicroBatcher
+
+class Recorder:
+    """process() stand-in: doubles every item and remembers each batch and when it ran."""
+
+    def __init__(self, fail=None, delay=0.0):
+        self.batches = []
+        self.started = []
+        self.fail = fail
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        with self._lock:
+            self.batches.append(list(items))
+            self.started.append(time.perf_counter())
+        time.sleep(self.delay)
+        if self.fail is not None:
+            raise self.fail
+        return [2 * x for x in items]
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_lone_request_is_not_held_for_the_window():
+    process = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(process, window=1.0).start()
+        start = time.perf_counter()
+        result = await batcher.submit(21)
+        elapsed = time.perf_counter() - start
+        await batcher.stop()
+        return result, elapsed
+
+    result, elapsed = run(main())
+    assert result == 42
+    assert elapsed < 0.5
+    assert process.batches == [[21]]
+
+def test_concurrent_requests_go_out_together_at_the_deadline():
+    process = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(process, window=0.05, max_batch=64).start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        await batcher.stop()
+        return results, process.started[0] - start
+
+    results, waited = run(main())
+    assert results == [0, 2, 4, 6, 8]
+    assert process.batches == [[0, 1, 2, 3, 4]]
+    assert waited >= 0.05
+
+def test_full_batch_is_dispatched_before_the_deadline():
+    process = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(process, window=0.3, max_batch=4, max_concurrency=4).start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        await batcher.stop()
+        return results, [t - start for t in process.started]
+
+    results, started = run(main())
+    assert results == [2 * i for i in range(10)]
+    assert [len(b) for b in process.batches] == [4, 4, 2]
+    assert sum(process.batches, []) == list(range(10))
+    # the two full batches did not wait for the window
+    assert started[0] < 0.3 and started[1] < 0.3
+
+def test_a_failed_batch_fails_every_waiting_caller():
+    process = Recorder(fail=ValueError("model error"))
+
+    async def main():
+        batcher = MicroBatcher(process, window=0.01).start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        await batcher.stop()
+        return batcher, results
+
+    batcher, results = run(main())
+    assert all(isinstance(r, ValueError) and str(r) == "model error" for r in results)
+    assert batcher.stats["failed_batches"] == 1
+
+def test_wrong_number_of_results_is_an_error():
+    async def main():
+        batcher = MicroBatcher(lambda items: items[:-1], window=0.01).start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+def test_stop_drains_queued_and_running_batches():
+    # one slot and a slow process: most items are still queued when stop() is called
+    process = Recorder(delay=0.05)
+    seen = []
+
+    async def main():
+        batcher = MicroBatcher(process, window=0.01, max_batch=2, max_concurrency=1,
+                               on_batch=lambda n, waits, seconds: seen.append(n)).start()
+        calls = [asyncio.ensure_future(batcher.submit(i)) for i in range(7)]
+        await asyncio.sleep(0)
+        await batcher.stop()
+        with pytest.raises(RuntimeError, match="not running"):
+            await batcher.submit(99)
+        return [c.result() for c in calls], batcher
+
+    results, batcher = run(main())
+    assert results == [2 * i for i in range(7)]
+    assert sum(seen) == 7 and batcher.stats["requests"] == 7
+    assert batcher.pending() == 0
@@ -0,0 +1,57 @@
+# tests/test_build_features.py
+import json
+
+import pandas as pd
+import pytest
+
+from build_features import add_labels, build_features_columnar, process_one_attempt
+from generate_synthetic_data import generate_raw_attempts
+
+def row_wise(df_raw):
+    """The reference: process_one_attempt over every row, attempts without responses left out."""
+    rows = {i: process_one_attempt(r) for i, r in zip(df_raw.index, df_raw.to_dict("records"))}
+    rows = {i: r for i, r in rows.items() if r is not None}
+    return pd.DataFrame(list(rows.values()), index=pd.Index(list(rows.keys())))
+
+def raw_frame():
+    df = generate_raw_attempts(300, seed=4, n_topics=5)
+    responses = [json.loads(r) for r in df["responses"]]
+    # attempts without responses
+    responses[3] = []
+    responses[10] = []
+    # topics and difficulties outside the usual sets, and missing keys
+    responses[5][0]["topic"] = "handwriting"
+    responses[6][1]["difficulty"] = "expert"
+    del responses[7][0]["topic"]
+    del responses[8][0]["difficulty"]
+    # NaN, missing and zero times
+    responses[9][0]["time_taken"] = float("nan")
+    del responses[11][0]["time_taken"]
+    for r in responses[12]:
+        r["time_taken"] = 0.0
+    df["responses"] = [json.dumps(r) for r in responses]
+    return df
+
+def test_columnar_matches_the_row_wise_reference():
+    df_raw = raw_frame()
+    df_feat, topics = build_features_columnar(df_raw)
+    expected = row_wise(df_raw)
+    assert len(df_feat) == 298
+    assert {"topic_acc__handwriting", "topic_acc__unknown"} <= set(df_feat.columns)
+    assert topics == [c[len("topic_acc__"):] for c in expected.columns if c.startswith("topic_acc__")]
+    pd.testing.assert_frame_equal(df_feat, expected, check_dtype=False, rtol=1e-9)
+
+def test_columnar_matches_on_a_shuffled_chunk():
+    # a chunk as read from the middle of a file: index does not start at 0
+    df_raw = raw_frame().sample(frac=1.0, random_state=0)
+    df_raw.index = df_raw.index + 50000
+    df_feat, _ = build_features_columnar(df_raw)
+    pd.testing.assert_frame_equal(df_feat, row_wise(df_raw), check_dtype=False, rtol=1e-9)
+
+@pytest.mark.parametrize("score, label", [(0.0, 0), (49.9, 0), (50.0, 1), (79.9, 1), (80.0, 2), (100.0, 2)])
+def test_skill_level_labels(score, label):
+    df = pd.DataFrame({"quiz_score": [score], "time_std": [0.0], "topic_acc__spelling": [0.5]})
+    out = add_labels(df, ["spelling", "grammar"])
+    assert out["skill_level_label"].tolist() == [label]
+    assert out["weak_topic__spelling"].tolist() == [1] and out["weak_topic__grammar"].tolist() == [0]
+    assert out["confidence_score"].tolist() == [score / 100.0]
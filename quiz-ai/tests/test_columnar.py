@@ -0,0 +1,90 @@
+# tests/test_columnar.py
+import base64
+
+import msgpack
+import numpy as np
+import pytest
+
+from server.columnar import parse_columnar, to_columnar
+from server.feature_builder import build_feature_matrix, build_feature_matrix_columnar
+from server.serialization import decode_body, dumps
+from server.user_history import summarize_submission
+
+FEATURE_COLS = ["correct_count", "total_questions", "avg_time", "median_time", "time_std",
+                "easy_acc", "medium_acc", "hard_acc", "topic_acc__phonics", "topic_acc__spelling"]
+
+def submission(n, offset=0):
+    topics = ["phonics", "spelling", "grammar"]
+    return {"user_id": "u1", "quiz_id": "q1", "start_time": "2026-05-01T10:00:00Z",
+            "responses": [{"question_id": f"q{i}", "topic": topics[(i + offset) % 3],
+                           "difficulty": ["easy", "medium", "hard"][(i * 2 + offset) % 3],
+                           "is_correct": (i + offset) % 3 != 0, "time_taken": 2.5 + i} for i in range(n)]}
+
+def payload(n=5):
+    return to_columnar(submission(n))
+
+def test_round_trip_matches_the_dict_path():
+    # ragged batch: every submission has its own length, including none at all
+    subs = [submission(n, offset=n) for n in (0, 1, 7, 3, 12, 0, 2)]
+    parsed = [parse_columnar(to_columnar(s)) for s in subs]
+    assert [len(p["topic_ids"]) for p in parsed] == [0, 1, 7, 3, 12, 0, 2]
+    np.testing.assert_allclose(build_feature_matrix_columnar(parsed, FEATURE_COLS),
+                               build_feature_matrix(subs, FEATURE_COLS), rtol=1e-12, equal_nan=True)
+    for s, p in zip(subs, parsed):
+        assert summarize_submission(p) == summarize_submission(s)
+
+@pytest.mark.parametrize("dtype", ["<f4", "<f8"])
+def test_time_taken_as_little_endian_bytes(dtype):
+    times = [1.5, 2.25, 30.0, 0.0, 8.5]
+    p = payload(5)
+    p["time_taken"] = np.array(times, dtype=dtype).tobytes()
+    parsed = parse_columnar(p)
+    assert parsed["time_taken"].dtype == np.float64
+    np.testing.assert_array_equal(parsed["time_taken"], times)
+
+def test_msgpack_body_with_raw_bytes():
+    p = payload(9)
+    p["topic_ids"] = bytes(p["topic_ids"])
+    p["correct"] = base64.b64decode(p["correct"])
+    p["time_taken"] = np.array(p["time_taken"], dtype="<f4").tobytes()
+    from_msgpack = parse_columnar(decode_body(msgpack.packb(p), "application/msgpack"))
+    from_json = parse_columnar(decode_body(dumps(payload(9)), "application/json"))
+    for key in ("topic_ids", "difficulty", "correct", "time_taken"):
+        np.testing.assert_array_equal(from_msgpack[key], from_json[key])
+
+def test_nan_times_are_summarized_like_response_dicts():
+    sub = submission(4)
+    sub["responses"][1]["time_taken"] = float("nan")
+    assert summarize_submission(parse_columnar(to_columnar(sub))) == summarize_submission(sub)
+
+@pytest.mark.parametrize("field, value, message", [
+    ("time_taken", np.zeros(5, dtype="<f8").tobytes()[:-1], "time_taken has 39 bytes"),
+    ("time_taken", np.zeros(6, dtype="<f4").tobytes(), "expected 20 or 40"),
+    ("time_taken", [1.0, 2.0], "time_taken must have 5 entries"),
+    ("correct", b"\x00\x00", "correct bitmap has 2 bytes, expected 1"),
+    ("correct", [1, 0, 1], "correct must have 5 entries"),
+    ("difficulty", [0, 1], "difficulty must have 5 entries"),
+    ("difficulty", [0, 1, 2, 3, 0], "difficulty codes must be 0..2"),
+    ("topic_ids", [0, 1, 9, 0, 0], "topic_ids must index into topics"),
+    ("topic_ids", [0.5, 1, 0, 0, 0], "topic_ids must be a list of integers"),
+    # bytes only come from msgpack; a JSON string is not a time list
+    ("time_taken", "AAAAAAAA+D8=", "could not convert"),
+])
+def test_malformed_payloads_are_rejected(field, value, message):
+    p = payload(5)
+    p[field] = value
+    with pytest.raises(ValueError, match=message):
+        parse_columnar(p)
+
+def test_missing_fields_are_rejected():
+    p = payload(3)
+    del p["correct"]
+    with pytest.raises(ValueError, match="missing field correct"):
+        parse_columnar(p)
+    with pytest.raises(ValueError, match="must be an object"):
+        parse_columnar([p])
+
+def test_difficulty_defaults_to_medium():
+    p = payload(4)
+    del p["difficulty"]
+    assert parse_columnar(p)["difficulty"].tolist() == [1, 1, 1, 1]
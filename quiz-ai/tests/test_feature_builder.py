@@ -0,0 +1,90 @@
+# tests/test_feature_builder.py
+import random
+
+import numpy as np
+import pytest
+
+from server.feature_builder import FeatureLayout, build_feature_matrix, build_features_from_submission
+
+TOPICS = ["phonics", "rhyming", "spelling", "grammar"]
+FEATURE_COLS = (["correct_count", "total_questions", "avg_time", "median_time", "time_std",
+                 "easy_acc", "medium_acc", "hard_acc"]
+                + [f"topic_acc__{t}" for t in TOPICS] + ["hist_attempts"])
+
+def make_submission(rng, n_responses):
+    responses = []
+    for i in range(n_responses):
+        r = {"question_id": f"q{i}", "is_correct": rng.random() < 0.6, "time_taken": round(rng.uniform(0, 30), 1)}
+        # topics and difficulties the model does not know, and missing keys, on some responses
+        if rng.random() < 0.9:
+            r["topic"] = rng.choice(TOPICS + ["vocabulary"])
+        if rng.random() < 0.9:
+            r["difficulty"] = rng.choice(["easy", "medium", "hard", "expert"])
+        responses.append(r)
+    return {"user_id": "u1", "quiz_id": "q1", "responses": responses}
+
+def reference_row(submission, feature_cols, known_topics):
+    feat = build_features_from_submission(submission, known_topics)
+    return np.array([feat.get(c, np.nan) for c in feature_cols], dtype=np.float64)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fill_matches_build_features_from_submission(seed):
+    rng = random.Random(seed)
+    cols = list(FEATURE_COLS)
+    # the layout follows feature_cols, whatever their order
+    rng.shuffle(cols)
+    layout = FeatureLayout(cols)
+    for n in [0, 1, 2, 7, 40]:
+        sub = make_submission(rng, n)
+        np.testing.assert_allclose(layout.fill(sub["responses"]), reference_row(sub, cols, layout.known_topics),
+                                   rtol=1e-12, equal_nan=True)
+
+def test_fill_matches_build_feature_matrix():
+    rng = random.Random(7)
+    layout = FeatureLayout(FEATURE_COLS)
+    subs = [make_submission(rng, rng.randint(0, 25)) for _ in range(50)]
+    rows = np.vstack([layout.fill(s["responses"]) for s in subs])
+    np.testing.assert_allclose(rows, build_feature_matrix(subs, FEATURE_COLS), rtol=1e-12, equal_nan=True)
+
+def test_fill_overwrites_the_output_row():
+    layout = FeatureLayout(FEATURE_COLS)
+    out = np.zeros(layout.width)
+    layout.fill([{"topic": "phonics", "difficulty": "hard", "is_correct": True, "time_taken": 3.0}], out=out)
+    layout.fill([{"topic": "rhyming", "difficulty": "easy", "is_correct": False, "time_taken": 5.0}], out=out)
+    row = dict(zip(FEATURE_COLS, out))
+    # nothing carries over from the previous submission
+    assert np.isnan(row["topic_acc__phonics"]) and np.isnan(row["hard_acc"])
+    assert row["topic_acc__rhyming"] == 0.0 and row["easy_acc"] == 0.0
+    assert row["correct_count"] == 0 and row["total_questions"] == 1
+
+def test_columns_the_layout_does_not_compute_stay_nan():
+    layout = FeatureLayout(["hist_attempts", "total_questions", "topic_acc__spelling"])
+    row = layout.fill([{"topic": "spelling", "is_correct": True, "time_taken": 1.0}])
+    assert np.isnan(row[0])
+    assert row[1] == 1 and row[2] == 1.0
+
+def columnar_matrix(subs, cols):
+    from server.columnar import parse_columnar, to_columnar
+    from server.feature_builder import build_feature_matrix_columnar
+    return build_feature_matrix_columnar([parse_columnar(to_columnar(s)) for s in subs], cols)
+
+def test_columnar_matches_per_item_with_nan_empty_and_zero_times():
+    rng = random.Random(3)
+    subs = [make_submission(rng, rng.randint(1, 12)) for _ in range(20)]
+    for sub in subs:
+        for r in sub["responses"]:
+            # columnar payloads only carry the three known difficulty codes
+            r["difficulty"] = r.get("difficulty") if r.get("difficulty") in ("easy", "medium", "hard") else "medium"
+    subs[0]["responses"][0]["time_taken"] = float("nan")
+    for r in subs[1]["responses"]:
+        r["time_taken"] = float("nan")
+    for r in subs[2]["responses"]:
+        r["time_taken"] = 0.0
+    del subs[3]["responses"][0]["time_taken"]
+    subs.append({"user_id": "u1", "quiz_id": "q1", "responses": []})
+    expected = build_feature_matrix(subs, FEATURE_COLS)
+    assert not np.isnan(expected[:, FEATURE_COLS.index("avg_time")]).any()
+    np.testing.assert_allclose(columnar_matrix(subs, FEATURE_COLS), expected, rtol=1e-12, equal_nan=True)
+    layout = FeatureLayout(FEATURE_COLS)
+    np.testing.assert_allclose(np.vstack([layout.fill(s["responses"]) for s in subs]), expected,
+                               rtol=1e-12, equal_nan=True)
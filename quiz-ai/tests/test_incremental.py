@@ -0,0 +1,63 @@
+# tests/test_incremental.py
+import json
+import os
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+import incremental
+import train_models
+from server.model_registry import MANIFEST_FILE, load_registry_bundle, publish_bundle
+
+def attempts(date, ids):
+    return pd.DataFrame({"user_id": [f"u{i % 3}" for i in ids], "attempt_date": date, "attempt_id": ids})
+
+def publish(tmp_path, mark):
+    X = np.random.default_rng(0).normal(size=(50, 2))
+    booster = lgb.train({"objective": "regression", "verbose": -1}, lgb.Dataset(X, X[:, 0]), num_boost_round=2)
+    recorded, files = train_models.publish_watermark(mark)
+    return publish_bundle({"quiz_score": booster}, ["a", "b"], [], registry_dir=str(tmp_path),
+                          activate_now=False, extra={"watermark": recorded}, data_files=files)
+
+def test_watermark_ids_live_outside_the_manifest(tmp_path):
+    df = pd.concat([attempts("2025-11-01", [1, 2]), attempts("2025-11-02", [7, 5, 9])])
+    mark = train_models.data_watermark(df)
+    assert mark == {"attempt_date": "2025-11-02", "attempt_ids": [5, 7, 9]}
+
+    version = publish(tmp_path, mark)
+    with open(os.path.join(tmp_path, version, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    assert manifest["watermark"] == {"attempt_date": "2025-11-02", "attempt_id_count": 3,
+                                     "attempt_ids_file": train_models.WATERMARK_IDS_FILE}
+    bundle = load_registry_bundle(version, str(tmp_path), use_fused=False)
+    assert "attempt_ids" not in bundle.manifest["watermark"]
+    assert train_models.load_watermark(bundle.manifest, version, str(tmp_path)) == mark
+
+def test_same_day_delta_extends_the_ids(tmp_path):
+    base = {"attempt_date": "2025-11-02", "attempt_ids": [5, 7]}
+    same_day = incremental.advance_watermark(base, attempts("2025-11-02", [3]))
+    assert same_day == {"attempt_date": "2025-11-02", "attempt_ids": [3, 5, 7]}
+    next_day = incremental.advance_watermark(base, pd.concat([attempts("2025-11-02", [3]), attempts("2025-11-03", [4])]))
+    assert next_day == {"attempt_date": "2025-11-03", "attempt_ids": [4]}
+
+    version = publish(tmp_path, same_day)
+    manifest = load_registry_bundle(version, str(tmp_path), use_fused=False).manifest
+    assert train_models.load_watermark(manifest, version, str(tmp_path)) == same_day
+
+def test_manifests_without_an_ids_file_load_as_they_are(tmp_path):
+    assert train_models.load_watermark({}, "v", str(tmp_path)) is None
+    inline = {"attempt_date": "2025-11-02", "attempt_ids": [1]}
+    assert train_models.load_watermark({"watermark": inline}, "v", str(tmp_path)) == inline
+    assert train_models.load_watermark({"watermark": {"rows": 10}}, "v", str(tmp_path)) == {"rows": 10}
+
+def test_delta_rereads_the_watermark_day_without_its_seen_ids(tmp_path, monkeypatch):
+    df = pd.concat([attempts("2025-11-01", [1, 2]), attempts("2025-11-02", [5, 7, 8]), attempts("2025-11-03", [9])])
+    for col in ("quiz_score", "confidence_score", "skill_level_label", "f"):
+        df[col] = 1.0
+    path = tmp_path / "features.csv"
+    df.to_csv(path, index=False)
+    monkeypatch.setattr(train_models, "DATA_CSV", str(path))
+    monkeypatch.setattr(train_models, "FEATURE_STORE_DIR", None)
+    delta = incremental.load_delta({"attempt_date": "2025-11-02", "attempt_ids": [5, 7]}, ["f"], [])
+    assert delta["attempt_id"].tolist() == [8, 9]
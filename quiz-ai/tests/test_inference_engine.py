@@ -0,0 +1,78 @@
+# tests/test_inference_engine.py
+import lightgbm as lgb
+import numpy as np
+import pytest
+
+from server.inference_engine import FusedEngine
+
+PARAMS = {"num_leaves": 15, "min_data_in_leaf": 5, "learning_rate": 0.2, "verbose": -1, "num_threads": 1, "seed": 0}
+
+def training_data(n=600, f=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, f))
+    # NaN (missing_type NaN splits) in one column, exact zeros in another
+    X[rng.random(n) < 0.2, 1] = np.nan
+    X[rng.random(n) < 0.3, 2] = 0.0
+    signal = X[:, 0] + np.nan_to_num(X[:, 1]) - X[:, 3] * X[:, 4]
+    return X, signal
+
+def train(objective, y, X, rounds=30, **extra):
+    params = dict(PARAMS, objective=objective, **extra)
+    return lgb.train(params, lgb.Dataset(X, y), num_boost_round=rounds)
+
+@pytest.fixture(scope="module")
+def boosters():
+    X, signal = training_data()
+    return {
+        "quiz_score": train("regression", 50 + 10 * signal, X),
+        "skill_level": train("multiclass", np.digitize(signal, [-0.5, 0.5]), X, num_class=3),
+        "weak": train("binary", (signal > 0).astype(int), X),
+        # zero_as_missing: splits with missing_type Zero
+        "confidence": train("regression", signal, X, zero_as_missing=True),
+    }
+
+def inputs(f=8):
+    X, _ = training_data(n=80, f=f, seed=1)
+    X[5] = np.nan
+    X[6] = 0.0
+    X[7, ::2] = np.nan
+    return X
+
+def assert_matches(out, boosters, X):
+    for name, booster in boosters.items():
+        expected = booster.predict(X)
+        assert out[name].shape == expected.shape
+        assert np.allclose(out[name], expected, rtol=0, atol=1e-9), name
+
+def test_fused_walk_matches_booster_predict(boosters):
+    engine = FusedEngine(boosters)
+    X = inputs()
+    assert_matches(engine._fused(X), boosters, X)
+    # single rows, as /predict scores them
+    for i in (0, 5, 6, 7):
+        assert_matches(engine._fused(X[i]), boosters, X[i:i + 1])
+
+def test_predict_matches_on_both_sides_of_max_fused_rows(boosters):
+    engine = FusedEngine(boosters, max_fused_rows=16)
+    X = inputs()
+    assert_matches(engine.predict(X[:16]), boosters, X[:16])
+    assert_matches(engine.predict(X), boosters, X)
+
+def test_calibration_keeps_predictions_unchanged(boosters):
+    engine = FusedEngine(boosters)
+    rows = engine.calibrate(sizes=(1, 8), reps=3)
+    assert rows in (0, 1, 8) and rows == engine.max_fused_rows
+    assert set(engine.calibration) <= {1, 8}
+    X = inputs()
+    for n in (1, 8, 80):
+        assert_matches(engine.predict(X[:n]), boosters, X[:n])
+
+def test_unsupported_models_are_refused():
+    X, signal = training_data(n=200)
+    with pytest.raises(NotImplementedError):
+        FusedEngine({"counts": train("poisson", np.abs(signal), X, rounds=3)})
+
+def test_feature_count_is_checked(boosters):
+    engine = FusedEngine(boosters)
+    with pytest.raises(ValueError):
+        engine.raw_scores(np.zeros((1, 5)))
@@ -0,0 +1,218 @@
+# tests/test_prod_source.py
+import os
+import sqlite3
+import uuid
+
+import pandas as pd
+import pytest
+
+import feature_store
+import prod_source
+from generate_synthetic_data import generate_raw_attempts
+
+def test_plan_pages_are_aligned_and_cover_the_range():
+    assert prod_source.plan_pages(0, 250, 100) == [(0, 100), (100, 200), (200, 250)]
+    # the page holding the watermark is read again, from its aligned start
+    assert prod_source.plan_pages(130, 250, 100) == [(100, 200), (200, 250)]
+    assert prod_source.plan_pages(200, 201, 100) == [(200, 201)]
+    assert prod_source.plan_pages(300, 300, 100) == []
+
+class SqliteConnection:
+    """The psycopg2 connection calls prod_source makes, on a sqlite file."""
+
+    def __init__(self, db):
+        self.db = db
+        self.conn = sqlite3.connect(db.path, check_same_thread=False)
+
+    def set_session(self, readonly=False):
+        self.conn.execute(f"PRAGMA query_only = {int(readonly)}")
+
+    def cursor(self, name=None):
+        return SqliteCursor(self.db, self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+class SqliteCursor:
+    def __init__(self, db, cur):
+        self.db = db
+        self.cur = cur
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cur.close()
+
+    def execute(self, query, params=()):
+        if self.db.fail_at is not None and f"> {self.db.fail_at} AND" in query:
+            raise sqlite3.OperationalError("connection lost")
+        self.cur.execute(query, params)
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def fetchmany(self, size):
+        return self.cur.fetchmany(size)
+
+class RawTable:
+    """The raw table in sqlite: one row per attempt under an integer key."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fail_at = None
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE quiz_attempts (id INTEGER PRIMARY KEY, user_id TEXT, quiz_id TEXT, "
+                         "responses TEXT, start_time TEXT, end_time TEXT)")
+
+    def insert(self, df, keys=None):
+        """Commit df under the next keys, or under the given keys (a late commit)."""
+        with sqlite3.connect(self.path) as conn:
+            last = conn.execute("SELECT coalesce(max(id), 0) FROM quiz_attempts").fetchone()[0]
+            keys = keys or range(last + 1, last + len(df) + 1)
+            conn.executemany("INSERT INTO quiz_attempts VALUES (?, ?, ?, ?, ?, ?)",
+                             [(k, *row) for k, row in zip(keys, df[prod_source.RAW_COLUMNS].itertuples(index=False))])
+
+@pytest.fixture
+def raw(monkeypatch, tmp_path):
+    table = RawTable(str(tmp_path / "raw.db"))
+    monkeypatch.setattr(prod_source.psycopg2, "connect", lambda dsn: SqliteConnection(table))
+    monkeypatch.setattr(prod_source, "FEATURE_STORE_DIR", str(tmp_path / "store"))
+    return table
+
+def test_paging_reads_each_committed_key_once(raw):
+    raw.insert(generate_raw_attempts(250, seed=1))
+    conn = SqliteConnection(raw)
+    assert prod_source.key_range(conn, "quiz_attempts", "id") == (1, 250)
+    reader = prod_source.PageReader("", "quiz_attempts", "id", "cursor", 3)
+    try:
+        pages = list(reader.pages(prod_source.plan_pages(0, 250, 100)))
+    finally:
+        reader.close()
+    assert [page for page, _ in pages] == [(0, 100), (100, 200), (200, 250)]
+    keys = pd.concat([df["id"] for _, df in pages]).tolist()
+    assert keys == list(range(1, 251))
+    assert list(pages[0][1].columns) == ["id"] + prod_source.RAW_COLUMNS
+
+def stored_ids():
+    df = feature_store.read_features(prod_source.FEATURE_STORE_DIR, columns=["attempt_id"])
+    return df["attempt_id"].tolist()
+
+def run(*args):
+    return prod_source.main(["--method", "cursor", "--page-size", "100", "--lookback", "150", *args])
+
+def test_resume_reads_only_new_attempts_and_keeps_each_once(raw):
+    raw.insert(generate_raw_attempts(600, seed=1))
+    assert run() == 0
+    assert len(stored_ids()) == 600
+    assert prod_source.read_state(prod_source.FEATURE_STORE_DIR)["watermark"] == 600
+
+    raw.insert(generate_raw_attempts(130, seed=2))
+    assert run() == 0
+    ids = stored_ids()
+    assert len(ids) == 730 and len(set(ids)) == 730
+    assert prod_source.read_state(prod_source.FEATURE_STORE_DIR)["watermark"] == 730
+
+    # nothing new: the rebuilt pages replace their own files
+    assert run() == 0
+    assert sorted(stored_ids()) == sorted(ids)
+
+def test_interrupted_run_resumes_from_the_last_page(raw):
+    raw.insert(generate_raw_attempts(600, seed=1))
+    raw.fail_at = 300
+    with pytest.raises(sqlite3.OperationalError):
+        run()
+    assert prod_source.read_state(prod_source.FEATURE_STORE_DIR)["watermark"] == 300
+    raw.fail_at = None
+    assert run() == 0
+    ids = stored_ids()
+    assert len(ids) == 600 and len(set(ids)) == 600
+
+def late_commit(raw, key):
+    """600 attempts committed around `key`, whose attempt commits after the first run."""
+    df = generate_raw_attempts(600, seed=1)
+    keys = [k for k in range(1, 601) if k != key]
+    raw.insert(df.drop(index=key - 1), keys=keys)
+    run()
+    assert len(stored_ids()) == 599
+    raw.insert(df.iloc[[key - 1]], keys=[key])
+    run()
+
+def test_late_commit_within_the_lookback_is_picked_up(raw):
+    late_commit(raw, 420)
+    ids = stored_ids()
+    assert len(ids) == 600 and len(set(ids)) == 600
+
+def test_late_commit_past_the_lookback_is_missed(raw):
+    # only (600 - 150, 600] is read again, from its aligned page start
+    late_commit(raw, 120)
+    assert len(stored_ids()) == 599
+
+def test_page_size_is_kept_from_the_store(raw):
+    raw.insert(generate_raw_attempts(600, seed=1))
+    run()
+    raw.insert(generate_raw_attempts(10, seed=3))
+    prod_source.main(["--method", "cursor", "--page-size", "64"])
+    assert prod_source.read_state(prod_source.FEATURE_STORE_DIR)["page_size"] == 100
+    assert len(set(stored_ids())) == 610
+
+def test_empty_table_does_nothing(raw):
+    assert run() == 0
+    assert prod_source.read_state(prod_source.FEATURE_STORE_DIR) is None
+
+# Against a real Postgres, e.g.
+#   ETL_TEST_DATABASE_URL=postgresql://localhost/postgres python -m pytest -q tests/test_prod_source.py
+TEST_DATABASE_URL = os.environ.get("ETL_TEST_DATABASE_URL")
+
+@pytest.fixture
+def pg_table(monkeypatch, tmp_path):
+    if not TEST_DATABASE_URL:
+        pytest.skip("ETL_TEST_DATABASE_URL is not set")
+    name = f"etl_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(prod_source, "DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(prod_source, "RAW_TABLE", name)
+    monkeypatch.setattr(prod_source, "FEATURE_STORE_DIR", str(tmp_path / "store"))
+    conn = prod_source.psycopg2.connect(TEST_DATABASE_URL)
+    yield conn, name
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {prod_source.quote_ident(name)}")
+    conn.commit()
+    conn.close()
+
+def insert_attempts(conn, table, df):
+    with conn.cursor() as cur:
+        for row in df.itertuples(index=False):
+            cur.execute(f"INSERT INTO {prod_source.quote_ident(table)} "
+                        "(user_id, quiz_id, responses, start_time, end_time) VALUES (%s, %s, %s, %s, %s)",
+                        (row.user_id, row.quiz_id, row.responses, row.start_time, row.end_time))
+
+@pytest.mark.parametrize("method", ["copy", "cursor"])
+def test_postgres_late_commit_is_picked_up(pg_table, tmp_path, method):
+    conn, table = pg_table
+    path = tmp_path / "raw.csv"
+    generate_raw_attempts(300, seed=1).to_csv(path, index=False)
+    assert prod_source.load_csv(conn, str(path), table) == 300
+
+    # a transaction takes key 301 and stays open while 302..311 commit
+    late = prod_source.psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        insert_attempts(late, table, generate_raw_attempts(1, seed=2))
+        insert_attempts(conn, table, generate_raw_attempts(10, seed=3))
+        conn.commit()
+        args = ["--method", method, "--workers", "2", "--page-size", "64"]
+        assert prod_source.main(args) == 0
+        assert len(stored_ids()) == 310
+        late.commit()
+    finally:
+        late.close()
+    assert prod_source.main(args) == 0
+    ids = stored_ids()
+    assert len(ids) == 311 and len(set(ids)) == 311
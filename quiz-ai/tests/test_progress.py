@@ -0,0 +1,130 @@
+# tests/test_progress.py
+import json
+
+import pytest
+
+from server.progress import ProgressStore, backfill, class_summary, learner_summary
+
+def result(i, user_id, skill="Intermediate", score=None, weak=()):
+    return {"id": f"r{i}", "user_id": user_id, "quiz_id": f"q{i % 3}",
+            "quiz_score": float(score if score is not None else 40 + i % 50), "skill_level": skill,
+            "confidence_score": 0.8, "weak_topics": list(weak), "taken_at": f"2026-03-{1 + i % 28:02d}T10:00:00Z"}
+
+@pytest.fixture
+def store(tmp_path):
+    s = ProgressStore(str(tmp_path / "progress.sqlite"))
+    yield s
+    s.close()
+
+def fold(store, results, class_id=None):
+    store.update_many([{"class_id": class_id} for _ in results], results)
+
+def test_history_pages_newest_first_without_gaps(store):
+    fold(store, [result(i, "u1") for i in range(23)])
+    fold(store, [result(100 + i, "u2") for i in range(5)])
+    seen, cursor, pages = [], None, 0
+    while True:
+        items, cursor = store.history("u1", limit=10, before=cursor)
+        seen += [item["id"] for item in items]
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    assert seen == [f"r{i}" for i in reversed(range(23))]
+
+def test_history_cursor_is_stable_while_results_arrive(store):
+    fold(store, [result(i, "u1") for i in range(10)])
+    first, cursor = store.history("u1", limit=4)
+    fold(store, [result(50, "u1")])
+    second, _ = store.history("u1", limit=4, before=cursor)
+    # the new result is on the first page, not pushed into the next one
+    assert [i["id"] for i in first] == ["r9", "r8", "r7", "r6"]
+    assert [i["id"] for i in second] == ["r5", "r4", "r3", "r2"]
+
+def test_history_last_page_has_no_cursor(store):
+    fold(store, [result(i, "u1") for i in range(4)])
+    items, cursor = store.history("u1", limit=4)
+    assert len(items) == 4 and cursor is None
+    assert store.history("nobody") == ([], None)
+
+def test_class_learners_page_by_user_id(store):
+    fold(store, [result(i, f"u{i:02d}") for i in range(12)], class_id="c1")
+    fold(store, [result(99, "other")], class_id="c2")
+    ids, cursor = [], None
+    while True:
+        items, cursor = store.class_learners("c1", limit=5, after=cursor)
+        ids += [item["user_id"] for item in items]
+        if cursor is None:
+            break
+    assert ids == [f"u{i:02d}" for i in range(12)]
+
+def test_rollups(store):
+    fold(store, [result(0, "u1", "Beginner", 30, ["rhyming"]), result(1, "u1", "Intermediate", 60, ["rhyming"]),
+                 result(2, "u2", "Advanced", 90)], class_id="c1")
+    fold(store, [result(3, "u1", "Advanced", 80)], class_id="c1")
+    learner = learner_summary("u1", store.learner("u1"), days=10000)
+    assert learner["attempts"] == 3 and learner["best_score"] == 80 and learner["last_score"] == 80
+    assert learner["skill_transitions"] == [{"from": "Beginner", "to": "Intermediate", "count": 1},
+                                            {"from": "Intermediate", "to": "Advanced", "count": 1}]
+    assert learner["weak_topics"] == [{"topic": "rhyming", "attempts": 2}]
+    classroom = class_summary("c1", store.classroom("c1"), days=10000)
+    # each learner counted once, at their latest level
+    assert classroom["learners"] == 2 and classroom["attempts"] == 4
+    assert classroom["skill_levels"] == {"Advanced": 2}
+    assert store.learner("nobody") is None and store.classroom("nobody") is None
+
+def test_failed_update_leaves_nothing_behind(store):
+    bad = result(1, "u2")
+    del bad["quiz_id"]
+    with pytest.raises(KeyError):
+        fold(store, [result(0, "u1"), bad], class_id="c1")
+    assert store.learner("u1") is None and store.classroom("c1") is None
+    assert store.history("u1") == ([], None)
+
+class FakeResults:
+    """supabase-style reads of quiz_results: table().select().order().range().execute().data"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return self
+
+    def select(self, *columns):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end
+        return self
+
+    def execute(self):
+        page = [dict(r, weak_topics=json.dumps(r["weak_topics"])) for r in self.rows[self.start:self.end + 1]]
+        return type("Response", (), {"data": page})()
+
+def test_backfill_rebuilds_from_stored_results(store):
+    stored = sorted((result(i, f"u{i % 4}", weak=["spelling"] if i % 2 else []) for i in range(45)),
+                    key=lambda r: (r["taken_at"], r["id"]))
+    # the server already folded some of them in, with their class
+    fold(store, stored[:10], class_id="c1")
+    assert backfill(store, FakeResults(stored), page_size=8, roster={"u3": "c9"}) == 45
+    assert sum(store.learner(f"u{i}")["attempts"] for i in range(4)) == 45
+    assert store.classroom("c1")["attempts"] == 10
+    assert store.classroom("c9")["attempts"] == sum(1 for r in stored[10:] if r["user_id"] == "u3")
+    items, _ = store.history("u1", limit=100)
+    assert len(items) == len({r["id"] for r in stored if r["user_id"] == "u1"})
+
+def test_backfill_skips_results_folded_in_meanwhile(store):
+    stored = [result(i, "u1") for i in range(6)]
+
+    class Racing(FakeResults):
+        # the running server folds r5 in right after the reset
+        def execute(self):
+            if self.start == 0 and store.learner("u1") is None:
+                fold(store, [stored[5]])
+            return super().execute()
+
+    assert backfill(store, Racing(stored), page_size=4) == 5
+    assert store.learner("u1")["attempts"] == 6
@@ -0,0 +1,251 @@
+# tests/test_result_writer.py
+import fcntl
+import glob
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+import threading
+
+from server.result_writer import ResultWriter
+
+class FakeClient:
+    """Stands in for the supabase Client: table(t).insert(rows) / upsert(...) then execute()."""
+
+    def __init__(self, down=False):
+        self.down = down
+        self.rows = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.rows = []
+        self.unique_on = None
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.rows, self.unique_on = rows, on_conflict
+        return self
+
+    def execute(self):
+        client = self.client
+        with client._lock:
+            client.calls += 1
+            if client.down is True or (client.down and client.calls <= client.down):
+                raise ConnectionError("backend unavailable")
+            rows = self.rows
+            if self.unique_on:
+                stored = {r[self.unique_on] for r in client.rows}
+                rows = [r for r in rows if r[self.unique_on] not in stored]
+            client.rows.extend(rows)
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def make_writer(client, tmp_path, **kwargs):
+    kwargs.setdefault("flush_interval", 0.01)
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("backoff_max", 0.01)
+    return ResultWriter(client, spill_path=str(tmp_path / "spill.jsonl"), **kwargs)
+
+def rows(n, start=0):
+    return [{"id": f"r{i}", "quiz_score": float(i)} for i in range(start, start + n)]
+
+def leftovers(tmp_path):
+    return sorted(glob.glob(str(tmp_path / "spill.jsonl")) + glob.glob(str(tmp_path / "spill.jsonl.replay*")))
+
+def test_batches_are_written_once(tmp_path):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, batch_size=4).start()
+    assert writer.submit(rows(10))
+    writer.stop()
+    assert [r["id"] for r in client.rows] == [f"r{i}" for i in range(10)]
+    assert writer.stats["written"] == 10
+    assert writer.stats["batches"] >= 3
+    assert leftovers(tmp_path) == []
+
+def test_failed_insert_is_retried(tmp_path):
+    # the first two attempts fail, the third goes through
+    client = FakeClient(down=2)
+    writer = make_writer(client, tmp_path, max_retries=3).start()
+    writer.submit(rows(3))
+    wait_for(lambda: len(client.rows) == 3)
+    writer.stop()
+    assert writer.stats["retries"] == 2
+    assert writer.stats["spilled"] == 0
+
+def test_spilled_rows_are_replayed_after_recovery(tmp_path):
+    client = FakeClient(down=True)
+    writer = make_writer(client, tmp_path, max_retries=1).start()
+    writer.submit(rows(5))
+    wait_for(lambda: writer.stats["spilled"] == 5)
+    assert len(open(tmp_path / "spill.jsonl").readlines()) == 5
+
+    client.down = False
+    # the next successful insert replays the spill file
+    writer.submit(rows(1, start=5))
+    wait_for(lambda: len(client.rows) == 6)
+    writer.stop()
+    assert sorted(r["id"] for r in client.rows) == [f"r{i}" for i in range(6)]
+    assert writer.stats["replayed"] == 5
+    assert leftovers(tmp_path) == []
+
+def test_replay_failure_keeps_unwritten_rows(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text("".join(json.dumps(r) + "\n" for r in rows(7)))
+    client = FakeClient(down=True)
+    writer = make_writer(client, tmp_path, batch_size=3, max_retries=0).start()
+    wait_for(lambda: writer.stats["failed"] >= 1)
+    writer.stop()
+    # nothing was written, so every row is back on disk exactly once
+    back = [json.loads(line)["id"] for path in leftovers(tmp_path) for line in open(path)]
+    assert sorted(back) == [f"r{i}" for i in range(7)]
+    assert client.rows == []
+
+def test_start_replays_leftovers_and_skips_truncated_lines(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    # a process died mid-append, and another one mid-replay (pre-pid file name)
+    spill.write_text(json.dumps(rows(1)[0]) + "\n" + '{"id": "r1", "quiz_sc')
+    (tmp_path / "spill.jsonl.replay").write_text("".join(json.dumps(r) + "\n" for r in rows(2, start=2)))
+    client = FakeClient()
+    writer = make_writer(client, tmp_path).start()
+    wait_for(lambda: len(client.rows) == 3)
+    writer.stop()
+    assert sorted(r["id"] for r in client.rows) == ["r0", "r2", "r3"]
+    assert writer.stats["corrupt"] == 1
+    assert writer.stats["errors"] == 0
+    assert leftovers(tmp_path) == []
+
+def test_writer_survives_an_error_while_flushing(tmp_path):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path).start()
+    # the insert fails and the row cannot be spilled either (not JSON-serializable)
+    client.down = True
+    writer.max_retries = 0
+    writer.submit([{"id": "bad", "value": object()}])
+    wait_for(lambda: writer.stats["errors"] == 1)
+    client.down = False
+    writer.submit(rows(2))
+    wait_for(lambda: len(client.rows) == 2)
+    writer.stop()
+    assert writer._thread is None
+
+def test_unique_column_makes_retries_idempotent(tmp_path):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, unique_on="submission_key").start()
+    writer.submit([{"id": "a", "submission_key": "k1"}, {"id": "b", "submission_key": "k2"}])
+    wait_for(lambda: len(client.rows) == 2)
+    # the same submission sent again (e.g. to another worker) is not stored twice
+    writer.submit([{"id": "c", "submission_key": "k1"}])
+    writer.stop()
+    assert sorted(r["submission_key"] for r in client.rows) == ["k1", "k2"]
+
+def test_full_queue_never_spills_on_the_caller(tmp_path):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, max_queue=2)
+    # not started yet: nothing drains the queue
+    assert writer.submit(rows(3)) is False
+    assert writer.submit(rows(4, start=3)) is False
+    assert not (tmp_path / "spill.jsonl").exists()
+    assert writer.stats["enqueued"] == 2
+    # two more wait for the writer thread, the rest is dropped
+    assert writer.stats["dropped"] == 3
+    assert writer.pending() == 4
+    writer.start()
+    wait_for(lambda: len(client.rows) == 4)
+    writer.stop()
+    assert sorted(r["id"] for r in client.rows) == ["r0", "r1", "r2", "r3"]
+    assert writer.stats["spilled"] == 2 and writer.stats["replayed"] == 2
+
+def test_counters_are_exact_under_concurrent_submits(tmp_path):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, max_queue=100000, batch_size=500).start()
+    threads = [threading.Thread(target=lambda t=t: [writer.submit(rows(1, start=t * 1000 + i)) for i in range(1000)])
+               for t in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.stop()
+    assert writer.stats["enqueued"] == 8000
+    assert writer.stats["written"] == len(client.rows) == 8000
+
+class FileRows:
+    """client.rows shared between processes: stored rows are appended to a jsonl file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def extend(self, rows):
+        with open(self.path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write("".join(json.dumps(r) + "\n" for r in rows))
+
+    def ids(self):
+        with open(self.path) as f:
+            return [json.loads(line)["id"] for line in f]
+
+def write_spill(path, batch):
+    with open(path, "w") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in batch))
+
+def run_writer(tmp_path, stored, start, barrier):
+    client = FakeClient()
+    client.rows = FileRows(stored)
+    writer = make_writer(client, tmp_path)
+    barrier.wait()
+    writer.start()
+    writer.submit(rows(5, start=start))
+    writer.stop()
+
+def test_two_processes_share_a_spill_path(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    stored = str(tmp_path / "stored.jsonl")
+    open(stored, "w").close()
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    live = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        write_spill(spill, rows(20))
+        # a worker that died mid-replay, and one that is still replaying
+        write_spill(f"{spill}.replay-{dead.pid}-1-0", rows(10, start=20))
+        live_file = f"{spill}.replay-{live.pid}-1-0"
+        write_spill(live_file, rows(5, start=30))
+
+        ctx = multiprocessing.get_context("fork")
+        barrier = ctx.Barrier(2)
+        workers = [ctx.Process(target=run_writer, args=(tmp_path, stored, start, barrier)) for start in (100, 200)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join(30)
+            assert w.exitcode == 0
+        ids = FileRows(stored).ids()
+        expected = [f"r{i}" for i in list(range(30)) + list(range(100, 105)) + list(range(200, 205))]
+        assert sorted(ids) == sorted(expected)
+        # the live worker's replay file is left to it
+        assert leftovers(tmp_path) == [live_file]
+    finally:
+        live.kill()
+        live.wait()
+
+    # once it is gone, the next writer to start takes its file over
+    client = FakeClient()
+    client.rows = FileRows(stored)
+    make_writer(client, tmp_path).start().stop()
+    ids = FileRows(stored).ids()
+    assert len(ids) == len(set(ids)) == 45
+    assert leftovers(tmp_path) == []
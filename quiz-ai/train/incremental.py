@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Incremental retraining: update the active models with only the attempts added since
+they were trained, instead of retraining on the whole history.
+
+  python train/incremental.py                    # continue boosting on the delta
+  python train/incremental.py --mode refit       # refit the existing trees' leaf values
+  python train/incremental.py --since 2025-11-01 # base bundle has no watermark
+  python train/incremental.py --full             # full retrain (train_models.py)
+
+Every bundle published by train_models.py records a watermark in its manifest: the
+latest attempt_date it saw (or the row count, for a feature CSV without dates). The
+delta is what lies beyond the active bundle's watermark, read from FEATURE_STORE_DIR
+with a partition filter, or from DATA_CSV. Attempts can still arrive for the
+watermark day after a run, so when the data carries attempt ids the watermark also
+lists the ids trained on that day: the day is read again and only those are skipped.
+The ids are kept in a file of their own in the bundle (not in the manifest the
+server loads); the manifest only names it.
+
+The delta is split into train and holdout rows (by user, unless --split random).
+In "boost" mode every booster continues from its current trees with up to --rounds
+new ones, early-stopped on a further --stop-fraction of the train rows (split the
+same way). In "refit" mode the tree structure is kept and leaf values are blended
+with ones fitted on the train rows (--decay weights the old values). Both the base
+and the candidate bundle are then scored on the holdout, which no update has seen. The
+candidate is published to the registry, with the new watermark, only when no
+target's holdout loss is worse than the base's by more than --tolerance (relative).
+Otherwise nothing is published and the script exits with status 1.
+
+The models keep the base bundle's feature layout. Topics that first appear in the
+delta are ignored until the next full retrain.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+from sklearn.metrics import log_loss, mean_absolute_error
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import feature_store
+import train_models
+from shared_dataset import DATASET_PARAMS
+from server.model_registry import current_version, load_registry_bundle, publish_bundle
+from train_models import (build_tasks, data_watermark, load_watermark, publish_watermark, split_frame,
+                          target_cls, target_conf, target_reg)
+
+MODEL_REGISTRY_DIR = train_models.MODEL_REGISTRY_DIR
+
+def load_delta(watermark, feature_cols, weak_cols):
+    """Rows beyond the watermark, with the base bundle's feature and label columns."""
+    labels = [target_reg, target_conf, target_cls] + weak_cols
+    if train_models.FEATURE_STORE_DIR:
+        if "attempt_date" not in watermark:
+            raise ValueError("the feature store needs an attempt_date watermark (use --since)")
+        available = set(feature_store.read_schema(train_models.FEATURE_STORE_DIR)["dtypes"])
+        columns = ["user_id", "attempt_date", "attempt_id"] + feature_cols + labels
+        columns = [c for c in columns if c in available or c == "attempt_date"]
+        if "attempt_ids" in watermark:
+            df = feature_store.read_features(train_models.FEATURE_STORE_DIR, columns=columns,
+                                             start=watermark["attempt_date"])
+        else:
+            df = feature_store.read_features(train_models.FEATURE_STORE_DIR, columns=columns,
+                                             since=watermark["attempt_date"])
+    elif "rows" in watermark:
+        # the ETL appends to the CSV, so everything after the first `rows` rows is new
+        df = pd.read_csv(train_models.DATA_CSV, skiprows=range(1, watermark["rows"] + 1))
+    else:
+        df = pd.read_csv(train_models.DATA_CSV)
+        if "attempt_date" not in df.columns:
+            raise ValueError(f"{train_models.DATA_CSV} has no attempt_date column for the watermark")
+        dates = df["attempt_date"].astype(str)
+        df = df[dates >= watermark["attempt_date"] if "attempt_ids" in watermark else dates > watermark["attempt_date"]]
+    if "attempt_ids" in watermark:
+        if "attempt_id" not in df.columns:
+            raise ValueError("the watermark lists attempt ids but the data has no attempt_id column")
+        # the watermark day again, without the attempts the base bundle was trained on
+        seen = (df["attempt_date"].astype(str) == watermark["attempt_date"]) & df["attempt_id"].isin(watermark["attempt_ids"])
+        df = df[~seen]
+    ids = [c for c in ("attempt_date", "attempt_id") if c in df.columns]
+    df = df.reindex(columns=["user_id"] + ids + feature_cols + labels).reset_index(drop=True)
+    # a topic no delta attempt touched is not weak (the ETL's definition)
+    df[weak_cols] = df[weak_cols].fillna(0).astype(np.int64)
+    return df
+
+def advance_watermark(watermark, delta):
+    if "rows" in watermark:
+        return {"rows": watermark["rows"] + len(delta)}
+    mark = data_watermark(delta)
+    if mark.get("attempt_date") == watermark["attempt_date"] and "attempt_ids" in watermark:
+        # still the same day: it now holds the base's attempts and the delta's
+        mark["attempt_ids"] = sorted(set(watermark["attempt_ids"]) | set(mark.get("attempt_ids", [])))
+    return mark
+
+def describe_watermark(watermark):
+    if "attempt_ids" not in watermark:
+        return json.dumps(watermark)
+    return f"{watermark['attempt_date']} (+{len(watermark['attempt_ids'])} attempts of that day)"
+
+def holdout_loss(name, booster, X, y):
+    """Holdout loss of one model: MAE for regressors, log loss for classifiers."""
+    pred = booster.predict(X)
+    if name in ("quiz_score", "confidence"):
+        return float(mean_absolute_error(y, pred))
+    if pred.ndim == 2:
+        return float(log_loss(y, pred, labels=list(range(pred.shape[1]))))
+    return float(log_loss(y, np.clip(pred, 1e-7, 1 - 1e-7), labels=[0, 1]))
+
+def update_booster(booster, task, X_train, X_stop, y_stop, mode, rounds, stopping, decay):
+    if mode == "refit":
+        return booster.refit(X_train, task["y_train"], decay_rate=decay)
+    # continued boosting needs the raw rows to compute the starting scores
+    train_ds = lgb.Dataset(X_train, label=task["y_train"], params=DATASET_PARAMS, free_raw_data=False)
+    valid_ds = lgb.Dataset(X_stop, label=y_stop, reference=train_ds, params=DATASET_PARAMS,
+                           free_raw_data=False)
+    updated = lgb.train(
+        task["params"],
+        train_ds,
+        num_boost_round=rounds,
+        init_model=booster,
+        valid_sets=[valid_ds],
+        callbacks=[lgb.early_stopping(stopping_rounds=stopping, verbose=False)],
+    )
+    # drop the trees added after the best early-stopping iteration
+    return lgb.Booster(model_str=updated.model_to_string(num_iteration=updated.best_iteration))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["boost", "refit"], default="boost")
+    parser.add_argument("--full", action="store_true", help="run a full retrain instead")
+    parser.add_argument("--base", help="registry version to start from (default: the active one)")
+    parser.add_argument("--since", help="attempt_date watermark to use when the base bundle has none")
+    parser.add_argument("--rounds", type=int, default=100, help="max new trees per model (boost mode)")
+    parser.add_argument("--early-stopping", type=int, default=10)
+    parser.add_argument("--decay", type=float, default=0.9, help="weight of the old leaf values (refit mode)")
+    parser.add_argument("--split", choices=["random", "user"], default="user", help="how the delta is split")
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of the delta held out for the gate")
+    parser.add_argument("--stop-fraction", type=float, default=0.2,
+                        help="fraction of the train rows used for early stopping (boost mode)")
+    parser.add_argument("--min-rows", type=int, default=50, help="skip the update below this many new rows")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="largest allowed relative holdout loss increase per target")
+    parser.add_argument("--no-activate", action="store_true", help="publish without switching the server to it")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.full:
+        train_models.main()
+        return 0
+
+    version = args.base or current_version(MODEL_REGISTRY_DIR)
+    if version is None:
+        print(f"No model version in {MODEL_REGISTRY_DIR}; run train/train_models.py for a full training first.")
+        return 1
+    base = load_registry_bundle(version, MODEL_REGISTRY_DIR, use_fused=False)
+    watermark = load_watermark(base.manifest, version, MODEL_REGISTRY_DIR) or (
+        {"attempt_date": args.since} if args.since else None)
+    if watermark is None:
+        print(f"Version {version} records no watermark; pass --since or run a full retrain.")
+        return 1
+    feature_cols, weak_cols = base.feature_cols, base.weak_cols
+
+    start = time.perf_counter()
+    delta = load_delta(watermark, feature_cols, weak_cols)
+    print(f"Base version {version}, watermark {describe_watermark(watermark)}: {len(delta)} new rows")
+    if len(delta) < args.min_rows:
+        print(f"Fewer than {args.min_rows} new rows, nothing to do.")
+        return 0
+
+    train_df, holdout_df = split_frame(delta, args.split, args.holdout, args.seed)
+    stop_df = None
+    if args.mode == "boost":
+        # early stopping picks the trees on its own rows, so the gate below is unbiased
+        train_df, stop_df = split_frame(train_df, args.split, args.stop_fraction, args.seed)
+    X_train = train_df[feature_cols].to_numpy(dtype=np.float64)
+    X_holdout = holdout_df[feature_cols].to_numpy(dtype=np.float64)
+    num_class = base.boosters["skill_level"].num_model_per_iteration()
+    tasks = {t["name"]: t for t in build_tasks(train_df, holdout_df, weak_cols, num_class=num_class)}
+    X_stop, stop_labels = None, {}
+    if stop_df is not None:
+        X_stop = stop_df[feature_cols].to_numpy(dtype=np.float64)
+        stop_labels = {t["name"]: t["y_valid"] for t in build_tasks(train_df, stop_df, weak_cols, num_class=num_class)}
+
+    candidate, report, ok = {}, {}, True
+    for name, booster in base.boosters.items():
+        task = tasks.get(name)
+        if task is None:
+            # a model without a training target in this tree: carry it over unchanged
+            candidate[name] = booster
+            continue
+        t0 = time.perf_counter()
+        candidate[name] = update_booster(booster, task, X_train, X_stop, stop_labels.get(name), args.mode,
+                                         args.rounds, args.early_stopping, args.decay)
+        before = holdout_loss(name, booster, X_holdout, task["y_valid"])
+        after = holdout_loss(name, candidate[name], X_holdout, task["y_valid"])
+        # the absolute slack keeps near-zero losses from failing on rounding noise
+        passed = after <= before * (1 + args.tolerance) + 1e-6
+        ok &= passed
+        report[name] = {"base": before, "candidate": after, "trees_added": candidate[name].num_trees() - booster.num_trees(),
+                        "seconds": time.perf_counter() - t0, "passed": passed}
+        print(f"  {name}: holdout loss {before:.4f} -> {after:.4f}, "
+              f"{report[name]['trees_added']:+d} trees ({report[name]['seconds']:.1f}s){'' if passed else '  REGRESSED'}")
+
+    if not ok:
+        print(f"Holdout loss regressed by more than {args.tolerance:.0%}; keeping version {version}.")
+        return 1
+    new_watermark = advance_watermark(watermark, delta)
+    recorded, files = publish_watermark(new_watermark)
+    extra = {
+        "watermark": recorded,
+        "parent_version": version,
+        # drift is still measured against the full training run's data
+        "drift_baseline": base.manifest.get("drift_baseline"),
+        "training": {"mode": args.mode, "rows": len(delta), "holdout_rows": len(holdout_df),
+                     "early_stopping_rows": 0 if stop_df is None else len(stop_df),
+                     "split": args.split, "holdout": report},
+    }
+    new_version = publish_bundle(candidate, feature_cols, weak_cols, registry_dir=MODEL_REGISTRY_DIR,
+                                 activate_now=not args.no_activate, extra=extra, data_files=files)
+    print(f"Published {new_version} ({args.mode} on {len(delta)} rows, {time.perf_counter() - start:.1f}s)"
+          f"{'' if args.no_activate else ' and activated it'}; watermark {describe_watermark(new_watermark)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
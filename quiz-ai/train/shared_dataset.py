@@ -0,0 +1,83 @@
+"""
+Bin the training features once and reuse the binned data for every target.
+
+save_binned() constructs the LightGBM Dataset for the train/valid feature matrices
+(finding bin boundaries and binning every value) and writes it in LightGBM's binary
+format. Each target then loads those files with its own label, which skips binning
+entirely, so the cost no longer grows with the number of targets.
+
+train_target() is the worker entry point used by train_all() to fit targets in
+parallel processes. Workers use the "spawn" start method because LightGBM's OpenMP
+thread pool is not fork-safe once the parent has used it.
+"""
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import lightgbm as lgb
+
+# bin construction is label-independent; feature_pre_filter is off so the same
+# binned files stay valid for any min_data_in_leaf a target (or a sweep) uses
+DATASET_PARAMS = {"max_bin": 255, "feature_pre_filter": False, "verbosity": -1}
+
+def save_binned(train_X, valid_X, cache_dir, feature_names=None, params=DATASET_PARAMS):
+    """Bin train/valid once and save them; returns (train_path, valid_path)."""
+    os.makedirs(cache_dir, exist_ok=True)
+    train_path = os.path.join(cache_dir, "train.bin")
+    valid_path = os.path.join(cache_dir, "valid.bin")
+    for path in (train_path, valid_path):
+        # LightGBM will not overwrite an existing binary file
+        if os.path.exists(path):
+            os.remove(path)
+    names = list(feature_names) if feature_names is not None else "auto"
+    train_ds = lgb.Dataset(train_X, feature_name=names, params=params, free_raw_data=True).construct()
+    train_ds.save_binary(train_path)
+    valid_ds = lgb.Dataset(valid_X, feature_name=names, reference=train_ds, params=params).construct()
+    valid_ds.save_binary(valid_path)
+    return train_path, valid_path
+
+def load_binned(train_path, valid_path, y_train, y_valid, params=DATASET_PARAMS):
+    train_ds = lgb.Dataset(train_path, label=y_train, params=params)
+    valid_ds = lgb.Dataset(valid_path, label=y_valid, reference=train_ds, params=params)
+    return train_ds, valid_ds
+
+def train_target(task):
+    """
+    Fit one target on the shared binned data.
+    task: dict(name, params, y_train, y_valid, num_boost_round, stopping_rounds,
+               train_path, valid_path, num_threads)
+    Returns (name, model_string, best_iteration, best_score, seconds).
+    """
+    start = time.perf_counter()
+    train_ds, valid_ds = load_binned(task["train_path"], task["valid_path"], task["y_train"], task["y_valid"])
+    params = dict(task["params"], num_threads=task["num_threads"])
+    booster = lgb.train(
+        params,
+        train_ds,
+        num_boost_round=task["num_boost_round"],
+        valid_sets=[valid_ds],
+        callbacks=[lgb.early_stopping(stopping_rounds=task["stopping_rounds"], verbose=False)],
+    )
+    best_score = {k: {m: float(x) for m, x in v.items()} for k, v in booster.best_score.items()}
+    return task["name"], booster.model_to_string(), booster.best_iteration, best_score, time.perf_counter() - start
+
+def train_all(tasks, workers=1, thread_budget=None):
+    """
+    Train every task, `workers` at a time, splitting `thread_budget` LightGBM threads
+    between them. Returns {name: (Booster, best_iteration, best_score, seconds)} in
+    task order.
+    """
+    thread_budget = thread_budget or os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    threads = max(1, thread_budget // workers)
+    tasks = [dict(t, num_threads=threads) for t in tasks]
+    if workers == 1:
+        results = [train_target(t) for t in tasks]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            results = list(pool.map(train_target, tasks))
+    return {
+        name: (lgb.Booster(model_str=model_str), best_iter, best_score, seconds)
+        for name, model_str, best_iter, best_score, seconds in results
+    }
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter sweep for the training targets.
+
+  python train/sweep.py --trials 40 --workers 4
+  python train/sweep.py --targets quiz_score,skill_level --split user --trial-seconds 60
+  python train/sweep.py --grid --space space.json
+
+The training frame is split, binned and saved in LightGBM's binary format once per
+(data source, split) under SWEEP_CACHE_DIR, together with the labels and a sample of
+validation rows; later sweeps over the same data skip the CSV parse and the binning.
+Trials run in parallel spawn processes (--workers, sharing --threads LightGBM
+threads) with early stopping and an optional wall-clock budget: a trial that runs out
+of time keeps its best iteration so far and is marked timed_out.
+
+Each trial is appended to a JSON-lines file as soon as it finishes, with its
+parameters, validation metric and best iteration, plus what the model costs to serve:
+trees, leaves, single-row latency (Booster.predict and the fused engine the server
+uses) and per-row latency on a 1024-row batch, all on one thread. The summary marks
+the trials on each target's accuracy / latency Pareto front.
+
+A search space file maps parameter names to a list of values or to
+{"low": .., "high": .., "log": true|false} (random search only). Bin parameters
+(max_bin) are fixed by shared_dataset.DATASET_PARAMS, because every trial shares
+the same binned files.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import datetime
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from shared_dataset import DATASET_PARAMS, save_binned, load_binned
+import train_models
+from train_models import build_tasks, load_training_frame, split_frame, target_cls
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SWEEP_DIR = os.environ.get("SWEEP_DIR", os.path.join(BASE_DIR, "sweeps"))
+# binned datasets, labels and the latency sample, one subdirectory per data source + split
+SWEEP_CACHE_DIR = os.environ.get("SWEEP_CACHE_DIR", os.path.join(SWEEP_DIR, "cache"))
+# rows used to measure predict latency
+LATENCY_ROWS = 1024
+
+DEFAULT_SPACE = {
+    "learning_rate": [0.02, 0.05, 0.1],
+    "num_leaves": [7, 15, 31, 63],
+    "min_data_in_leaf": [10, 20, 50],
+    "feature_fraction": [0.7, 0.9, 1.0],
+    "lambda_l2": [0.0, 1.0, 10.0],
+    "max_depth": [-1, 6],
+}
+
+def _source_fingerprint():
+    """Identifies the training data: path plus size and mtime of every file in it."""
+    source = os.path.abspath(train_models.FEATURE_STORE_DIR or train_models.DATA_CSV)
+    paths = [source]
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(d, f) for d, _, files in os.walk(source) for f in files)
+    h = hashlib.sha256(source.encode())
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+def prepare_data(split, test_size, seed, cache_root=SWEEP_CACHE_DIR, rebuild=False):
+    """
+    Bin the training data once (or reuse an earlier sweep's files). Returns the cache
+    directory holding train.bin, valid.bin, labels.npz, latency.npy and meta.json.
+    """
+    key = hashlib.sha256(json.dumps(
+        [_source_fingerprint(), split, test_size, seed, DATASET_PARAMS], sort_keys=True).encode()).hexdigest()[:16]
+    cache_dir = os.path.join(cache_root, key)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path) and not rebuild:
+        print(f"Using binned data in {cache_dir}")
+        return cache_dir
+
+    start = time.perf_counter()
+    df, feature_cols, weak_cols = load_training_frame()
+    train_df, valid_df = split_frame(df, split, test_size, seed)
+    save_binned(train_df[feature_cols], valid_df[feature_cols], cache_dir, feature_cols)
+    label_cols = [train_models.target_reg, train_models.target_conf, target_cls] + weak_cols
+    np.savez(os.path.join(cache_dir, "labels.npz"),
+             **{f"train/{c}": train_df[c].to_numpy() for c in label_cols},
+             **{f"valid/{c}": valid_df[c].to_numpy() for c in label_cols})
+    sample = valid_df[feature_cols].head(LATENCY_ROWS).to_numpy(dtype=np.float64)
+    np.save(os.path.join(cache_dir, "latency.npy"), sample)
+    meta = {
+        "feature_cols": feature_cols,
+        "weak_cols": weak_cols,
+        "label_cols": label_cols,
+        "num_class": int(df[target_cls].nunique()),
+        "split": split,
+        "test_size": test_size,
+        "seed": seed,
+        "train_rows": len(train_df),
+        "valid_rows": len(valid_df),
+    }
+    # written last: a cache directory without meta.json is incomplete and gets rebuilt
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Binned {len(train_df)} train / {len(valid_df)} valid rows into {cache_dir} "
+          f"({time.perf_counter() - start:.1f}s)")
+    return cache_dir
+
+def load_tasks(cache_dir):
+    """The training tasks of train_models.build_tasks(), with labels from the cache."""
+    with open(os.path.join(cache_dir, "meta.json")) as f:
+        meta = json.load(f)
+    labels = np.load(os.path.join(cache_dir, "labels.npz"))
+    train_df = pd.DataFrame({c: labels[f"train/{c}"] for c in meta["label_cols"]})
+    valid_df = pd.DataFrame({c: labels[f"valid/{c}"] for c in meta["label_cols"]})
+    tasks = build_tasks(train_df, valid_df, meta["weak_cols"], num_class=meta["num_class"])
+    for t in tasks:
+        t["train_path"] = os.path.join(cache_dir, "train.bin")
+        t["valid_path"] = os.path.join(cache_dir, "valid.bin")
+        t["latency_path"] = os.path.join(cache_dir, "latency.npy")
+    return tasks
+
+def sample_trials(space, n_trials, seed, grid=False):
+    """Parameter sets to try: the full grid (list values only) or n_trials random draws."""
+    if grid:
+        names = list(space)
+        for name in names:
+            if not isinstance(space[name], list):
+                raise ValueError(f"--grid needs a list of values for {name}")
+        return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(n_trials):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                params[name] = values[rng.integers(len(values))]
+            elif values.get("log"):
+                params[name] = float(np.exp(rng.uniform(np.log(values["low"]), np.log(values["high"]))))
+            else:
+                params[name] = float(rng.uniform(values["low"], values["high"]))
+            if isinstance(params[name], np.generic):
+                params[name] = params[name].item()
+        trials.append(params)
+    return trials
+
+def time_budget(seconds, state):
+    """
+    Callback that stops training after `seconds` of wall time (None = never), keeping
+    the best iteration seen so far on the first validation metric. Sets
+    state["timed_out"] and state["higher_is_better"] for that metric.
+    """
+    start = time.perf_counter()
+    best = {"score": None, "iteration": 0, "results": []}
+
+    def _callback(env):
+        if not env.evaluation_result_list:
+            return
+        _, _, score, higher_is_better = env.evaluation_result_list[0][:4]
+        state["higher_is_better"] = bool(higher_is_better)
+        if best["score"] is None or (score > best["score"] if higher_is_better else score < best["score"]):
+            best.update(score=score, iteration=env.iteration, results=list(env.evaluation_result_list))
+        if seconds and time.perf_counter() - start > seconds:
+            state["timed_out"] = True
+            raise lgb.callback.EarlyStopException(best["iteration"], best["results"])
+    # run after early stopping has had its say on this iteration
+    _callback.order = 40
+    return _callback
+
+def _median_seconds(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+def serving_cost(booster, X):
+    """Size and single-thread predict latency of a trained booster."""
+    from server.inference_engine import FusedEngine
+    dump = booster.dump_model()
+    cost = {
+        "num_trees": len(dump["tree_info"]),
+        "num_leaves": int(sum(t["num_leaves"] for t in dump["tree_info"])),
+    }
+    row = X[:1]
+    booster.predict(row, num_threads=1)
+    cost["predict_us_row"] = _median_seconds(lambda: booster.predict(row, num_threads=1), 200) * 1e6
+    cost["predict_us_per_row_batch"] = _median_seconds(lambda: booster.predict(X, num_threads=1), 5) * 1e6 / len(X)
+    try:
+        engine = FusedEngine({"model": booster})
+    except NotImplementedError:
+        cost["fused_us_row"] = None
+    else:
+        engine.predict(row)
+        cost["fused_us_row"] = _median_seconds(lambda: engine.predict(row), 200) * 1e6
+    return cost
+
+def run_trial(task):
+    """
+    Train one (target, parameter set) trial on the cached binned data and measure it.
+    task: a load_tasks() task plus trial, trial_params, num_threads, trial_seconds.
+    """
+    start = time.perf_counter()
+    train_ds, valid_ds = load_binned(task["train_path"], task["valid_path"], task["y_train"], task["y_valid"])
+    params = dict(task["params"], **task["trial_params"], num_threads=task["num_threads"])
+    state = {"timed_out": False, "higher_is_better": False}
+    callbacks = [lgb.early_stopping(stopping_rounds=task["stopping_rounds"], verbose=False),
+                 time_budget(task["trial_seconds"], state)]
+    booster = lgb.train(params, train_ds, num_boost_round=task["num_boost_round"],
+                        valid_sets=[valid_ds], callbacks=callbacks)
+    train_seconds = time.perf_counter() - start
+    metric, score = next(iter(booster.best_score["valid_0"].items()))
+    # serve only the trees up to the best iteration
+    best = lgb.Booster(model_str=booster.model_to_string(num_iteration=booster.best_iteration))
+    result = {
+        "trial": task["trial"],
+        "target": task["name"],
+        "params": task["trial_params"],
+        "metric": metric,
+        "score": float(score),
+        "higher_is_better": state["higher_is_better"],
+        "best_iteration": booster.best_iteration,
+        "timed_out": state["timed_out"],
+        "train_seconds": train_seconds,
+    }
+    result.update(serving_cost(best, np.load(task["latency_path"])))
+    return result
+
+def pareto_front(results, latency_key="fused_us_row"):
+    """Trials (of one target) that no other trial beats on both score and latency."""
+    def latency(r):
+        return r[latency_key] if r.get(latency_key) is not None else r["predict_us_row"]
+
+    def loss(r):
+        return -r["score"] if r["higher_is_better"] else r["score"]
+
+    def dominates(a, b):
+        return (loss(a) <= loss(b) and latency(a) <= latency(b)
+                and (loss(a) < loss(b) or latency(a) < latency(b)))
+
+    return [r for r in results if not any(dominates(o, r) for o in results if o is not r)]
+
+def print_summary(results, top):
+    for target in dict.fromkeys(r["target"] for r in results):
+        rows = [r for r in results if r["target"] == target]
+        rows.sort(key=lambda r: -r["score"] if r["higher_is_better"] else r["score"])
+        front = {id(r) for r in pareto_front(rows)}
+        print(f"\n{target} ({rows[0]['metric']}), {len(rows)} trials; * = accuracy/latency Pareto front")
+        print(f"  {'':1} {'trial':>5} {'score':>10} {'iters':>6} {'trees':>6} {'leaves':>7} "
+              f"{'row us':>8} {'fused us':>9} {'batch us/row':>12}  params")
+        shown = [r for i, r in enumerate(rows) if i < top or id(r) in front]
+        for r in shown:
+            fused = f"{r['fused_us_row']:9.1f}" if r["fused_us_row"] is not None else f"{'-':>9}"
+            print(f"  {'*' if id(r) in front else '':1} {r['trial']:>5} {r['score']:>10.4f} {r['best_iteration']:>6} "
+                  f"{r['num_trees']:>6} {r['num_leaves']:>7} {r['predict_us_row']:>8.1f} {fused} "
+                  f"{r['predict_us_per_row_batch']:>12.2f}  {json.dumps(r['params'])}"
+                  + ("  (timed out)" if r["timed_out"] else ""))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default="quiz_score",
+                        help="comma-separated targets (quiz_score, skill_level, confidence, weak_topic__*) or 'all'")
+    parser.add_argument("--trials", type=int, default=20, help="random parameter sets per target")
+    parser.add_argument("--grid", action="store_true", help="try every combination in the space instead")
+    parser.add_argument("--space", help="JSON file with the search space (default: a small built-in space)")
+    parser.add_argument("--split", choices=["random", "user"], default=train_models.TRAIN_SPLIT)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SWEEP_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("SWEEP_THREADS", os.cpu_count() or 1)),
+                        help="LightGBM threads shared by all workers")
+    parser.add_argument("--rounds", type=int, help="max boosting rounds (default: train_models' per target)")
+    parser.add_argument("--early-stopping", type=int, help="early stopping rounds (default: train_models' per target)")
+    parser.add_argument("--trial-seconds", type=float, default=0, help="wall-clock budget per trial (0 = none)")
+    parser.add_argument("--rebuild", action="store_true", help="re-bin the data even if it is cached")
+    parser.add_argument("--out", help="JSON-lines results file (default: sweeps/sweep-<time>.jsonl)")
+    parser.add_argument("--top", type=int, default=10, help="trials to show per target (plus the Pareto front)")
+    args = parser.parse_args(argv)
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    trials = sample_trials(space, args.trials, args.seed, grid=args.grid)
+
+    cache_dir = prepare_data(args.split, args.test_size, args.seed, rebuild=args.rebuild)
+    tasks = load_tasks(cache_dir)
+    if args.targets != "all":
+        wanted = args.targets.split(",")
+        unknown = sorted(set(wanted) - {t["name"] for t in tasks})
+        if unknown:
+            parser.error(f"unknown targets: {', '.join(unknown)}")
+        tasks = [t for t in tasks if t["name"] in wanted]
+
+    workers = max(1, min(args.workers, len(trials) * len(tasks)))
+    threads = max(1, args.threads // workers)
+    jobs = []
+    for task in tasks:
+        for i, params in enumerate(trials):
+            job = dict(task, trial=i, trial_params=params, num_threads=threads, trial_seconds=args.trial_seconds)
+            if args.rounds:
+                job["num_boost_round"] = args.rounds
+            if args.early_stopping:
+                job["stopping_rounds"] = args.early_stopping
+            jobs.append(job)
+
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    out = args.out or os.path.join(SWEEP_DIR, f"sweep-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.jsonl")
+    print(f"Running {len(jobs)} trials ({len(tasks)} targets x {len(trials)} parameter sets) "
+          f"with {workers} workers, {threads} threads each")
+    results = []
+    start = time.perf_counter()
+    with open(out, "a") as f:
+        def done(result):
+            results.append(result)
+            f.write(json.dumps(dict(result, cache=os.path.basename(cache_dir), split=args.split)) + "\n")
+            f.flush()
+            print(f"  [{len(results)}/{len(jobs)}] {result['target']} trial {result['trial']}: "
+                  f"{result['metric']}={result['score']:.4f} trees={result['num_trees']} "
+                  f"({result['train_seconds']:.1f}s{', timed out' if result['timed_out'] else ''})")
+        if workers == 1:
+            for job in jobs:
+                done(run_trial(job))
+        else:
+            # spawn: LightGBM's OpenMP runtime is not fork-safe
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                for future in as_completed([pool.submit(run_trial, job) for job in jobs]):
+                    done(future.result())
+    print(f"Finished in {time.perf_counter() - start:.1f}s; results in {out}")
+    print_summary(results, args.top)
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,40 @@
 #!/usr/bin/env python3
 import os
+import sys
+import shutil
+import tempfile
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-import lightgbm as lgb
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import feature_store
+from server.drift import build_baseline, decode_outputs
+from server.model_registry import publish_bundle, read_bundle_file
+from shared_dataset import save_binned, train_all
 
 DATA_CSV = os.environ.get("FEATURE_CSV", os.path.join(os.path.dirname(__file__), "../prepared_quiz_features.csv"))
 MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(os.path.dirname(__file__), "../models"))
-os.makedirs(MODEL_DIR, exist_ok=True)
+# when set, read typed columns from the Parquet feature store instead of DATA_CSV
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR")
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(MODEL_DIR, "registry"))
+# parallel training: number of worker processes and total LightGBM threads shared by them
+TRAIN_WORKERS = int(os.environ.get("TRAIN_WORKERS", os.cpu_count() or 1))
+TRAIN_THREADS = int(os.environ.get("TRAIN_THREADS", os.cpu_count() or 1))
+# where the binned train/valid datasets are written (a temp dir by default)
+TRAIN_CACHE_DIR = os.environ.get("TRAIN_CACHE_DIR")
+# "random" splits attempts, "user" keeps all of a user's attempts on one side of the split
+TRAIN_SPLIT = os.environ.get("TRAIN_SPLIT", "random")
+# equal-frequency bins per column in the drift baseline (see server/drift.py)
+DRIFT_BINS = int(os.environ.get("DRIFT_BINS", 20))
 
-df = pd.read_csv(DATA_CSV)
 # identify columns
 ignore_cols = ["user_id", "quiz_id", "weak_topics_list"]
 target_reg = "quiz_score"
 target_conf = "confidence_score"
 target_cls = "skill_level_label"
 
-# weak topic columns follow pattern weak_topic__*
-weak_cols = [c for c in df.columns if c.startswith("weak_topic__")]
-# feature columns are numeric columns excluding targets + weak_cols
-excluded = set([target_reg, target_conf, target_cls] + weak_cols + ignore_cols)
-feature_cols = [c for c in df.columns if c not in excluded and df[c].dtype in [np.float64, np.float32, np.int64, np.int32]]
-
-print("Feature cols:", feature_cols[:30])
-print("Weak topic cols:", weak_cols)
-
-# split (by user ideally) - here simple random split
-train_df, valid_df = train_test_split(df, test_size=0.2, random_state=42)
-
-# ------- regression model for quiz_score
-train_data = lgb.Dataset(train_df[feature_cols], label=train_df[target_reg])
-valid_data = lgb.Dataset(valid_df[feature_cols], label=valid_df[target_reg])
-
 params_reg = {
     "objective": "regression",
     "metric": "mae",
@@ -42,79 +44,165 @@ params_reg = {
     "seed": 42
 }
 
-reg_model = lgb.train(
-    params_reg,
-    train_data,
-    num_boost_round=1000,
-    valid_sets=[valid_data],
-    callbacks=[lgb.early_stopping(stopping_rounds=50)]
-)
-
-joblib.dump(reg_model, os.path.join(MODEL_DIR, "lgb_reg_quiz_score.pkl"))
-print("Saved reg model.")
-
-# ------- classifier for skill level
 params_cls = {
     "objective": "multiclass",
-    "num_class": len(df[target_cls].unique()),
     "metric": "multi_logloss",
     "learning_rate": 0.05,
     "num_leaves": 31,
     "verbosity": -1,
     "seed": 42
 }
-train_c = lgb.Dataset(train_df[feature_cols], label=train_df[target_cls])
-valid_c = lgb.Dataset(valid_df[feature_cols], label=valid_df[target_cls])
-cls_model = lgb.train(
-    params_cls,
-    train_c,
-    num_boost_round=1000,
-    valid_sets=[valid_c],
-    callbacks=[lgb.early_stopping(stopping_rounds=50)]
-)
-
-joblib.dump(cls_model, os.path.join(MODEL_DIR, "lgb_cls_skill_level.pkl"))
-print("Saved class model.")
-
-# ------- weak topic binary models (one per topic)
-weak_models = {}
-for col in weak_cols:
-    print("Training weak model for", col)
-    tr = lgb.Dataset(train_df[feature_cols], label=train_df[col])
-    va = lgb.Dataset(valid_df[feature_cols], label=valid_df[col])
-    p = {
-        "objective": "binary",
-        "metric": "binary_logloss",
-        "learning_rate": 0.05,
-        "num_leaves": 31,
-        "verbosity": -1,
-        "seed": 42
-    }
-m = lgb.train(
-    p,
-    tr,
-    num_boost_round=500,
-    valid_sets=[va],
-    callbacks=[lgb.early_stopping(stopping_rounds=20)]
-)
-
-joblib.dump(m, os.path.join(MODEL_DIR, f"lgb_weak_{col}.pkl"))
-weak_models[col] = os.path.join(MODEL_DIR, f"lgb_weak_{col}.pkl")
-
-# ------- confidence model (regression)
-train_conf = lgb.Dataset(train_df[feature_cols], label=train_df[target_conf])
-valid_conf = lgb.Dataset(valid_df[feature_cols], label=valid_df[target_conf])
-conf_model = lgb.train(
-    params_reg, train_conf,
-    num_boost_round=500,
-    valid_sets=[valid_conf],
-    callbacks=[lgb.early_stopping(stopping_rounds=30)]
-)
-
-joblib.dump(conf_model, os.path.join(MODEL_DIR, "lgb_reg_confidence.pkl"))
-print("Saved confidence model.")
-
-# Save metadata (feature_cols, weak_cols)
-meta = {"feature_cols": feature_cols, "weak_cols": weak_cols}
-joblib.dump(meta, os.path.join(MODEL_DIR, "meta.pkl"))
-print("Saved metadata.")
+
+params_weak = {
+    "objective": "binary",
+    "metric": "binary_logloss",
+    "learning_rate": 0.05,
+    "num_leaves": 31,
+    "verbosity": -1,
+    "seed": 42
+}
+
+def load_training_frame():
+    """Returns (df, feature_cols, weak_cols) from the feature store or DATA_CSV."""
+    if FEATURE_STORE_DIR:
+        # the store schema says which columns are features and labels
+        schema = feature_store.read_schema(FEATURE_STORE_DIR)
+        feature_cols = schema["feature_cols"]
+        weak_cols = [c for c in schema["label_cols"] if c.startswith("weak_topic__")]
+        ids = ["user_id", "attempt_date"] + (["attempt_id"] if "attempt_id" in schema["dtypes"] else [])
+        df = feature_store.read_features(
+            FEATURE_STORE_DIR,
+            columns=ids + feature_cols + [target_reg, target_conf, target_cls] + weak_cols,
+        )
+    else:
+        df = pd.read_csv(DATA_CSV)
+        # weak topic columns follow pattern weak_topic__*
+        weak_cols = [c for c in df.columns if c.startswith("weak_topic__")]
+        # feature columns are numeric columns excluding targets + weak_cols
+        excluded = set([target_reg, target_conf, target_cls] + weak_cols + ignore_cols)
+        feature_cols = [c for c in df.columns if c not in excluded and df[c].dtype in [np.float64, np.float32, np.int64, np.int32]]
+    return df, feature_cols, weak_cols
+
+def data_watermark(df):
+    """
+    How far into the data a model was trained, so train/incremental.py knows what is
+    new: the latest attempt_date, or the row count for a CSV without dates. With
+    attempt ids the ones seen on that last day are kept too: the ETL may still add
+    attempts for the day, so the next run reads it again and skips only these.
+    """
+    if "attempt_date" in df.columns and df["attempt_date"].notna().any():
+        last = str(df["attempt_date"].max())
+        mark = {"attempt_date": last}
+        if "attempt_id" in df.columns:
+            seen = df.loc[df["attempt_date"].astype(str) == last, "attempt_id"].dropna()
+            mark["attempt_ids"] = sorted(int(i) for i in seen)
+        return mark
+    return {"rows": len(df)}
+
+# the watermark day's attempt ids, kept in their own bundle file so the manifest that
+# the server loads stays small
+WATERMARK_IDS_FILE = "watermark_attempt_ids.json"
+
+def publish_watermark(mark):
+    """The watermark as recorded in the manifest, and the bundle files holding its attempt ids."""
+    if "attempt_ids" not in mark:
+        return mark, {}
+    ids = mark["attempt_ids"]
+    recorded = {k: v for k, v in mark.items() if k != "attempt_ids"}
+    recorded.update(attempt_ids_file=WATERMARK_IDS_FILE, attempt_id_count=len(ids))
+    return recorded, {WATERMARK_IDS_FILE: ids}
+
+def load_watermark(manifest, version, registry_dir=MODEL_REGISTRY_DIR):
+    """A bundle's watermark with its attempt ids read back in (None when it records none)."""
+    mark = manifest.get("watermark")
+    if not mark or "attempt_ids_file" not in mark:
+        return mark
+    ids = read_bundle_file(version, mark["attempt_ids_file"], registry_dir)
+    mark = {k: v for k, v in mark.items() if k not in ("attempt_ids_file", "attempt_id_count")}
+    mark["attempt_ids"] = ids
+    return mark
+
+def split_frame(df, how="random", test_size=0.2, seed=42):
+    """Train/valid split; how="user" holds out whole users, so validation measures unseen learners."""
+    if how == "user":
+        splitter = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=seed)
+        train_idx, valid_idx = next(splitter.split(df, groups=df["user_id"]))
+        return df.iloc[train_idx], df.iloc[valid_idx]
+    if how != "random":
+        raise ValueError(f"Unknown split {how!r} (expected 'random' or 'user')")
+    return train_test_split(df, test_size=test_size, random_state=seed)
+
+def build_tasks(train_df, valid_df, weak_cols, num_class):
+    """One training task per target, all sharing the same binned feature data."""
+    def task(name, label, params, rounds, stopping):
+        return {
+            "name": name,
+            "params": params,
+            "y_train": train_df[label].to_numpy(),
+            "y_valid": valid_df[label].to_numpy(),
+            "num_boost_round": rounds,
+            "stopping_rounds": stopping,
+        }
+    tasks = [
+        task("quiz_score", target_reg, params_reg, 1000, 50),
+        task("skill_level", target_cls, dict(params_cls, num_class=num_class), 1000, 50),
+        task("confidence", target_conf, params_reg, 500, 30),
+    ]
+    # weak topic binary models (one per topic)
+    tasks += [task(col, col, params_weak, 500, 20) for col in weak_cols]
+    return tasks
+
+def main():
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    df, feature_cols, weak_cols = load_training_frame()
+    print("Feature cols:", feature_cols[:30])
+    print("Weak topic cols:", weak_cols)
+
+    train_df, valid_df = split_frame(df, TRAIN_SPLIT)
+    print(f"Split ({TRAIN_SPLIT}): {len(train_df)} train / {len(valid_df)} valid rows")
+
+    # bin the feature matrix once; every target loads the binned files with its own label
+    cache_dir = TRAIN_CACHE_DIR or tempfile.mkdtemp(prefix="quiz-train-")
+    try:
+        train_path, valid_path = save_binned(train_df[feature_cols], valid_df[feature_cols], cache_dir, feature_cols)
+        tasks = build_tasks(train_df, valid_df, weak_cols, num_class=len(df[target_cls].unique()))
+        for t in tasks:
+            t["train_path"], t["valid_path"] = train_path, valid_path
+        print(f"Training {len(tasks)} models with {min(TRAIN_WORKERS, len(tasks))} workers, {TRAIN_THREADS} threads")
+        trained = train_all(tasks, workers=TRAIN_WORKERS, thread_budget=TRAIN_THREADS)
+    finally:
+        if not TRAIN_CACHE_DIR:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    for name, (_, best_iter, best_score, seconds) in trained.items():
+        print(f"Trained {name}: best_iteration={best_iter} {best_score.get('valid_0', {})} ({seconds:.1f}s)")
+    boosters = {name: booster for name, (booster, _, _, _) in trained.items()}
+
+    # what the server's drift monitor compares live traffic with: training features and
+    # the models' outputs on the held-out rows
+    X_valid = valid_df[feature_cols].to_numpy(dtype=np.float64)
+    outputs = decode_outputs({name: b.predict(X_valid) for name, b in boosters.items()}, weak_cols)
+    baseline = build_baseline(df[feature_cols].to_numpy(dtype=np.float64), feature_cols, outputs, bins=DRIFT_BINS)
+
+    joblib.dump(boosters["quiz_score"], os.path.join(MODEL_DIR, "lgb_reg_quiz_score.pkl"))
+    joblib.dump(boosters["skill_level"], os.path.join(MODEL_DIR, "lgb_cls_skill_level.pkl"))
+    joblib.dump(boosters["confidence"], os.path.join(MODEL_DIR, "lgb_reg_confidence.pkl"))
+    for col in weak_cols:
+        joblib.dump(boosters[col], os.path.join(MODEL_DIR, f"lgb_weak_{col}.pkl"))
+    print(f"Saved {len(boosters)} models.")
+
+    # Save metadata (feature_cols, weak_cols)
+    meta = {"feature_cols": feature_cols, "weak_cols": weak_cols, "drift_baseline": baseline}
+    joblib.dump(meta, os.path.join(MODEL_DIR, "meta.pkl"))
+    print("Saved metadata.")
+
+    # Publish a versioned bundle (native model files + manifest) for the server to hot-swap to
+    watermark, files = publish_watermark(data_watermark(df))
+    extra = {"watermark": watermark, "training": {"mode": "full", "rows": len(df), "split": TRAIN_SPLIT},
+             "drift_baseline": baseline}
+    version = publish_bundle(boosters, feature_cols, weak_cols, registry_dir=MODEL_REGISTRY_DIR, extra=extra,
+                             data_files=files)
+    print(f"Published model version {version} to {MODEL_REGISTRY_DIR}")
+
+if __name__ == "__main__":
+    main()